@@ -0,0 +1,119 @@
+import argparse
+import time
+import threading
+
+import numpy as np
+import torch
+
+from utilities.constants import *
+from utilities.device import get_device
+from video2music import Video2music, BatchScheduler
+
+# Local stand-in client for the batched server mode of video2music.py.
+# Random features replace the feature extraction so that only the model forward is measured:
+# num_requests videos are sent from concurrency client threads, once one request at a time
+# (Video2music.generate path) and once through the BatchScheduler.
+
+def parse_load_test_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num_requests", type=int, default=32, help="Number of videos to generate for")
+    parser.add_argument("--concurrency", type=int, default=8, help="Number of client threads")
+    parser.add_argument("--max_batch_size", type=int, default=8, help="Max number of videos in one batched forward")
+    parser.add_argument("--max_wait_time", type=float, default=0.05, help="Max seconds a request waits for a batch")
+    parser.add_argument("--video_len", type=int, default=300, help="Video length in seconds (max 300)")
+    parser.add_argument("--skip_sequential", action="store_true", help="Only run the batched server mode")
+    # Video2music reads its own arguments with parse_known_args
+    return parser.parse_known_args()[0]
+
+def random_inputs(video2music, video_len):
+    # Same layout as Video2music.prepare, features padded to max_seq_video like get_*_feature
+    max_seq_video = video2music.max_seq_video
+    feature_semantic_list = torch.full((1, max_seq_video, 768), SEMANTIC_PAD)
+    feature_semantic_list[:, :video_len] = torch.randn(1, video_len, 768)
+    feature_scene_offset = torch.full((1, max_seq_video), SCENE_OFFSET_PAD)
+    feature_scene_offset[:, :video_len] = torch.randint(1, 10, (1, video_len)).float()
+    feature_motion = torch.zeros(1, max_seq_video, 512)
+    feature_motion[:, :video_len] = torch.rand(1, video_len, 512)
+    feature_emotion = torch.full((1, max_seq_video, 6), EMOTION_PAD)
+    feature_emotion[:, :video_len] = torch.softmax(torch.randn(1, video_len, 6), dim=-1)
+
+    is_minor = np.random.rand() < 0.5
+    primer, primer_root, primer_attr = video2music.parse_primer("Am" if is_minor else "C")
+    return {
+        "feature_semantic_list": feature_semantic_list.to(get_device()),
+        "feature_key": torch.tensor([1.0 if is_minor else 0.0]).to(get_device()),
+        "feature_scene_offset": feature_scene_offset.to(get_device()),
+        "feature_motion": feature_motion.to(get_device()),
+        "feature_emotion": feature_emotion.to(get_device()),
+        "primer": primer,
+        "primer_root": primer_root,
+        "primer_attr": primer_attr,
+        "key": "A minor" if is_minor else "C major",
+    }
+
+def run_clients(requests, concurrency, handle):
+    # Sends the requests from concurrency threads, returns the per-request latencies and the wall time
+    latencies = [0.0] * len(requests)
+    next_idx = [0]
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            with lock:
+                idx = next_idx[0]
+                next_idx[0] += 1
+            if idx >= len(requests):
+                return
+            start = time.perf_counter()
+            handle(requests[idx])
+            latencies[idx] = time.perf_counter() - start
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - start
+
+def print_stats(name, latencies, wall_time):
+    latencies = np.array(latencies)
+    print(name)
+    print("  requests:", len(latencies), "wall time: %.2fs" % wall_time, "throughput: %.2f videos/s" % (len(latencies) / wall_time))
+    print("  latency mean: %.3fs p50: %.3fs p90: %.3fs max: %.3fs" % (
+        latencies.mean(), np.percentile(latencies, 50), np.percentile(latencies, 90), latencies.max()))
+
+def main():
+    args = parse_load_test_args()
+    video2music = Video2music()
+    requests = [random_inputs(video2music, args.video_len) for _ in range(args.num_requests)]
+
+    if not args.skip_sequential:
+        model_lock = threading.Lock()
+
+        def handle_sequential(inputs):
+            with model_lock, torch.set_grad_enabled(False):
+                video2music.model.generate(feature_semantic_list=inputs["feature_semantic_list"],
+                                           feature_key=inputs["feature_key"],
+                                           feature_scene_offset=inputs["feature_scene_offset"],
+                                           feature_motion=inputs["feature_motion"],
+                                           feature_emotion=inputs["feature_emotion"],
+                                           primer=inputs["primer"],
+                                           primer_root=inputs["primer_root"],
+                                           primer_attr=inputs["primer_attr"],
+                                           target_seq_length=300, beam=0)
+                video2music.modelReg(inputs["feature_semantic_list"], inputs["feature_scene_offset"],
+                                     inputs["feature_motion"], inputs["feature_emotion"])
+
+        latencies, wall_time = run_clients(requests, args.concurrency, handle_sequential)
+        print_stats("One video per forward", latencies, wall_time)
+
+    scheduler = BatchScheduler(video2music, max_batch_size=args.max_batch_size, max_wait_time=args.max_wait_time)
+    latencies, wall_time = run_clients(requests, args.concurrency, lambda inputs: scheduler.submit(inputs).result())
+    scheduler.close()
+    print_stats("BatchScheduler (max_batch_size=%d, max_wait_time=%.3fs)" % (args.max_batch_size, args.max_wait_time),
+                latencies, wall_time)
+    print("  batches:", scheduler.num_batches, "mean batch size: %.2f" % (scheduler.num_requests / max(scheduler.num_batches, 1)))
+
+if __name__ == "__main__":
+    main()
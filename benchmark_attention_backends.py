@@ -0,0 +1,85 @@
+import argparse
+import time
+
+import torch
+
+from model.custom_transformer import CustomMultiheadAttention, AngleMultiheadAttention, \
+    DifferentialMultiheadAttention, set_attention_backend
+from model.grouped_query_attention import MultiheadGQA
+from model.rotate_operation import RotaryPositionalEmbeddings
+
+# Equivalence check and latency of the attention backends ('reference' vs 'sdpa', see
+# set_attention_backend) of the custom attention modules, with the RoPE of the models.
+# Self-attention with the causal mask of the decoder, sequence first like the transformer layers.
+
+def parse_benchmark_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--d_model", type=int, default=512, help="Model dimension")
+    parser.add_argument("--nhead", type=int, default=8, help="Number of heads")
+    parser.add_argument("--kv_heads", type=int, default=2, help="Number of key/value heads of MultiheadGQA")
+    parser.add_argument("--batch_size", type=int, default=1, help="Batch size")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[32, 128, 300], help="Sequence lengths")
+    parser.add_argument("--repeat", type=int, default=50, help="Timed iterations per setting")
+    parser.add_argument("--tolerance", type=float, default=1e-4, help="Max allowed |reference - sdpa|")
+    parser.add_argument("--device", type=str, default="cpu", help="cpu or cuda")
+    return parser.parse_args()
+
+def build_modules(args, max_len):
+    RoPE = RotaryPositionalEmbeddings(args.d_model, max_len)
+    RoPE_diff = RotaryPositionalEmbeddings(args.d_model * 2, max_len)
+    return {
+        "CustomMultiheadAttention": CustomMultiheadAttention(args.d_model, args.nhead, RoPE=RoPE),
+        "AngleMultiheadAttention": AngleMultiheadAttention(args.d_model, args.nhead, RoPE=RoPE),
+        "DifferentialMultiheadAttention": DifferentialMultiheadAttention(args.d_model, args.nhead, RoPE=RoPE_diff, depth=1),
+        "MultiheadGQA": MultiheadGQA(args.d_model, args.nhead, args.kv_heads, RoPE=RoPE),
+    }
+
+def timeit(fn, repeat, device):
+    for _ in range(3):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeat * 1000
+
+def main():
+    args = parse_benchmark_args()
+    device = torch.device(args.device)
+    torch.manual_seed(0)
+
+    modules = build_modules(args, max(args.lengths))
+    failed = False
+    print("%32s %8s %16s %12s %9s %12s" % ("module", "length", "reference (ms)", "sdpa (ms)", "speedup", "max |diff|"))
+    with torch.set_grad_enabled(False):
+        for name, attn in modules.items():
+            attn = attn.to(device).eval()
+            for length in args.lengths:
+                x = torch.randn(length, args.batch_size, args.d_model, device=device)
+                mask = torch.triu(torch.full((length, length), float("-inf"), device=device), diagonal=1)
+                if isinstance(attn, MultiheadGQA):
+                    run = lambda: attn(x, x, x, is_causal=True)[0]
+                else:
+                    run = lambda: attn(x, x, x, attn_mask=mask)[0]
+
+                set_attention_backend(attn, "reference")
+                out_reference = run()
+                reference_ms = timeit(run, args.repeat, device)
+
+                set_attention_backend(attn, "sdpa")
+                out_sdpa = run()
+                sdpa_ms = timeit(run, args.repeat, device)
+
+                diff = (out_reference - out_sdpa).abs().max().item()
+                failed = failed or diff > args.tolerance
+                print("%32s %8d %16.3f %12.3f %8.2fx %12.2e" % (name, length, reference_ms, sdpa_ms, reference_ms / sdpa_ms, diff))
+
+    if failed:
+        raise SystemExit("sdpa backend differs from the reference by more than %g" % args.tolerance)
+    print("sdpa backend matches the reference (tolerance %g)" % args.tolerance)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import argparse
+import io
+import time
+
+import numpy as np
+from midiutil import MIDIFile
+
+from utilities.chord_events import chord_pitch_table, note_events, split_tracks, add_note_events
+
+# Note events of the rendered tracks: the former per-chord addChord ladder (reference, copied below)
+# vs the table-driven utilities/chord_events.py, on random voiced chords with the instrument / arpeggio /
+# velocity rules of Video2music.render. Checks that every written MIDI file is byte-identical.
+
+ARPEGGIO_INSTRUMENTS = [3, 7, 8, 11, 14, 27, 31, 37, 38, 39]
+LOW_VELOCITY_INSTRUMENTS = [14]
+
+def parse_benchmark_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n_chords", type=int, default=300, help="Chords per video")
+    parser.add_argument("-n_inst", type=int, default=40, help="Instrument tracks")
+    parser.add_argument("-duration", type=int, default=2, help="Chord duration (beats)")
+    parser.add_argument("-repeat", type=int, default=5, help="Timed renders per implementation")
+    parser.add_argument("-seed", type=int, default=0, help="Random seed")
+    return parser.parse_args()
+
+def add_chord_reference(midifile, chord, chord_offset, density_val, time, duration, velocity, arpeggio_chord=False):
+    # addChord of video2music.py before the table-driven engine (trans_val was always 0)
+    first_velo = 1.1
+    second_velo = 0.95
+    third_velo = 0.98
+    fourth_velo = 1.0
+    fifth_velo = 0.95
+    diminish_velo = 0.6
+
+    if arpeggio_chord:
+        if density_val == 0:
+            if len(chord) >= 4:
+                if chord_offset % 2 == 0:
+                    midifile.addNote(0, 0, chord[0], time + 0, duration,  int(velocity*first_velo))
+                    midifile.addNote(0, 0, chord[1], time + 1, duration,  int(velocity*second_velo))
+                else:
+                    midifile.addNote(0, 0, chord[2], time + 0, duration,  int(velocity*third_velo))
+                    midifile.addNote(0, 0, chord[3], time + 1, duration,  int(velocity*fourth_velo))
+                if len(chord) == 5:
+                    midifile.addNote(0, 0, chord[4], time + 2, duration,  int(velocity*fifth_velo))
+        elif density_val == 1:
+            if len(chord) >= 4:
+                if chord_offset % 2 == 0:
+                    midifile.addNote(0, 0, chord[0], time + 0, duration,  int(velocity*first_velo))
+                    midifile.addNote(0, 0, chord[1], time + 0.5, duration,  int(velocity*second_velo))
+                    midifile.addNote(0, 0, chord[2], time + 1, duration,  int(velocity*third_velo))
+                else:
+                    midifile.addNote(0, 0, chord[3], time + 0, duration,  int(velocity*fourth_velo))
+                    midifile.addNote(0, 0, chord[1], time + 0.5, duration,  int(velocity*second_velo))
+                    midifile.addNote(0, 0, chord[2], time + 1, duration,  int(velocity*third_velo))
+                if len(chord) == 5:
+                    midifile.addNote(0, 0, chord[4], time + 1.5, duration,  int(velocity*fifth_velo))
+        elif density_val == 2:
+            if len(chord) >= 4:
+                if chord_offset % 2 == 0:
+                    midifile.addNote(0, 0, chord[0], time + 0, duration,  int(velocity*first_velo))
+                    midifile.addNote(0, 0, chord[1], time + 0.5, duration,  int(velocity*second_velo))
+                    midifile.addNote(0, 0, chord[2], time + 1, duration,  int(velocity*third_velo))
+                    midifile.addNote(0, 0, chord[3], time + 1.5, duration,  int(velocity*fourth_velo))
+                else:
+                    midifile.addNote(0, 0, chord[2], time + 0, duration,  int(velocity*third_velo))
+                    midifile.addNote(0, 0, chord[1], time + 0.5, duration,  int(velocity*second_velo))
+                    midifile.addNote(0, 0, chord[2], time + 1, duration,  int(velocity*third_velo))
+                    midifile.addNote(0, 0, chord[3], time + 1.5, duration,  int(velocity*fourth_velo))
+                if len(chord) == 5:
+                    midifile.addNote(0, 0, chord[4], time + 2, duration,  int(velocity*fifth_velo))
+        elif density_val == 3:
+            if len(chord) >= 4:
+                if chord_offset % 2 == 0:
+                    midifile.addNote(0, 0, chord[0], time + 0, duration,  int(velocity*first_velo))
+                    midifile.addNote(0, 0, chord[1], time + 0.25, duration,  int(velocity*second_velo))
+                    midifile.addNote(0, 0, chord[2], time + 0.5, duration,  int(velocity*third_velo))
+                    midifile.addNote(0, 0, chord[1], time + 0.75, duration,  int(velocity*second_velo))
+                    midifile.addNote(0, 0, chord[3], time + 1, duration,  int(velocity*fourth_velo))
+                    midifile.addNote(0, 0, chord[2], time + 1.5, duration,  int(velocity*third_velo))
+                else:
+                    midifile.addNote(0, 0, chord[1], time + 0, duration,  int(velocity*second_velo))
+                    midifile.addNote(0, 0, chord[0], time + 0.25, duration,  int(velocity*first_velo))
+                    midifile.addNote(0, 0, chord[1], time + 0.5, duration,  int(velocity*second_velo))
+                    midifile.addNote(0, 0, chord[2], time + 0.75, duration,  int(velocity*third_velo))
+                    midifile.addNote(0, 0, chord[3], time + 1, duration,  int(velocity*fourth_velo))
+                    midifile.addNote(0, 0, chord[2], time + 1.5, duration,  int(velocity*third_velo))
+                if len(chord) == 5:
+                    midifile.addNote(0, 0, chord[4], time + 2, duration,  int(velocity*fifth_velo))
+        elif density_val == 4:
+            if len(chord) >= 4:
+                if chord_offset % 2 == 0:
+                    midifile.addNote(0, 0, chord[0], time + 0, duration,  int(velocity*first_velo))
+                    midifile.addNote(0, 0, chord[1], time + 0.25, duration,  int(velocity*second_velo))
+                    midifile.addNote(0, 0, chord[2], time + 0.5, duration,  int(velocity*third_velo))
+                    midifile.addNote(0, 0, chord[1], time + 0.75, duration,  int(velocity*second_velo))
+                    midifile.addNote(0, 0, chord[3], time + 1, duration,  int(velocity*fourth_velo))
+                    midifile.addNote(0, 0, chord[2], time + 1.25, duration,  int(velocity*third_velo))
+                    midifile.addNote(0, 0, chord[1], time + 1.5, duration,  int(velocity*second_velo))
+                    midifile.addNote(0, 0, chord[2], time + 1.75, duration,  int(velocity*third_velo))
+                else:
+                    midifile.addNote(0, 0, chord[1], time + 0, duration,  int(velocity*second_velo))
+                    midifile.addNote(0, 0, chord[0], time + 0.25, duration,  int(velocity*first_velo))
+                    midifile.addNote(0, 0, chord[1], time + 0.5, duration,  int(velocity*second_velo))
+                    midifile.addNote(0, 0, chord[2], time + 0.75, duration,  int(velocity*third_velo))
+                    midifile.addNote(0, 0, chord[3], time + 1, duration,  int(velocity*fourth_velo))
+                    midifile.addNote(0, 0, chord[2], time + 1.25, duration,  int(velocity*third_velo))
+                    midifile.addNote(0, 0, chord[1], time + 1.5, duration,  int(velocity*second_velo))
+                    midifile.addNote(0, 0, chord[2], time + 1.75, duration,  int(velocity*third_velo))
+                if len(chord) == 5:
+                    midifile.addNote(0, 0, chord[4], time + 2, duration,  int(velocity*fifth_velo))
+    else:
+        if len(chord) >= 4:
+            midifile.addNote(0, 0, chord[0], time, duration, int(velocity*first_velo*diminish_velo))
+            midifile.addNote(0, 0, chord[1], time, duration, int(velocity*second_velo*diminish_velo))
+            midifile.addNote(0, 0, chord[2], time, duration, int(velocity*third_velo*diminish_velo))
+            midifile.addNote(0, 0, chord[3], time, duration, int(velocity*fourth_velo*diminish_velo))
+            if len(chord) == 5:
+                midifile.addNote(0, 0, chord[4], time, duration, int(velocity*fifth_velo*diminish_velo))
+
+def random_song(args):
+    rng = np.random.default_rng(args.seed)
+    chords = []
+    for _ in range(args.n_chords):
+        n_voices = rng.choice([0, 3, 4, 5], p=[0.1, 0.1, 0.5, 0.3])
+        chords.append(sorted(rng.integers(36, 84, n_voices).tolist()))
+    # Runs of equal chord symbols -> offsets 0, 1, 2, ... within a run
+    offsets = []
+    for _ in range(args.n_chords):
+        offsets.append(offsets[-1] + 1 if offsets and rng.random() < 0.6 else 0)
+    densities = rng.integers(0, 5, args.n_chords).tolist()
+    velocities = rng.integers(48, 115, args.n_chords).tolist()
+    emotions = rng.integers(0, 6, args.n_chords).tolist()
+    inst = rng.random((args.n_chords, args.n_inst)) < 0.3
+    return chords, offsets, densities, velocities, emotions, inst
+
+def new_tracks(n_inst):
+    midis = []
+    for _ in range(n_inst + 1):
+        midi = MIDIFile(1)
+        midi.addTempo(0, 0, 120)
+        midis.append(midi)
+    return midis
+
+def render_reference(song, args):
+    chords, offsets, densities, velocities, emotions, inst = song
+    generated_midi, *midi_list = new_tracks(args.n_inst)
+    for inst_id in range(args.n_inst):
+        for i, chord in enumerate(chords):
+            if inst_id == 0:
+                add_chord_reference(generated_midi, chord, offsets[i], densities[i], i * args.duration,
+                                    args.duration, velocities[i], arpeggio_chord=True)
+            if inst[i, inst_id]:
+                arpeggio_chord = inst_id in ARPEGGIO_INSTRUMENTS or emotions[i] in (0, 1, 2)
+                velocity = velocities[i] * (1.15 if inst_id in LOW_VELOCITY_INSTRUMENTS else 1.0)
+                add_chord_reference(midi_list[inst_id], chord, offsets[i], densities[i], i * args.duration,
+                                    args.duration, velocity, arpeggio_chord=arpeggio_chord)
+    return [generated_midi] + midi_list
+
+def table_events(song, args):
+    chords, offsets, densities, velocities, emotions, inst = song
+    pitches, lengths = chord_pitch_table(chords)
+    velocities = np.asarray(velocities, dtype=np.float64)
+    inst_ids = np.arange(args.n_inst)
+    arpeggio = np.isin(emotions, (0, 1, 2)) | np.isin(inst_ids, ARPEGGIO_INSTRUMENTS)[:, None]
+    velocity = velocities * np.where(np.isin(inst_ids, LOW_VELOCITY_INSTRUMENTS), 1.15, 1.0)[:, None]
+    generated = note_events(pitches, lengths, offsets, densities, velocities, True, args.duration)
+    events = note_events(pitches, lengths, offsets, densities, velocity, arpeggio, args.duration, active=inst.T)
+    return generated, split_tracks(events, args.n_inst)
+
+def render_table(song, args):
+    generated_midi, *midi_list = new_tracks(args.n_inst)
+    generated, tracks = table_events(song, args)
+    add_note_events(generated_midi, generated, args.duration)
+    for midi, events in zip(midi_list, tracks):
+        add_note_events(midi, events, args.duration)
+    return [generated_midi] + midi_list
+
+class NullMIDI:
+    # Drops the notes, times the note event computation alone
+    def addNote(self, *args):
+        pass
+
+def reference_events(song, args):
+    chords, offsets, densities, velocities, emotions, inst = song
+    midi = NullMIDI()
+    for inst_id in range(args.n_inst):
+        for i, chord in enumerate(chords):
+            if inst_id == 0:
+                add_chord_reference(midi, chord, offsets[i], densities[i], i * args.duration,
+                                    args.duration, velocities[i], arpeggio_chord=True)
+            if inst[i, inst_id]:
+                arpeggio_chord = inst_id in ARPEGGIO_INSTRUMENTS or emotions[i] in (0, 1, 2)
+                velocity = velocities[i] * (1.15 if inst_id in LOW_VELOCITY_INSTRUMENTS else 1.0)
+                add_chord_reference(midi, chord, offsets[i], densities[i], i * args.duration,
+                                    args.duration, velocity, arpeggio_chord=arpeggio_chord)
+
+def midi_bytes(midi):
+    buffer = io.BytesIO()
+    midi.writeFile(buffer)
+    return buffer.getvalue()
+
+def timeit(render, song, args):
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        render(song, args)
+    return (time.perf_counter() - start) / args.repeat * 1000
+
+def main():
+    args = parse_benchmark_args()
+    song = random_song(args)
+
+    reference = [midi_bytes(midi) for midi in render_reference(song, args)]
+    table = [midi_bytes(midi) for midi in render_table(song, args)]
+    mismatches = [i for i, (a, b) in enumerate(zip(reference, table)) if a != b]
+
+    reference_ms = timeit(reference_events, song, args)
+    table_ms = timeit(table_events, song, args)
+    reference_total_ms = timeit(render_reference, song, args)
+    table_total_ms = timeit(render_table, song, args)
+    print("%d chords x %d instruments, %d MIDI files" % (args.n_chords, args.n_inst, len(reference)))
+    print("%12s %18s %9s %24s %9s" % ("", "note events (ms)", "speedup", "events + addNote (ms)", "speedup"))
+    print("%12s %18.2f %9s %24.2f %9s" % ("addChord", reference_ms, "-", reference_total_ms, "-"))
+    print("%12s %18.2f %8.2fx %24.2f %8.2fx" % ("table", table_ms, reference_ms / table_ms,
+                                                 table_total_ms, reference_total_ms / table_total_ms))
+
+    if mismatches:
+        raise SystemExit("MIDI files differ from the reference: %s" % mismatches)
+    print("All MIDI files are byte-identical")
+
+if __name__ == "__main__":
+    main()
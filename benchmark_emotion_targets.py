@@ -0,0 +1,105 @@
+import argparse
+import time
+
+import torch
+
+from utilities.constants import *
+from dataset.vevo_dataset import VevoDataset, emotion_chord_targets
+
+# Benchmark of the emotion -> chord target map (tgt_emotion) built in VevoDataset.createSample:
+# the former per-time-step loop over hand-built tensors vs the (8, 159) lookup table gather.
+# With -dataset_root the whole createSample is timed per sample as well.
+
+def parse_benchmark_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n_samples", type=int, default=200, help="Number of synthetic samples")
+    parser.add_argument("-dataset_root", type=str, default=None, help="Also time createSample on this dataset (e.g. ./dataset/)")
+    parser.add_argument("-split", type=str, default="test", help="Split used with -dataset_root")
+    return parser.parse_args()
+
+def emotion_chord_targets_loop(feature_emotion_argmax, feature_chord):
+    # Reference: the previous implementation of createSample
+    a0 = [0]+[1,0,1,0,0,0,0,0,0,0,1,0,0]*12+[0,0]
+    a1 = [0]+[0,1,0,1,0,0,0,1,0,1,0,0,0]*12+[0,0]
+    a2 = [0]+[0,1,1,1,0,0,0,0,0,0,1,0,0]*12+[0,0]
+    a3 = [0]+[0,0,0,1,1,1,0,0,0,0,0,0,0]*12+[0,0]
+    a4 = [0]+[1,0,0,0,0,0,0,0,1,0,0,0,1]*12+[0,0]
+    a5 = [0]+[0,0,0,0,0,0,0,0,0,0,0,0,0]*12+[0,0]
+
+    aend = [0]+[0,0,0,0,0,0,0,0,0,0,0,0,0]*12+[1,0]
+    apad = [0]+[0,0,0,0,0,0,0,0,0,0,0,0,0]*12+[0,1]
+
+    a0_tensor = torch.tensor(a0)
+    a1_tensor = torch.tensor(a1)
+    a2_tensor = torch.tensor(a2)
+    a3_tensor = torch.tensor(a3)
+    a4_tensor = torch.tensor(a4)
+    a5_tensor = torch.tensor(a5)
+
+    aend_tensor = torch.tensor(aend)
+    apad_tensor = torch.tensor(apad)
+
+    mapped_tensor = torch.zeros((300, 159))
+    for i, val in enumerate(feature_emotion_argmax):
+        if feature_chord[i] == CHORD_PAD:
+            mapped_tensor[i] = apad_tensor
+        elif feature_chord[i] == CHORD_END:
+            mapped_tensor[i] = aend_tensor
+        elif val == 0:
+            mapped_tensor[i] = a0_tensor
+        elif val == 1:
+            mapped_tensor[i] = a1_tensor
+        elif val == 2:
+            mapped_tensor[i] = a2_tensor
+        elif val == 3:
+            mapped_tensor[i] = a3_tensor
+        elif val == 4:
+            mapped_tensor[i] = a4_tensor
+        elif val == 5:
+            mapped_tensor[i] = a5_tensor
+    return mapped_tensor
+
+def synthetic_samples(n_samples):
+    samples = []
+    for _ in range(n_samples):
+        length = torch.randint(30, 300, (1,)).item()
+        feature_chord = torch.full((300,), CHORD_PAD, dtype=torch.long)
+        feature_chord[:length] = torch.randint(0, CHORD_END, (length,))
+        if length < 300:
+            feature_chord[length] = CHORD_END
+        feature_emotion_argmax = torch.argmax(torch.rand(300, 6), dim=1)
+        samples.append((feature_emotion_argmax, feature_chord))
+    return samples
+
+def main():
+    args = parse_benchmark_args()
+    samples = synthetic_samples(args.n_samples)
+
+    for feature_emotion_argmax, feature_chord in samples:
+        assert torch.equal(emotion_chord_targets_loop(feature_emotion_argmax, feature_chord),
+                           emotion_chord_targets(feature_emotion_argmax, feature_chord))
+    print("Outputs identical on", args.n_samples, "samples")
+
+    start = time.perf_counter()
+    for feature_emotion_argmax, feature_chord in samples:
+        emotion_chord_targets_loop(feature_emotion_argmax, feature_chord)
+    loop_ms = (time.perf_counter() - start) / args.n_samples * 1000
+
+    start = time.perf_counter()
+    for feature_emotion_argmax, feature_chord in samples:
+        emotion_chord_targets(feature_emotion_argmax, feature_chord)
+    table_ms = (time.perf_counter() - start) / args.n_samples * 1000
+
+    print("tgt_emotion per sample: loop %.3f ms, lookup table %.3f ms (%.1fx)" % (loop_ms, table_ms, loop_ms / table_ms))
+
+    if args.dataset_root is not None:
+        dataset = VevoDataset(dataset_root=args.dataset_root, split=args.split, cache=False, lazy=True)
+        n = min(args.n_samples, dataset.num_samples)
+        start = time.perf_counter()
+        for i in range(n):
+            dataset.createSample(i)
+        sample_ms = (time.perf_counter() - start) / n * 1000
+        print("createSample per sample: %.3f ms (the loop accounted for about %.3f ms more)" % (sample_ms, loop_ms - table_ms))
+
+if __name__ == "__main__":
+    main()
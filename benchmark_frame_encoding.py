@@ -0,0 +1,89 @@
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+import torch
+import torchvision.models as models
+
+from utilities.frame_encoding import preprocess_frames, encode_batched
+from utilities.video_loader import read_frames_1fps
+
+# Frames per second of the batched frame encoding (utilities/frame_encoding.py) per batch size,
+# for the CLIP ViT-L/14@336px image encoder (semantic / emotion features) and MaxViT-T (motion).
+# The 1-fps frames are decoded from the video once (read_frames_1fps), every run preprocesses and
+# encodes them like Video2music. Batch size 1 with 0 workers is the former one-frame-at-a-time path, the
+# other batch sizes (with -num_workers preprocessing threads) are compared against it. Without -video, a 640x360 test video of -n_frames seconds is generated.
+
+def parse_benchmark_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-video", type=str, default=None, help="Video file (e.g. dataset/vevo/001.mp4)")
+    parser.add_argument("-n_frames", type=int, default=64, help="Seconds (1-fps frames) of the test video without -video")
+    parser.add_argument("-extractors", type=str, nargs="+", default=["clip", "maxvit"], help="clip and / or maxvit")
+    parser.add_argument("-batch_sizes", type=int, nargs="+", default=[1, 4, 16, 32], help="Batch sizes")
+    parser.add_argument("-num_workers", type=int, default=4, help="Preprocessing threads of the batched runs")
+    parser.add_argument("-device", type=str, default="cuda" if torch.cuda.is_available() else "cpu", help="cpu or cuda")
+    return parser.parse_args()
+
+def synthetic_video(video_path, n_frames):
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-f", "lavfi", "-i", "testsrc=size=640x360:rate=25",
+           "-t", str(n_frames), "-pix_fmt", "yuv420p", video_path]
+    subprocess.run(cmd, check=True)
+
+def load_extractor(name, device):
+    if name == "clip":
+        import clip
+        model, preprocess = clip.load("ViT-L/14@336px", device=device)
+        return model.encode_image, preprocess
+    model = models.maxvit_t(weights=models.MaxVit_T_Weights.DEFAULT)
+    model.classifier = torch.nn.Sequential(
+        torch.nn.AdaptiveAvgPool2d(1),
+        torch.nn.Flatten()
+    )
+    model = model.to(device).eval()
+    return model, models.MaxVit_T_Weights.IMAGENET1K_V1.transforms()
+
+def run(encode, frames, transform, device, batch_size, num_workers):
+    start = time.perf_counter()
+    images = preprocess_frames(frames, transform, num_workers=num_workers)
+    features = torch.stack(list(encode_batched(encode, images, device, batch_size=batch_size)))
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return features, len(frames) / (time.perf_counter() - start)
+
+def main():
+    args = parse_benchmark_args()
+    device = torch.device(args.device)
+
+    tmp_dir = None
+    video_path = args.video
+    if video_path is None:
+        tmp_dir = tempfile.mkdtemp(prefix="frames_")
+        video_path = os.path.join(tmp_dir, "video.mp4")
+        synthetic_video(video_path, args.n_frames)
+
+    try:
+        start = time.perf_counter()
+        frames = list(read_frames_1fps(video_path))
+        print("decoded %d frames in %.2fs" % (len(frames), time.perf_counter() - start))
+
+        print("%8s %12s %9s %10s %9s %12s" % ("model", "batch size", "workers", "frames/s", "speedup", "max |diff|"))
+        for name in args.extractors:
+            encode, transform = load_extractor(name, device)
+            # Warm-up
+            run(encode, frames[:2], transform, device, 2, 0)
+
+            reference, reference_fps = run(encode, frames, transform, device, 1, 0)
+            print("%8s %12d %9d %10.2f %8.2fx %12s" % (name, 1, 0, reference_fps, 1.0, "-"))
+            for batch_size in args.batch_sizes:
+                features, fps = run(encode, frames, transform, device, batch_size, args.num_workers)
+                diff = (features - reference).abs().max().item()
+                print("%8s %12d %9d %10.2f %8.2fx %12.2e" % (name, batch_size, args.num_workers, fps, fps / reference_fps, diff))
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
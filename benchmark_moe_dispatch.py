@@ -0,0 +1,67 @@
+import argparse
+import time
+
+import torch
+from torch.nn import functional as F
+from torch.nn.modules.transformer import _get_clones
+
+from model.moe import GLUExpert, stack_glu_experts, dispatch_experts, dispatch_experts_loop
+
+# Microbenchmark of the MoE expert dispatch in model/moe.py:
+# per-expert loop (dispatch_experts_loop) vs sorted / batched matmul dispatch (dispatch_experts),
+# for several token counts and numbers of experts per token (k). Runs in eval mode, like generation.
+
+def parse_benchmark_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--d_model", type=int, default=512, help="Model dimension")
+    parser.add_argument("--d_ff", type=int, default=1024, help="Expert hidden dimension")
+    parser.add_argument("--n_experts", type=int, default=6, help="Number of experts")
+    parser.add_argument("--tokens", type=int, nargs="+", default=[1, 8, 32, 300, 1200], help="Token counts (seq_len * batch)")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 2, 4], help="Experts per token")
+    parser.add_argument("--repeat", type=int, default=50, help="Timed iterations per setting")
+    parser.add_argument("--device", type=str, default="cpu", help="cpu or cuda")
+    return parser.parse_args()
+
+def timeit(fn, repeat, device):
+    for _ in range(3):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeat * 1000
+
+def main():
+    args = parse_benchmark_args()
+    device = torch.device(args.device)
+    torch.manual_seed(0)
+
+    experts = _get_clones(GLUExpert(args.d_model, args.d_ff), args.n_experts).to(device).eval()
+    gate = torch.nn.Linear(args.d_model, args.n_experts).to(device).eval()
+    dropout = torch.nn.Dropout(0.1).eval()
+
+    print("%8s %3s %12s %12s %9s %12s" % ("tokens", "k", "loop (ms)", "fused (ms)", "speedup", "max |diff|"))
+    with torch.set_grad_enabled(False):
+        stacked = stack_glu_experts(experts)
+        for n_tokens in args.tokens:
+            for k in args.k:
+                if k > args.n_experts:
+                    continue
+                # (seq_len, batch_size, d_model) like the transformer layers
+                x = torch.randn(n_tokens, 1, args.d_model, device=device)
+                weights, selected_experts = torch.topk(gate(x), k)
+                weights = F.softmax(weights, dim=-1, dtype=torch.float)
+
+                run_loop = lambda: dispatch_experts_loop(x, weights, selected_experts, experts, dropout, torch.zeros_like(x))
+                run_fused = lambda: dispatch_experts(x, weights, selected_experts, stacked, dropout, torch.zeros_like(x))
+
+                diff = (run_loop() - run_fused()).abs().max().item()
+                loop_ms = timeit(run_loop, args.repeat, device)
+                fused_ms = timeit(run_fused, args.repeat, device)
+                print("%8d %3d %12.3f %12.3f %8.2fx %12.2e" % (n_tokens, k, loop_ms, fused_ms, loop_ms / fused_ms, diff))
+
+if __name__ == "__main__":
+    main()
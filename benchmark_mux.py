@@ -0,0 +1,56 @@
+import argparse
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+
+from utilities.video_mux import media_duration, mux_copy, mux_moviepy
+
+# Wall time of the output video step of Video2music.render per mux mode (utilities/video_mux.py):
+# copy (video stream copied, audio encoded) vs moviepy (every frame re-encoded with libx264).
+# Without -video / -audio, a test pattern video and a sine tone are generated with ffmpeg.
+
+def parse_benchmark_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-video", type=str, default=None, help="Input video (default: generated)")
+    parser.add_argument("-audio", type=str, default=None, help="Generated audio, e.g. output/output.flac (default: generated)")
+    parser.add_argument("-seconds", type=int, default=60, help="Length of the generated inputs")
+    parser.add_argument("-size", type=str, default="1280x720", help="Frame size of the generated video")
+    parser.add_argument("-modes", type=str, nargs="+", default=["moviepy", "copy"], help="Modes, the speedup is relative to the first")
+    return parser.parse_args()
+
+def synthetic_inputs(tmp_dir, seconds, size):
+    video = os.path.join(tmp_dir, "input.mp4")
+    audio = os.path.join(tmp_dir, "input.flac")
+    subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=30",
+                    "-t", str(seconds), "-c:v", "libx264", "-pix_fmt", "yuv420p", video], check=True)
+    # Audio a bit longer than the video, as the rendered music usually is
+    subprocess.run(["ffmpeg", "-y", "-loglevel", "error", "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=44100",
+                    "-ac", "2", "-t", str(seconds + 5), audio], check=True)
+    return video, audio
+
+def main():
+    args = parse_benchmark_args()
+    tmp_dir = tempfile.mkdtemp(prefix="mux_")
+    try:
+        video, audio = args.video, args.audio
+        if video is None or audio is None:
+            video, audio = synthetic_inputs(tmp_dir, args.seconds, args.size)
+        duration = min(media_duration(video), media_duration(audio))
+
+        mux = {"copy": mux_copy, "moviepy": mux_moviepy}
+        times = {}
+        print("%8s %10s %12s %12s" % ("mode", "time (s)", "speedup", "output (s)"))
+        for mode in args.modes:
+            output = os.path.join(tmp_dir, f"output_{mode}.mp4")
+            start = time.perf_counter()
+            mux[mode](video, audio, output, duration)
+            times[mode] = time.perf_counter() - start
+            speedup = times[args.modes[0]] / times[mode]
+            print("%8s %10.2f %11.2fx %12.2f" % (mode, times[mode], speedup, media_duration(output)))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import argparse
+import time
+
+import torch
+
+import model.rpr as rpr
+from model.rpr import TransformerDecoderLayerRPR, ATTN_SELF, ATTN_ENCDEC, ATTN_GENERAL
+
+# Per-layer latency of the RPR decoder layer (model/rpr.py) for several chord sequence lengths:
+# the former attention path (skew mask rebuilt on every call, self- vs cross-attention found with
+# torch.equal) vs the cached skew masks and the explicit attention kind. Runs in eval mode.
+
+def parse_benchmark_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--d_model", type=int, default=512, help="Model dimension")
+    parser.add_argument("--nhead", type=int, default=8, help="Number of heads")
+    parser.add_argument("--d_ff", type=int, default=1024, help="Feedforward dimension")
+    parser.add_argument("--batch_size", type=int, default=1, help="Batch size")
+    parser.add_argument("--memory_len", type=int, default=300, help="Length of the video memory")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[32, 64, 128, 256, 300], help="Sequence lengths")
+    parser.add_argument("--repeat", type=int, default=50, help="Timed iterations per setting")
+    parser.add_argument("--device", type=str, default="cpu", help="cpu or cuda")
+    return parser.parse_args()
+
+def skew_reference(qe):
+    # Previous _skew, builds the mask on every call
+    sz = qe.shape[1]
+    mask = (torch.triu(torch.ones(sz, sz).to(qe.device)) == 1).float().flip(0)
+
+    qe = mask * qe
+    qe = torch.nn.functional.pad(qe, (1,0, 0,0, 0,0))
+    qe = torch.reshape(qe, (qe.shape[0], qe.shape[2], qe.shape[1]))
+    return qe[:, 1:, :]
+
+class ReferenceAttention(object):
+    # Restores the previous behaviour of model.rpr inside a with block
+    def __enter__(self):
+        self.skew = rpr._skew
+        self.forward = rpr.MultiheadAttentionRPR.forward
+        forward = self.forward
+
+        def forward_reference(attn, query, key, value, attn_kind=None, **kwargs):
+            # Ignore the given attention kind, compare the activations like before
+            qkv_same = torch.equal(query, key) and torch.equal(key, value)
+            kv_same = torch.equal(key, value)
+            attn_kind = ATTN_SELF if qkv_same else (ATTN_ENCDEC if kv_same else ATTN_GENERAL)
+            return forward(attn, query, key, value, attn_kind=attn_kind, **kwargs)
+
+        rpr._skew = skew_reference
+        rpr.MultiheadAttentionRPR.forward = forward_reference
+        return self
+
+    def __exit__(self, *exc):
+        rpr._skew = self.skew
+        rpr.MultiheadAttentionRPR.forward = self.forward
+
+def timeit(fn, repeat, device):
+    for _ in range(3):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeat * 1000
+
+def main():
+    args = parse_benchmark_args()
+    device = torch.device(args.device)
+    torch.manual_seed(0)
+
+    layer = TransformerDecoderLayerRPR(args.d_model, args.nhead, args.d_ff, 0.1, er_len=max(args.lengths)).to(device).eval()
+
+    print("%8s %16s %16s %9s %12s" % ("length", "reference (ms)", "cached (ms)", "speedup", "max |diff|"))
+    with torch.set_grad_enabled(False):
+        for length in args.lengths:
+            tgt = torch.randn(length, args.batch_size, args.d_model, device=device)
+            memory = torch.randn(args.memory_len, args.batch_size, args.d_model, device=device)
+            tgt_mask = torch.triu(torch.full((length, length), float("-inf"), device=device), diagonal=1)
+
+            run = lambda: layer(tgt, memory, tgt_mask=tgt_mask)
+            out = run()
+            with ReferenceAttention():
+                out_reference = run()
+                reference_ms = timeit(run, args.repeat, device)
+            cached_ms = timeit(run, args.repeat, device)
+
+            diff = (out - out_reference).abs().max().item()
+            print("%8d %16.3f %16.3f %8.2fx %12.2e" % (length, reference_ms, cached_ms, reference_ms / cached_ms, diff))
+
+if __name__ == "__main__":
+    main()
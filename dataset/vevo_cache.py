@@ -0,0 +1,139 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+import torch
+
+from tqdm import tqdm
+
+# Packed, memory-mapped store of the VevoDataset samples of one split.
+#
+# <dataset_root>/vevo_cache/<split_ver>_<split>_<config hash>/
+#     index.json     fingerprint of the source files, sample ids and shape / dtype of every field
+#     <field>.npy    one (n_samples, *field_shape) array per sample field (x, tgt, semanticList, ...)
+#
+# The arrays are opened with np.load(mmap_mode="c"), a sample is a set of zero-copy row views.
+# The fingerprint covers the dataset options and the path, size and mtime of every source file
+# (.lab, .npy, .csv, split list, vevo_meta json), a cache with another fingerprint is rebuilt.
+
+CACHE_VERSION = 1
+
+def _cache_config(dataset):
+    return {
+        "version": CACHE_VERSION,
+        "split_path": os.path.abspath(dataset.vevo_meta_split_path),
+        "vis_models": dataset.vis_models_arr,
+        "emo_model": dataset.emo_model,
+        "motion_type": dataset.motion_type,
+        "max_seq_chord": dataset.max_seq_chord,
+        "max_seq_video": dataset.max_seq_video,
+        "is_video": dataset.is_video,
+    }
+
+def _source_files(dataset):
+    files = [dataset.vevo_meta_split_path]
+    for name in ("chord.json", "chord_root.json", "chord_attr.json"):
+        files.append(os.path.join(dataset.dataset_root, "vevo_meta", name))
+    for i in range(len(dataset.data_files_chord)):
+        files += [dataset.data_files_chord[i], dataset.data_files_chord_no_norm[i], dataset.data_files_emotion[i],
+                  dataset.data_files_motion[i], dataset.data_files_scene_offset[i], dataset.data_files_loudness[i],
+                  dataset.data_files_note_density[i], dataset.data_files_instrument[i]]
+        for data_files_semantic in dataset.data_files_semantic_list:
+            if i < len(data_files_semantic):
+                files.append(data_files_semantic[i])
+    return files
+
+def get_cache_dir(dataset, split, split_ver):
+    config_hash = hashlib.sha1(json.dumps(_cache_config(dataset), sort_keys=True).encode()).hexdigest()[:10]
+    return os.path.join(dataset.dataset_root, "vevo_cache", f"{split_ver}_{split}_{config_hash}")
+
+def source_fingerprint(dataset):
+    h = hashlib.sha1(json.dumps(_cache_config(dataset), sort_keys=True).encode())
+    for path in _source_files(dataset):
+        st = os.stat(path)
+        h.update(f"{os.path.abspath(path)}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+def compile_vevo_cache(dataset, cache_dir, fingerprint):
+    # Writes every sample of dataset (createSample) into cache_dir, one sample at a time
+    n_samples = len(dataset.data_files_chord)
+    tmp_dir = f"{cache_dir}.tmp{os.getpid()}"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    fields = {}
+    arrays = {}
+    print(f'Compile dataset cache ({n_samples}): {cache_dir}')
+    for i in tqdm(range(n_samples)):
+        sample = dataset.createSample(i)
+        for key, value in sample.items():
+            is_tensor = torch.is_tensor(value)
+            value = value.numpy() if is_tensor else np.asarray(value)
+            if i == 0:
+                fields[key] = {"tensor": is_tensor, "dtype": value.dtype.str, "shape": list(value.shape)}
+                arrays[key] = np.lib.format.open_memmap(os.path.join(tmp_dir, key + ".npy"), mode="w+",
+                                                        dtype=value.dtype, shape=(n_samples,) + value.shape)
+            if list(value.shape) != fields[key]["shape"]:
+                shutil.rmtree(tmp_dir)
+                raise ValueError(f"Field {key} of sample {dataset.data_files_chord[i]} has shape {list(value.shape)}, "
+                                 f"expected {fields[key]['shape']}")
+            arrays[key][i] = value
+
+    for array in arrays.values():
+        array.flush()
+    del arrays
+
+    index = {
+        "version": CACHE_VERSION,
+        "fingerprint": fingerprint,
+        "n_samples": n_samples,
+        "ids": [os.path.splitext(os.path.basename(path))[0] for path in dataset.data_files_chord],
+        "fields": fields,
+    }
+    with open(os.path.join(tmp_dir, "index.json"), "w") as f:
+        json.dump(index, f)
+
+    # Swap in the complete cache, readers never see a half written one
+    if os.path.exists(cache_dir):
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    try:
+        os.rename(tmp_dir, cache_dir)
+    except OSError:
+        # Compiled by another process in the meantime
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+def open_vevo_cache(cache_dir, fingerprint):
+    # (index, {field: memmap}) or None if there is no valid cache for fingerprint
+    index_path = os.path.join(cache_dir, "index.json")
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path) as f:
+        index = json.load(f)
+    if index.get("version") != CACHE_VERSION or index.get("fingerprint") != fingerprint:
+        return None
+
+    arrays = {}
+    for key in index["fields"]:
+        arrays[key] = np.load(os.path.join(cache_dir, key + ".npy"), mmap_mode="c")
+    return index, arrays
+
+def cached_sample(index, arrays, idx):
+    # Sample idx as row views of the memory-mapped arrays, same types as VevoDataset.createSample
+    sample = {}
+    for key, field in index["fields"].items():
+        value = arrays[key][idx]
+        sample[key] = torch.from_numpy(value) if field["tensor"] else np.asarray(value)
+    return sample
+
+def load_vevo_cache(dataset, split, split_ver):
+    # Opens the cache of dataset, compiles it first if it is missing or stale
+    cache_dir = get_cache_dir(dataset, split, split_ver)
+    fingerprint = source_fingerprint(dataset)
+
+    cache = open_vevo_cache(cache_dir, fingerprint)
+    if cache is None:
+        compile_vevo_cache(dataset, cache_dir, fingerprint)
+        cache = open_vevo_cache(cache_dir, fingerprint)
+    return cache
@@ -7,6 +7,7 @@ import numpy as np
 import pandas as pd
 
 from torch.utils.data import Dataset
+from torch.utils.data.dataloader import default_collate
 from utilities.constants import *
 from utilities.device import cpu_device
 from utilities.device import get_device
@@ -15,9 +16,42 @@ from gensim.models import Word2Vec
 import json
 from tqdm import tqdm
 import copy
+from collections import OrderedDict
+
+from dataset.vevo_cache import load_vevo_cache, cached_sample
+from utilities.chord_vocab import get_chord_vocab
 
 SEQUENCE_START = 0
 
+# -- emotion to chord
+#              maj dim sus4 min7 min sus2 aug dim7 maj6 hdim7 7 min6 maj7
+# 0. extcing : [1,0,1,0,0,0,0,0,0,0,1,0,0]
+# 1. fearful : [0,1,0,1,0,0,0,1,0,1,0,0,0]
+# 2. tense :   [0,1,1,1,0,0,0,0,0,0,1,0,0]
+# 3. sad :     [0,0,0,1,1,1,0,0,0,0,0,0,0]
+# 4. relaxing: [1,0,0,0,0,0,0,0,1,0,0,0,1]
+# 5. neutral : [0,0,0,0,0,0,0,0,0,0,0,0,0]
+# 6. chord end, 7. chord padding
+EMOTION_CHORD_END = 6
+EMOTION_CHORD_PAD = 7
+EMOTION_CHORD_TABLE = torch.tensor([
+    [0]+[1,0,1,0,0,0,0,0,0,0,1,0,0]*12+[0,0],
+    [0]+[0,1,0,1,0,0,0,1,0,1,0,0,0]*12+[0,0],
+    [0]+[0,1,1,1,0,0,0,0,0,0,1,0,0]*12+[0,0],
+    [0]+[0,0,0,1,1,1,0,0,0,0,0,0,0]*12+[0,0],
+    [0]+[1,0,0,0,0,0,0,0,1,0,0,0,1]*12+[0,0],
+    [0]+[0,0,0,0,0,0,0,0,0,0,0,0,0]*12+[0,0],
+    [0]+[0,0,0,0,0,0,0,0,0,0,0,0,0]*12+[1,0],
+    [0]+[0,0,0,0,0,0,0,0,0,0,0,0,0]*12+[0,1],
+], dtype=torch.float32) # (8, CHORD_SIZE)
+
+def emotion_chord_targets(feature_emotion_argmax, feature_chord):
+    # Per time step the chord qualities of its emotion (EMOTION_CHORD_TABLE row), END / PAD rows where the chord is END / PAD
+    table_idx = feature_emotion_argmax.clone()
+    table_idx[feature_chord == CHORD_END] = EMOTION_CHORD_END
+    table_idx[feature_chord == CHORD_PAD] = EMOTION_CHORD_PAD
+    return EMOTION_CHORD_TABLE[table_idx]
+
 key_dic = {
     'F major' : -7,
     'F# major' : -6,
@@ -56,11 +90,10 @@ key_dic = {
 }
 
 class VevoDataset(Dataset):
-    def __init__(self, dataset_root = "./dataset/", split="train", split_ver="v1", vis_models="2d/clip_l14p", emo_model="6c_l14p", motion_type=0, max_seq_chord=300, max_seq_video=300, random_seq=True, is_video = True, augmentation=False):
+    def __init__(self, dataset_root = "./dataset/", split="train", split_ver="v1", vis_models="2d/clip_l14p", emo_model="6c_l14p", motion_type=0, max_seq_chord=300, max_seq_video=300, random_seq=True, is_video = True, cache=True, lazy=False, lazy_cache_size=64):
         
         self.dataset_root       = dataset_root
         self.motion_type = motion_type
-        self.augmentation = augmentation
 
         self.vevo_chord_root = os.path.join( dataset_root, "vevo_chord", "lab_v2_norm", "origin")
         self.vevo_chord_root_no_norm = os.path.join( dataset_root, "vevo_chord", "lab_v2", "origin")
@@ -170,61 +203,53 @@ class VevoDataset(Dataset):
                     for i in range(len(self.vis_models_arr)):
                         self.data_files_semantic_list[i].append( fpath_semantic_list[i] )
         
-        chordDicPath = os.path.join( dataset_root, "vevo_meta/chord.json")
-        
-        chordRootDicPath = os.path.join( dataset_root, "vevo_meta/chord_root.json")
-        chordAttrDicPath = os.path.join( dataset_root, "vevo_meta/chord_attr.json")
-        
-        with open(chordDicPath) as json_file:
-            self.chordDic = json.load(json_file)
-        
-        with open(chordRootDicPath) as json_file:
-            self.chordRootDic = json.load(json_file)
-        
-        with open(chordAttrDicPath) as json_file:
-            self.chordAttrDic = json.load(json_file)
+        # Shared chord vocabularies of vevo_meta, see utilities/chord_vocab.py
+        self.chord_vocab = get_chord_vocab(dataset_root)
 
         # Get all samples
         self.dataset = []
-        print(f'Get all samples ({len(self.data_files_chord)})')
-        for i in tqdm(range(len(self.data_files_chord))):
-            self.dataset.append(self.createSample(i))
-
-        # Augmentation
-        if self.augmentation:
-            print('Augmentation...')
-            num_iterations = 2 * len(self.dataset)
-            augmented_dataset = []
-            for _ in range(num_iterations):
-                a, b = random.sample(self.dataset, 2)  # Pick 2 distinct elements
-                l = random.uniform(0.2, 0.8)
-                c = {
-                    "x": a["x"] * l + b["x"] * (l - 1),
-                    "chord": a["chord"] * l + b["chord"] * (l - 1),
-                    "x_root": a["x_root"] * l + b["x_root"] * (l - 1),
-                    "tgt_root": a["tgt_root"] * l + b["tgt_root"] * (l - 1),
-                    "chord_root": a["chord_root"] * l + b["chord_root"] * (l - 1),
-                    "x_attr": a["x_attr"] * l + b["x_attr"] * (l - 1),
-                    "tgt_attr": a["tgt_attr"] * l + b["tgt_attr"] * (l - 1),
-                    "chord_attr": a["chord_attr"] * l + b["chord_attr"] * (l - 1),
-                    "semanticList": a["semanticList"] * l + b["semanticList"] * (l - 1),
-                    "key": a["key"] * l + b["key"] * (l - 1),
-                    "key_val": a["key_val"] * l + b["key_val"] * (l - 1),
-                    "scene_offset": a["scene_offset"] * l + b["scene_offset"] * (l - 1),
-                    "motion": a["motion"] * l + b["motion"] * (l - 1),
-                    "emotion": a["emotion"] * l + b["emotion"] * (l - 1),
-                    "tgt_emotion": a["tgt_emotion"] * l + b["tgt_emotion"] * (l - 1),
-                    "tgt_emotion_prob": a["tgt_emotion_prob"] * l + b["tgt_emotion_prob"] * (l - 1),
-                    "note_density": a["note_density"] * l + b["note_density"] * (l - 1),
-                    "loudness": a["loudness"] * l + b["loudness"] * (l - 1),
-                    "instrument": a["instrument"] * l + b["instrument"] * (l - 1)
-                }
-                augmented_dataset.append(c)
-            self.dataset.extend(augmented_dataset)
-            print('Augmentation adchieve', len(self.dataset), 'samples')
+        self.cache = None
+        self.lazy = lazy
+        if cache:
+            # Memory-mapped store of the split, see dataset/vevo_cache.py
+            self.cache = load_vevo_cache(self, split, split_ver)
+        self.num_samples = len(self.data_files_chord)
+
+        if self.lazy:
+            # Samples are built in __getitem__, at most lazy_cache_size of them are kept (LRU)
+            self.lazy_cache_size = lazy_cache_size
+            self.lazy_cache = OrderedDict()
+        elif self.cache is not None:
+            index, arrays = self.cache
+            for i in range(index["n_samples"]):
+                self.dataset.append(cached_sample(index, arrays, i))
+        else:
+            print(f'Get all samples ({len(self.data_files_chord)})')
+            for i in tqdm(range(len(self.data_files_chord))):
+                self.dataset.append(self.createSample(i))
+
+    def getSample(self, idx):
+        # Sample idx of the split, through the LRU in lazy mode
+        if not self.lazy:
+            return self.dataset[idx]
+
+        if idx in self.lazy_cache:
+            self.lazy_cache.move_to_end(idx)
+            return self.lazy_cache[idx]
+
+        if self.cache is not None:
+            index, arrays = self.cache
+            sample = cached_sample(index, arrays, idx)
+        else:
+            sample = self.createSample(idx)
+
+        self.lazy_cache[idx] = sample
+        if len(self.lazy_cache) > self.lazy_cache_size:
+            self.lazy_cache.popitem(last=False)
+        return sample
 
     def __len__(self):
-        return len(self.dataset)
+        return self.num_samples
 
     def emotionDistance(self, sample1, sample2, idx1=300//2, idx2=300//2, window_size=20):
         if idx1 < window_size or idx2 < window_size:
@@ -263,25 +288,10 @@ class VevoDataset(Dataset):
                 chord = line_arr[1]
 
                 # Original
-                chordID = self.chordDic[chord]
+                chordID = self.chord_vocab.chord_to_id[chord]
                 feature_chord[time] = chordID
-                chord_arr = chord.split(":")
-
-                if len(chord_arr) == 1:
-                    if chord_arr[0] == "N":
-                        chordRootID = self.chordRootDic["N"]
-                        chordAttrID = self.chordAttrDic["N"]
-                        feature_chordRoot[time] = chordRootID
-                        feature_chordAttr[time] = chordAttrID
-                    else:
-                        chordRootID = self.chordRootDic[chord_arr[0]]
-                        feature_chordRoot[time] = chordRootID
-                        feature_chordAttr[time] = 1
-                elif len(chord_arr) == 2:
-                    chordRootID = self.chordRootDic[chord_arr[0]]
-                    chordAttrID = self.chordAttrDic[chord_arr[1]]
-                    feature_chordRoot[time] = chordRootID
-                    feature_chordAttr[time] = chordAttrID
+                feature_chordRoot[time] = self.chord_vocab.chord_root[chordID]
+                feature_chordAttr[time] = self.chord_vocab.chord_attr[chordID]
 
                 # CBOW in Chord Embedding
                 
@@ -458,53 +468,7 @@ class VevoDataset(Dataset):
             data = data[:self.max_seq_chord, :]
         feature_instrument[:data.shape[0], :] = data
 
-        # -- emotion to chord
-        #              maj dim sus4 min7 min sus2 aug dim7 maj6 hdim7 7 min6 maj7
-        # 0. extcing : [1,0,1,0,0,0,0,0,0,0,1,0,0]
-        # 1. fearful : [0,1,0,1,0,0,0,1,0,1,0,0,0]
-        # 2. tense :   [0,1,1,1,0,0,0,0,0,0,1,0,0]
-        # 3. sad :     [0,0,0,1,1,1,0,0,0,0,0,0,0]
-        # 4. relaxing: [1,0,0,0,0,0,0,0,1,0,0,0,1]
-        # 5. neutral : [0,0,0,0,0,0,0,0,0,0,0,0,0]
-
-        a0 = [0]+[1,0,1,0,0,0,0,0,0,0,1,0,0]*12+[0,0]
-        a1 = [0]+[0,1,0,1,0,0,0,1,0,1,0,0,0]*12+[0,0]
-        a2 = [0]+[0,1,1,1,0,0,0,0,0,0,1,0,0]*12+[0,0]
-        a3 = [0]+[0,0,0,1,1,1,0,0,0,0,0,0,0]*12+[0,0]
-        a4 = [0]+[1,0,0,0,0,0,0,0,1,0,0,0,1]*12+[0,0]
-        a5 = [0]+[0,0,0,0,0,0,0,0,0,0,0,0,0]*12+[0,0]
-
-        aend = [0]+[0,0,0,0,0,0,0,0,0,0,0,0,0]*12+[1,0]
-        apad = [0]+[0,0,0,0,0,0,0,0,0,0,0,0,0]*12+[0,1]
-
-        a0_tensor = torch.tensor(a0)
-        a1_tensor = torch.tensor(a1)
-        a2_tensor = torch.tensor(a2)
-        a3_tensor = torch.tensor(a3)
-        a4_tensor = torch.tensor(a4)
-        a5_tensor = torch.tensor(a5)
-
-        aend_tensor = torch.tensor(aend)
-        apad_tensor = torch.tensor(apad)
-
-        mapped_tensor = torch.zeros((300, 159))
-        for i, val in enumerate(feature_emotion_argmax):
-            if feature_chord[i] == CHORD_PAD:
-                mapped_tensor[i] = apad_tensor
-            elif feature_chord[i] == CHORD_END:
-                mapped_tensor[i] = aend_tensor
-            elif val == 0:
-                mapped_tensor[i] = a0_tensor
-            elif val == 1:
-                mapped_tensor[i] = a1_tensor
-            elif val == 2:
-                mapped_tensor[i] = a2_tensor
-            elif val == 3:
-                mapped_tensor[i] = a3_tensor
-            elif val == 4:
-                mapped_tensor[i] = a4_tensor
-            elif val == 5:
-                mapped_tensor[i] = a5_tensor
+        mapped_tensor = emotion_chord_targets(feature_emotion_argmax, feature_chord)
 
         # feature emotion : [1, 300, 6]
         # y : [299, 159]
@@ -629,24 +593,72 @@ class VevoDataset(Dataset):
         return sample1, sample2
 
     def __getitem__(self, idx):
-        return self.dataset[idx]
+        if idx < 0:
+            idx += len(self)
+        return self.getSample(idx)
+
+# Categorical fields, never interpolated by MixupCollate
+MIXUP_LABEL_KEYS = ("x", "tgt", "chord", "x_root", "tgt_root", "chord_root", "x_attr", "tgt_attr", "chord_attr",
+                    "key", "key_val", "scene_offset")
+
+class MixupCollate(object):
+    """
+    Mixup augmentation as a DataLoader collate_fn, memory stays at one copy of the dataset and every
+    epoch sees new mixes.
+
+    Each sample of a batch is mixed with probability mix_prob (default 2/3, the 1 clean : 2 mixed ratio of the former
+    precomputed pairs) with another sample of the same batch, with one lambda ~ U(lambda_min, lambda_max) per batch.
+    The other samples stay unmixed, they are their own partner. Continuous fields (video features, emotion targets,
+    note density, loudness, instrument) become lambda * a + (1 - lambda) * b. Label fields (label_keys and non-float
+    tensors) keep the labels of a, the labels of b are added as <key>_mix and lambda as mix_lambda, so that the chord
+    loss is mix_lambda * loss(y, tgt) + (1 - mix_lambda) * loss(y, tgt_mix), see train_epoch.
+    """
+    def __init__(self, lambda_min=0.2, lambda_max=0.8, mix_prob=2/3, label_keys=MIXUP_LABEL_KEYS):
+        self.lambda_min = lambda_min
+        self.lambda_max = lambda_max
+        self.mix_prob = mix_prob
+        self.label_keys = label_keys
+
+    def __call__(self, samples):
+        batch = default_collate(samples)
+        batch_size = len(samples)
+        if batch_size < 2:
+            return batch
+
+        # Random partner of every sample, never the sample itself
+        perm = torch.randperm(batch_size)
+        partner = torch.empty_like(perm)
+        partner[perm] = perm.roll(1)
+        mixed = torch.rand(batch_size) < self.mix_prob
+        partner = torch.where(mixed, partner, torch.arange(batch_size))
+        l = random.uniform(self.lambda_min, self.lambda_max)
+
+        for key, value in list(batch.items()):
+            if key in self.label_keys or not torch.is_floating_point(value):
+                batch[key + "_mix"] = value[partner]
+            else:
+                # Unmixed samples are kept as is (bitwise), not l * a + (1 - l) * a
+                mask = mixed.view(-1, *([1] * (value.dim() - 1)))
+                batch[key] = torch.where(mask, value * l + value[partner] * (1 - l), value)
+        batch["mix_lambda"] = torch.tensor(l)
+        return batch
 
-def create_vevo_datasets(dataset_root = "./dataset", max_seq_chord=300, max_seq_video=300, vis_models="2d/clip_l14p", emo_model="6c_l14p", motion_type=0, split_ver="v1", random_seq=True, is_video=True, augmentation=False):
+def create_vevo_datasets(dataset_root = "./dataset", max_seq_chord=300, max_seq_video=300, vis_models="2d/clip_l14p", emo_model="6c_l14p", motion_type=0, split_ver="v1", random_seq=True, is_video=True, cache=True, lazy=False, lazy_cache_size=64):
 
     train_dataset = VevoDataset(
         dataset_root = dataset_root, split="train", split_ver=split_ver, 
         vis_models=vis_models, emo_model =emo_model, motion_type=motion_type, max_seq_chord=max_seq_chord, max_seq_video=max_seq_video, 
-        random_seq=random_seq, is_video = is_video, augmentation=augmentation)
+        random_seq=random_seq, is_video = is_video, cache=cache, lazy=lazy, lazy_cache_size=lazy_cache_size)
     
     val_dataset = VevoDataset(
         dataset_root = dataset_root, split="val", split_ver=split_ver, 
         vis_models=vis_models, emo_model =emo_model, motion_type=motion_type, max_seq_chord=max_seq_chord, max_seq_video=max_seq_video, 
-        random_seq=random_seq, is_video = is_video )
+        random_seq=random_seq, is_video = is_video, cache=cache, lazy=lazy, lazy_cache_size=lazy_cache_size)
     
     test_dataset = VevoDataset(
         dataset_root = dataset_root, split="test", split_ver=split_ver, 
         vis_models=vis_models, emo_model =emo_model, motion_type=motion_type, max_seq_chord=max_seq_chord, max_seq_video=max_seq_video, 
-        random_seq=random_seq, is_video = is_video )
+        random_seq=random_seq, is_video = is_video, cache=cache, lazy=lazy, lazy_cache_size=lazy_cache_size)
     
     return train_dataset, val_dataset, test_dataset
 
@@ -672,281 +684,78 @@ def compute_vevo_accuracy(out, tgt):
 
     return acc
 
-def compute_hits_k(out, tgt, k):
+def _root_attr_to_chord(y_root, y_attr):
+    # Predicted chord ids (flattened) from the root and attribute logits
     softmax = nn.Softmax(dim=-1)
-    out = softmax(out)
-    _, topk_indices = torch.topk(out, k, dim=-1)  # Get the indices of top-k values
+    y_root = torch.argmax(softmax(y_root), dim=-1).flatten()
+    y_attr = torch.argmax(softmax(y_attr), dim=-1).flatten()
+    return get_chord_vocab().tensor("root_attr_chord", y_root.device)[y_root, y_attr]
 
+def _hits_k(out, tgt, k):
+    # out (..., CHORD_SIZE) probabilities, tgt (...) chord ids
+    _, topk_indices = torch.topk(out, k, dim=-1)  # Get the indices of top-k values
+    topk_indices = topk_indices.reshape(-1, k)
     tgt = tgt.flatten()
 
-    topk_indices = torch.squeeze(topk_indices, dim = 0)
-
-    num_right = 0 
-    pt = 0
-    for i, tlist in enumerate(topk_indices):
-        if tgt[i] == CHORD_PAD:
-            num_right += 0
-        else:
-            pt += 1 
-            if tgt[i].item() in tlist:
-                num_right += 1
-
     # Empty
     if len(tgt) == 0:
         return 1.0
-    
-    num_right = torch.tensor(num_right, dtype=torch.float32)
-    hitk = num_right / pt
 
-    return hitk
+    mask = (tgt != CHORD_PAD)
+    hits = (topk_indices == tgt.unsqueeze(-1)).any(dim=-1) & mask
+    return hits.sum().type(TORCH_FLOAT) / mask.sum()
+
+def compute_hits_k(out, tgt, k):
+    softmax = nn.Softmax(dim=-1)
+    return _hits_k(softmax(out), tgt, k)
 
 def compute_hits_k_root_attr(out_root, out_attr, tgt, k):
     softmax = nn.Softmax(dim=-1)
     out_root = softmax(out_root)
     out_attr = softmax(out_attr)
 
-    tensor_shape = torch.Size([1, 299, 159])
-    out = torch.zeros(tensor_shape)
-    for i in range(out.shape[-1]):
-        if i == 0 :
-            out[0, :, i] = out_root[0, :, 0] * out_attr[0, :, 0] 
-        elif i == 157:
-            out[0, :, i] = out_root[0, :, 13] * out_attr[0, :, 14]
-        elif i == 158:
-            out[0, :, i] = out_root[0, :, 14] * out_attr[0, :, 15]
-        else:
-            rootindex =  int( (i-1)/13 ) + 1
-            attrindex =  (i-1)%13 + 1
-            out[0, :, i] = out_root[0, :, rootindex] * out_attr[0, :, attrindex]
-
-    out = softmax(out)
-    _, topk_indices = torch.topk(out, k, dim=-1)  # Get the indices of top-k values
-
-    tgt = tgt.flatten()
-
-    topk_indices = torch.squeeze(topk_indices, dim = 0)
-
-    num_right = 0 
-    pt = 0
-    for i, tlist in enumerate(topk_indices):
-        if tgt[i] == CHORD_PAD:
-            num_right += 0
-        else:
-            pt += 1 
-            if tgt[i].item() in tlist:
-                num_right += 1
-
-    if len(tgt) == 0:
-        return 1.0
-    
-    num_right = torch.tensor(num_right, dtype=torch.float32)
-    hitk = num_right / pt
+    # Chord probability as product of its root and attribute probabilities
+    vocab = get_chord_vocab()
+    out = out_root[..., vocab.tensor("chord_root", out_root.device)] * out_attr[..., vocab.tensor("chord_attr", out_root.device)]
 
-    return hitk
+    return _hits_k(softmax(out), tgt, k)
 
-def compute_vevo_correspondence(out, tgt, tgt_emotion, tgt_emotion_prob, emotion_threshold):
-
-    tgt_emotion = tgt_emotion.squeeze()
-    tgt_emotion_prob = tgt_emotion_prob.squeeze()
-
-    dataset_root = "./dataset/"
-    chordRootInvDicPath = os.path.join( dataset_root, "vevo_meta/chord_root_inv.json")
-    chordAttrInvDicPath = os.path.join( dataset_root, "vevo_meta/chord_attr_inv.json")
-    chordAttrDicPath = os.path.join( dataset_root, "vevo_meta/chord_attr.json")
-    
-    chordDicPath = os.path.join( dataset_root, "vevo_meta/chord.json")
-    chordInvDicPath = os.path.join( dataset_root, "vevo_meta/chord_inv.json")
-
-    with open(chordRootInvDicPath) as json_file:
-        chordRootInvDic = json.load(json_file)
-    with open(chordAttrDicPath) as json_file:
-        chordAttrDic = json.load(json_file)
-    with open(chordAttrInvDicPath) as json_file:
-        chordAttrInvDic = json.load(json_file)
-    with open(chordDicPath) as json_file:
-        chordDic = json.load(json_file)
-    with open(chordInvDicPath) as json_file:
-        chordInvDic = json.load(json_file)
-
-    softmax = nn.Softmax(dim=-1)
-    out = torch.argmax(softmax(out), dim=-1)
-    out = out.flatten()
-
-    tgt = tgt.flatten()
-
-    num_right = 0
-    tgt_emotion_quality = tgt_emotion[:, 0:14]
-    pt = 0 
-    for i, out_element in enumerate( out ):
-
-        all_zeros = torch.all(tgt_emotion_quality[i] == 0)
-        if tgt_emotion[i][-1] == 1 or all_zeros or tgt_emotion_prob[i] < emotion_threshold:
-            num_right += 0
-        else:
-            pt += 1
-            if out_element.item() != CHORD_END and out_element.item() != CHORD_PAD:
-                gen_chord = chordInvDic[ str( out_element.item() ) ]
-
-                chord_arr = gen_chord.split(":")
-                if len(chord_arr) == 1:
-                    out_quality = 1
-                elif len(chord_arr) == 2:
-                    chordAttrID = chordAttrDic[chord_arr[1]]
-                    out_quality = chordAttrID # 0:N, 1:maj ... 13:maj7
-
-                if tgt_emotion_quality[i][out_quality] == 1:
-                    num_right += 1
-                    
+def _correspondence(y, tgt_emotion, tgt_emotion_prob, emotion_threshold):
+    # Share of the emotion-labelled time steps whose chord y has a quality of the emotion
+    tgt_emotion = tgt_emotion.reshape(-1, tgt_emotion.shape[-1])
+    tgt_emotion_prob = tgt_emotion_prob.flatten()
 
     if(len(tgt_emotion) == 0):
         return 1.0
-    
-    if(pt == 0):
-        return -1
-    
-    num_right = torch.tensor(num_right, dtype=torch.float32)
-    acc = num_right / pt
-
-    return acc
-
-def compute_vevo_correspondence_root_attr(y_root, y_attr, tgt, tgt_emotion, tgt_emotion_prob, emotion_threshold):
-
-    tgt_emotion = tgt_emotion.squeeze()
-    tgt_emotion_prob = tgt_emotion_prob.squeeze()
 
-    dataset_root = "./dataset/"
-    chordRootInvDicPath = os.path.join( dataset_root, "vevo_meta/chord_root_inv.json")
-    chordAttrInvDicPath = os.path.join( dataset_root, "vevo_meta/chord_attr_inv.json")
-    chordAttrDicPath = os.path.join( dataset_root, "vevo_meta/chord_attr.json")
-    
-    chordDicPath = os.path.join( dataset_root, "vevo_meta/chord.json")
-    chordInvDicPath = os.path.join( dataset_root, "vevo_meta/chord_inv.json")
-
-    with open(chordRootInvDicPath) as json_file:
-        chordRootInvDic = json.load(json_file)
-    with open(chordAttrDicPath) as json_file:
-        chordAttrDic = json.load(json_file)
-    with open(chordAttrInvDicPath) as json_file:
-        chordAttrInvDic = json.load(json_file)
-    with open(chordDicPath) as json_file:
-        chordDic = json.load(json_file)
-    with open(chordInvDicPath) as json_file:
-        chordInvDic = json.load(json_file)
-
-    softmax = nn.Softmax(dim=-1)
-
-    y_root = torch.argmax(softmax(y_root), dim=-1)
-    y_attr = torch.argmax(softmax(y_attr), dim=-1)
-    
-    y_root = y_root.flatten()
-    y_attr = y_attr.flatten()
-
-    tgt = tgt.flatten()
-    y = np.empty( len(tgt) )
-
-    y.fill(CHORD_PAD)
-
-    for i in range(len(tgt)):
-        if y_root[i].item() == CHORD_ROOT_PAD or y_attr[i].item() == CHORD_ATTR_PAD:
-            y[i] = CHORD_PAD
-        elif y_root[i].item() == CHORD_ROOT_END or y_attr[i].item() == CHORD_ATTR_END:
-            y[i] = CHORD_END
-        else:
-            chordRoot = chordRootInvDic[str(y_root[i].item())]
-            chordAttr = chordAttrInvDic[str(y_attr[i].item())]
-            if chordRoot == "N":
-                y[i] = 0
-            else:
-                if chordAttr == "N" or chordAttr == "maj":
-                    y[i] = chordDic[chordRoot]
-                else:
-                    chord = chordRoot + ":" + chordAttr
-                    y[i] = chordDic[chord]
-
-    y = torch.from_numpy(y)
-    y = y.to(torch.long)
-    y = y.to(get_device())
-    y = y.flatten()
-
-    num_right = 0
     tgt_emotion_quality = tgt_emotion[:, 0:14]
-    pt = 0 
-    for i, y_element in enumerate( y ):
-        all_zeros = torch.all(tgt_emotion_quality[i] == 0)
-        if tgt_emotion[i][-1] == 1 or all_zeros or tgt_emotion_prob[i] < emotion_threshold:
-            num_right += 0
-        else:
-            pt += 1
-            if y_element.item() != CHORD_END and y_element.item() != CHORD_PAD:
-                gen_chord = chordInvDic[ str( y_element.item() ) ]
-                chord_arr = gen_chord.split(":")
-                if len(chord_arr) == 1:
-                    y_quality = 1
-                elif len(chord_arr) == 2:
-                    chordAttrID = chordAttrDic[chord_arr[1]]
-                    y_quality = chordAttrID # 0:N, 1:maj ... 13:maj7
-
-                if tgt_emotion_quality[i][y_quality] == 1:
-                    num_right += 1
-                    
-    if(len(tgt_emotion) == 0):
-        return 1.0
-    
+    labelled = ~((tgt_emotion[:, -1] == 1) | torch.all(tgt_emotion_quality == 0, dim=-1) | (tgt_emotion_prob < emotion_threshold))
+    pt = labelled.sum()
     if(pt == 0):
         return -1
-    
-    num_right = torch.tensor(num_right, dtype=torch.float32)
-    acc = num_right / pt
-    return acc
 
-def compute_vevo_accuracy_root_attr(y_root, y_attr, tgt):
+    # Chord quality of y, CHORD_END / CHORD_PAD never correspond
+    y_quality = get_chord_vocab().tensor("chord_quality", y.device)[y]
+    right = tgt_emotion_quality.gather(1, y_quality.clamp(max=CHORD_ATTR_END - 1).unsqueeze(-1)).squeeze(-1) == 1
+    right = right & (y_quality < CHORD_ATTR_END) & labelled
 
-    dataset_root = "./dataset/"
-    chordRootInvDicPath = os.path.join( dataset_root, "vevo_meta/chord_root_inv.json")
-    chordAttrInvDicPath = os.path.join( dataset_root, "vevo_meta/chord_attr_inv.json")
-    chordDicPath = os.path.join( dataset_root, "vevo_meta/chord.json")
-    
-    with open(chordRootInvDicPath) as json_file:
-        chordRootInvDic = json.load(json_file)
-    with open(chordAttrInvDicPath) as json_file:
-        chordAttrInvDic = json.load(json_file)
-    with open(chordDicPath) as json_file:
-        chordDic = json.load(json_file)
+    return right.sum().type(TORCH_FLOAT) / pt
 
+def compute_vevo_correspondence(out, tgt, tgt_emotion, tgt_emotion_prob, emotion_threshold):
     softmax = nn.Softmax(dim=-1)
+    out = torch.argmax(softmax(out), dim=-1)
+    out = out.flatten()
+    return _correspondence(out, tgt_emotion, tgt_emotion_prob, emotion_threshold)
 
-    y_root = torch.argmax(softmax(y_root), dim=-1)
-    y_attr = torch.argmax(softmax(y_attr), dim=-1)
-    
-    y_root = y_root.flatten()
-    y_attr = y_attr.flatten()
+def compute_vevo_correspondence_root_attr(y_root, y_attr, tgt, tgt_emotion, tgt_emotion_prob, emotion_threshold):
+    y = _root_attr_to_chord(y_root, y_attr)
+    return _correspondence(y, tgt_emotion, tgt_emotion_prob, emotion_threshold)
 
+def compute_vevo_accuracy_root_attr(y_root, y_attr, tgt):
+    y = _root_attr_to_chord(y_root, y_attr)
     tgt = tgt.flatten()
 
     mask = (tgt != CHORD_PAD)
-    y = np.empty( len(tgt) )
-    y.fill(CHORD_PAD)
-
-    for i in range(len(tgt)):
-        if y_root[i].item() == CHORD_ROOT_PAD or y_attr[i].item() == CHORD_ATTR_PAD:
-            y[i] = CHORD_PAD
-        elif y_root[i].item() == CHORD_ROOT_END or y_attr[i].item() == CHORD_ATTR_END:
-            y[i] = CHORD_END
-        else:
-            chordRoot = chordRootInvDic[str(y_root[i].item())]
-            chordAttr = chordAttrInvDic[str(y_attr[i].item())]
-            if chordRoot == "N":
-                y[i] = 0
-            else:
-                if chordAttr == "N" or chordAttr == "maj":
-                    y[i] = chordDic[chordRoot]
-                else:
-                    chord = chordRoot + ":" + chordAttr
-                    y[i] = chordDic[chord]
-
-    y = torch.from_numpy(y)
-    y = y.to(torch.long)
-    y = y.to(get_device())
 
     y = y[mask]
     tgt = tgt[mask]
@@ -19,7 +19,9 @@ import json
 from sklearn.metrics import confusion_matrix
 import matplotlib.pyplot as plt
 import argparse
-from third_party.log_experts import save_and_plot, change_logging_state
+from model.routing_stats import attach_routing_stats
+from model.custom_transformer import set_attention_backend
+from third_party.log_experts import save_and_plot
 
 version = VERSION
 split_ver = SPLIT_VER
@@ -37,8 +39,6 @@ logging.getLogger().addHandler(fh)
 
 # main
 def main( vm = "", isPrintArgs = True, isSavedConfusionMatrix = False, isSavedExpertEmotionPlot = False):
-    if isSavedExpertEmotionPlot:
-        change_logging_state(True)
     args = parse_eval_args()[0]
 
     if isPrintArgs:
@@ -132,6 +132,10 @@ def main( vm = "", isPrintArgs = True, isSavedConfusionMatrix = False, isSavedEx
         
     print(model)
     model.load_state_dict(torch.load(args.model_weights, map_location=get_device()))
+    set_attention_backend(model, args.attn_backend)
+
+    # Logging: expert / emotion routing counts
+    routing_stats = attach_routing_stats(model) if isSavedExpertEmotionPlot else None
     
     ##### Not smoothing evaluation loss #####
     eval_loss_func = nn.CrossEntropyLoss(ignore_index=CHORD_PAD)
@@ -160,9 +164,8 @@ def main( vm = "", isPrintArgs = True, isSavedConfusionMatrix = False, isSavedEx
     logging.info(f"Avg test h5: {eval_h5:.4f}")    
 
     # Logging emotion expert plot
-    save_and_plot()
-    # Turn off logging
-    change_logging_state(False)
+    if routing_stats is not None:
+        save_and_plot(routing_stats.get_counts())
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -60,8 +60,7 @@ def main( vm = "", isPrintArgs = True):
         emo_model = args.emo_model, 
         motion_type = args.motion_type,
         split_ver = SPLIT_VER, 
-        random_seq = True,
-        augmentation = args.augmentation)
+        random_seq = True)
     
     test_loader = DataLoader(test_dataset, batch_size=1, num_workers=args.n_workers)
 
@@ -18,6 +18,7 @@ from torch.optim import Adam
 
 from utilities.constants import *
 from utilities.device import get_device, use_cuda
+from utilities.chord_vocab import get_chord_vocab
 import numpy as np
 import json
 
@@ -94,15 +95,10 @@ def main():
         for line in txt_file:
             valFileList.append(line.strip())
     
-    with open('dataset/vevo_meta/chord.json') as json_file:
-        chordDic = json.load(json_file)
-    with open('dataset/vevo_meta/chord_inv.json') as json_file:
-        chordInvDic = json.load(json_file)
-
-    with open('dataset/vevo_meta/chord_root.json') as json_file:
-        chordRootDic = json.load(json_file)
-    with open('dataset/vevo_meta/chord_attr.json') as json_file:
-        chordAttrDic = json.load(json_file)
+    chord_vocab = get_chord_vocab()
+    chordDic = chord_vocab.chord_to_id
+    chordRootDic = chord_vocab.root_to_id
+    chordAttrDic = chord_vocab.attr_to_id
 
 
     args = parse_generate_args()[0]
@@ -432,10 +428,7 @@ def main():
                         densitylist.append(4)
 
                 # generated ChordID to ChordSymbol
-                chord_genlist = []
-                chordID_genlist= rand_seq[0].cpu().numpy()
-                for i in chordID_genlist:
-                    chord_genlist.append(chordInvDic[str(i)])
+                chord_genlist = chord_vocab.chord_names(rand_seq[0].cpu().numpy())
                 
                 chord_offsetlist = convert_format_id_to_offset(chord_genlist)
                 
@@ -622,10 +615,7 @@ def main():
                                               beam=0)
                 vispath = "no_video"
                 
-                chord_genlist = []
-                chordID_genlist= rand_seq[0].cpu().numpy()
-                for i in chordID_genlist:
-                    chord_genlist.append(chordInvDic[str(i)])
+                chord_genlist = chord_vocab.chord_names(rand_seq[0].cpu().numpy())
                 
                 chord_offsetlist = convert_format_id_to_offset(chord_genlist)
                 
@@ -23,6 +23,23 @@ from torch.nn.modules.activation import _check_arg_device, _arg_requires_grad, _
 
 from torch.nn.functional import linear, softmax, dropout
 
+# Attention backends of CustomMultiheadAttention, AngleMultiheadAttention, DifferentialMultiheadAttention
+# and MultiheadGQA, see set_attention_backend.
+#   'reference' the hand-written attention, also returns the attention weights
+#   'sdpa'      F.scaled_dot_product_attention (fused memory-efficient / math kernels), no attention weights
+ATTENTION_BACKENDS = ('reference', 'sdpa')
+
+def set_attention_backend(model, backend):
+    # Sets the attention backend of all attention modules of model, returns their number
+    if backend not in ATTENTION_BACKENDS:
+        raise ValueError(f"Unknown attention backend {backend}, expected one of {ATTENTION_BACKENDS}")
+    n_modules = 0
+    for module in model.modules():
+        if hasattr(module, 'attn_backend'):
+            module.attn_backend = backend
+            n_modules += 1
+    return n_modules
+
 # From https://github.com/microsoft/unilm/blob/master/Diff-Transformer/
 class RMSNorm(nn.Module):
     def __init__(self, dim: int, eps: float = 1e-6, elementwise_affine=True, memory_efficient=False):
@@ -55,7 +72,8 @@ class CustomMultiheadAttention(Module):
 
     def __init__(self, embed_dim, num_heads, dropout=0., bias=True, add_bias_kv=False, add_zero_attn=False,
                  kdim=None, vdim=None, batch_first=False, device=None, dtype=None,
-                 RoPE=None # OUR MODIFY
+                 RoPE=None, # OUR MODIFY
+                 attn_backend='reference'
                  ) -> None:
         if embed_dim <= 0 or num_heads <= 0:
             raise ValueError(
@@ -75,6 +93,7 @@ class CustomMultiheadAttention(Module):
         self.head_dim = embed_dim // num_heads
 
         self.RoPE = copy.deepcopy(RoPE) # OUR MODIFY
+        self.attn_backend = attn_backend
 
         assert self.head_dim * num_heads == self.embed_dim, "embed_dim must be divisible by num_heads"
 
@@ -258,6 +277,10 @@ class CustomMultiheadAttention(Module):
             else:
                 query, key, value = (x.transpose(1, 0) for x in (query, key, value))
 
+        # The sdpa backend is the need_weights=False branch of custom_multi_head_attention_forward
+        if self.attn_backend == 'sdpa':
+            need_weights = False
+
         if not self._qkv_same_embed_dim:
             attn_output, attn_output_weights = custom_multi_head_attention_forward(
                 query, key, value, self.embed_dim, self.num_heads,
@@ -327,7 +350,8 @@ class AngleMultiheadAttention(Module):
 
     def __init__(self, embed_dim, num_heads, dropout=0., bias=True, add_bias_kv=False, add_zero_attn=False,
                  kdim=None, vdim=None, batch_first=False, device=None, dtype=None,
-                 RoPE=None # OUR MODIFY
+                 RoPE=None, # OUR MODIFY
+                 attn_backend='reference'
                  ) -> None:
         if embed_dim <= 0 or num_heads <= 0:
             raise ValueError(
@@ -347,6 +371,7 @@ class AngleMultiheadAttention(Module):
         self.head_dim = embed_dim // num_heads
 
         self.RoPE = copy.deepcopy(RoPE) # OUR MODIFY
+        self.attn_backend = attn_backend
 
         assert self.head_dim * num_heads == self.embed_dim, "embed_dim must be divisible by num_heads"
 
@@ -530,6 +555,10 @@ class AngleMultiheadAttention(Module):
             else:
                 query, key, value = (x.transpose(1, 0) for x in (query, key, value))
 
+        # The sdpa backend is the need_weights=False branch of custom_multi_head_attention_forward
+        if self.attn_backend == 'sdpa':
+            need_weights = False
+
         if not self._qkv_same_embed_dim:
             attn_output, attn_output_weights = custom_multi_head_attention_forward(
                 query, key, value, self.embed_dim, self.num_heads,
@@ -613,7 +642,8 @@ class DifferentialMultiheadAttention(Module):
     bias_v: Optional[torch.Tensor]
 
     def __init__(self, embed_dim, num_heads, dropout=0., batch_first=False, device=None, 
-                 dtype=None, RoPE=None, depth=2 # OUR MODIFY
+                 dtype=None, RoPE=None, depth=2, # OUR MODIFY
+                 attn_backend='reference'
                  ) -> None:
         if embed_dim <= 0 or num_heads <= 0:
             raise ValueError(
@@ -631,6 +661,7 @@ class DifferentialMultiheadAttention(Module):
         self.scaling = self.head_dim ** -0.5
 
         self.RoPE = copy.deepcopy(RoPE)
+        self.attn_backend = attn_backend
 
         self.k_proj = nn.Linear(embed_dim, embed_dim * 2, **factory_kwargs, bias=False)
         self.q_proj = nn.Linear(embed_dim, embed_dim * 2, **factory_kwargs, bias=False)
@@ -792,7 +823,32 @@ class DifferentialMultiheadAttention(Module):
         q = q.transpose(1, 2)
         k = k.transpose(1, 2)
         v = v.transpose(1, 2)
-        q *= self.scaling
+
+        lambda_1 = torch.exp(torch.sum(self.lambda_q1 * self.lambda_k1, dim=-1).float()).type_as(q)
+        lambda_2 = torch.exp(torch.sum(self.lambda_q2 * self.lambda_k2, dim=-1).float()).type_as(q)
+        lambda_full = lambda_1 - lambda_2 + self.lambda_init
+
+        if self.attn_backend == 'sdpa':
+            attn, attn_weights = self._sdpa_forward(q, k, v, attn_mask, lambda_full, offset)
+        else:
+            attn, attn_weights = self._reference_forward(q, k, v, attn_mask, lambda_full, offset)
+
+        attn = self.subln(attn)
+        attn = attn * (1 - self.lambda_init)
+        attn = attn.view(tgt_len, bsz, self.num_heads * self.head_dim)
+
+        attn = self.out_proj(attn)
+
+        if self.batch_first and is_batched:
+            return attn.transpose(1, 0), attn_weights
+        else:
+            return attn, attn_weights
+
+    def _reference_forward(self, q, k, v, attn_mask, lambda_full, offset):
+        # q, k (bsz, 2 * num_heads, len, head_dim), v (bsz, num_heads, src_len, head_dim)
+        bsz, _, tgt_len, _ = q.shape
+        src_len = k.shape[2]
+        q = q * self.scaling
 
         attn_weights = torch.matmul(q, k.transpose(-1, -2))
         attn_weights = torch.nan_to_num(attn_weights)
@@ -811,25 +867,34 @@ class DifferentialMultiheadAttention(Module):
             attn_weights
         )
 
-        lambda_1 = torch.exp(torch.sum(self.lambda_q1 * self.lambda_k1, dim=-1).float()).type_as(q)
-        lambda_2 = torch.exp(torch.sum(self.lambda_q2 * self.lambda_k2, dim=-1).float()).type_as(q)
-        lambda_full = lambda_1 - lambda_2 + self.lambda_init
         attn_weights = attn_weights.view(bsz, self.num_heads, 2, tgt_len, src_len)
         attn_weights = attn_weights[:, :, 0] - lambda_full * attn_weights[:, :, 1]
         # attn_weights = self.dropout(attn_weights)
         
         attn = torch.matmul(attn_weights, v)
-
-        attn = self.subln(attn)
-        attn = attn * (1 - self.lambda_init)
-        attn = attn.view(tgt_len, bsz, self.num_heads * self.head_dim)
-
-        attn = self.out_proj(attn)
-
-        if self.batch_first and is_batched:
-            return attn.transpose(1, 0), attn_weights
+        return attn, attn_weights
+
+    def _sdpa_forward(self, q, k, v, attn_mask, lambda_full, offset):
+        # Same result as _reference_forward: the two softmax maps of a head pair are applied to v
+        # separately, (A1 - lambda * A2) v = A1 v - lambda * A2 v
+        bsz, _, tgt_len, head_dim = q.shape
+        src_len = k.shape[2]
+        q = q.view(bsz, self.num_heads, 2, tgt_len, head_dim)
+        k = k.view(bsz, self.num_heads, 2, src_len, head_dim)
+
+        # Any attn_mask means causal, like the reference
+        is_causal = attn_mask is not None and offset == 0
+        if attn_mask is not None and offset != 0:
+            attn_mask = torch.triu(
+                torch.full([tgt_len, src_len], float("-inf"), device=q.device, dtype=q.dtype),
+                1 + offset,
+            )
         else:
-            return attn, attn_weights
+            attn_mask = None
+
+        attn_1 = F.scaled_dot_product_attention(q[:, :, 0], k[:, :, 0], v, attn_mask, is_causal=is_causal, scale=self.scaling)
+        attn_2 = F.scaled_dot_product_attention(q[:, :, 1], k[:, :, 1], v, attn_mask, is_causal=is_causal, scale=self.scaling)
+        return attn_1 - lambda_full * attn_2, None
 
     # From pytorch
     def merge_masks(self, attn_mask: Optional[Tensor], key_padding_mask: Optional[Tensor],
@@ -1203,6 +1268,10 @@ def custom_multi_head_attention_forward(
             else:
                 attn_mask = attn_mask.view(bsz, num_heads, -1, src_len)
 
+        q = q.view(bsz, num_heads, tgt_len, head_dim)
+        k = k.view(bsz, num_heads, src_len, head_dim)
+        v = v.view(bsz, num_heads, src_len, head_dim)
+
         attn_output = F.scaled_dot_product_attention(
             q, k, v, attn_mask, dropout_p, is_causal
         )
@@ -1217,6 +1286,129 @@ def custom_multi_head_attention_forward(
             attn_output = attn_output.squeeze(1)
         return attn_output, None
 
+# Incremental decoding
+class KVCache(object):
+    """
+    Key/value cache for incremental decoding. layers[i] holds the projected keys and values
+    of decoder layer i: self-attention grows by one position per step, cross-attention is
+    projected from the encoder memory on the first step and reused afterwards.
+    length is the number of target positions already decoded.
+    """
+    def __init__(self, num_layers):
+        self.layers = [dict() for _ in range(num_layers)]
+        self.length = 0
+
+def supports_kv_cache(attn):
+    # Needs nn.MultiheadAttention style packed in-projection. RoPE is applied on a view of the
+    # whole sequence here, so the keys of earlier positions change with the sequence length
+    # and cannot be cached.
+    return (getattr(attn, 'in_proj_weight', None) is not None
+            and getattr(attn, '_qkv_same_embed_dim', True)
+            and getattr(attn, 'RoPE', None) is None
+            and getattr(attn, 'bias_k', None) is None
+            and not getattr(attn, 'add_zero_attn', False))
+
+def init_kv_cache(decoder):
+    # Returns None when the decoder can only run on the full sequence
+    if isinstance(decoder, nn.TransformerDecoder):
+        if not all(supports_kv_cache(layer.self_attn) and supports_kv_cache(layer.multihead_attn)
+                   for layer in decoder.layers):
+            return None
+    elif not hasattr(decoder, 'supports_kv_cache') or not decoder.supports_kv_cache():
+        return None
+    return KVCache(len(decoder.layers))
+
+def decoder_forward_step(decoder, tgt, memory, cache, memory_key_padding_mask=None):
+    # forward_step of the decoders above, also for the stock nn.TransformerDecoder (nn.Transformer
+    # without custom_decoder), which is stepped layer by layer by _stock_decoder_layer_step
+    if not isinstance(decoder, nn.TransformerDecoder):
+        return decoder.forward_step(tgt, memory, cache, memory_key_padding_mask=memory_key_padding_mask)
+    output = tgt
+    for i, layer in enumerate(decoder.layers):
+        output = _stock_decoder_layer_step(layer, output, memory, cache.layers[i],
+                                           memory_key_padding_mask=memory_key_padding_mask)
+    cache.length += tgt.shape[0]
+
+    if decoder.norm is not None:
+        output = decoder.norm(output)
+
+    return output
+
+def _stock_decoder_layer_step(layer, tgt, memory, cache, memory_key_padding_mask=None):
+    # nn.TransformerDecoderLayer on the newest position only, same block order as its forward (norm_first)
+    self_cache = cache.setdefault('self_attn', {})
+    cross_cache = cache.setdefault('cross_attn', {})
+
+    def sa_block(x):
+        return layer.dropout1(cached_multi_head_attention_forward(layer.self_attn, x, x, self_cache))
+
+    def mha_block(x):
+        return layer.dropout2(cached_multi_head_attention_forward(layer.multihead_attn, x, memory, cross_cache,
+                                                                  static_kv=True,
+                                                                  key_padding_mask=memory_key_padding_mask))
+
+    def ff_block(x):
+        return layer.dropout3(layer.linear2(layer.dropout(layer.activation(layer.linear1(x)))))
+
+    x = tgt
+    if layer.norm_first:
+        x = x + sa_block(layer.norm1(x))
+        x = x + mha_block(layer.norm2(x))
+        x = x + ff_block(layer.norm3(x))
+    else:
+        x = layer.norm1(x + sa_block(x))
+        x = layer.norm2(x + mha_block(x))
+        x = layer.norm3(x + ff_block(x))
+    return x
+
+def cached_multi_head_attention_forward(attn, query, key, cache, static_kv=False,
+                                        key_padding_mask=None, rpr_mat=None):
+    """
+    Multi-head attention of the newest target position against cached keys/values.
+    query is (1, bsz, embed_dim). Without static_kv the keys/values projected from key
+    are appended to cache, with static_kv they are projected once (encoder memory).
+    rpr_mat adds the relative position term of the last row of the skewed RPR matrix.
+    """
+    tgt_len, bsz, embed_dim = query.size()
+    num_heads = attn.num_heads
+    head_dim = embed_dim // num_heads
+    assert tgt_len == 1 or static_kv, "incremental self-attention takes one position per step"
+
+    w, b = attn.in_proj_weight, attn.in_proj_bias
+    q = linear(query, w[:embed_dim], b[:embed_dim] if b is not None else None)
+
+    if not static_kv or 'k' not in cache:
+        k, v = linear(key, w[embed_dim:], b[embed_dim:] if b is not None else None).chunk(2, dim=-1)
+        k = k.contiguous().view(-1, bsz * num_heads, head_dim).transpose(0, 1)
+        v = v.contiguous().view(-1, bsz * num_heads, head_dim).transpose(0, 1)
+        if 'k' in cache:
+            k = torch.cat([cache['k'], k], dim=1)
+            v = torch.cat([cache['v'], v], dim=1)
+        cache['k'], cache['v'] = k, v
+    k, v = cache['k'], cache['v']
+    src_len = k.size(1)
+
+    q = q.contiguous().view(tgt_len, bsz * num_heads, head_dim).transpose(0, 1)
+    q = q * math.sqrt(1.0 / float(head_dim))
+
+    attn_weights = torch.bmm(q, k.transpose(1, 2))
+    if rpr_mat is not None:
+        start = max(0, rpr_mat.shape[0] - src_len)
+        attn_weights += torch.einsum("hld,md->hlm", q, rpr_mat[start:, :])
+
+    if key_padding_mask is not None:
+        attn_weights = attn_weights.view(bsz, num_heads, tgt_len, src_len)
+        attn_weights = attn_weights.masked_fill(
+            key_padding_mask.unsqueeze(1).unsqueeze(2),
+            float('-inf'),
+        )
+        attn_weights = attn_weights.view(bsz * num_heads, tgt_len, src_len)
+
+    attn_weights = softmax(attn_weights, dim=-1)
+    attn_output = torch.bmm(attn_weights, v)
+    attn_output = attn_output.transpose(0, 1).contiguous().view(tgt_len, bsz, embed_dim)
+    return linear(attn_output, attn.out_proj.weight, attn.out_proj.bias)
+
 class TransformerEncoderLayer(Module):
     def __init__(self, self_att_layer, ff_layer, pre_norm=False, norm=None, dropout=0.1):
         super(TransformerEncoderLayer, self).__init__()
@@ -1291,6 +1483,41 @@ class TransformerDecoderLayer(Module):
             tgt = tgt + tgt2
         return tgt
 
+    def supports_kv_cache(self):
+        return supports_kv_cache(self.self_attn) and supports_kv_cache(self.cross_attn)
+
+    def forward_step(self, tgt, memory, cache, memory_key_padding_mask=None):
+        # tgt is only the newest position, cache is this layer's dict of a KVCache
+        self_cache = cache.setdefault('self_attn', {})
+        cross_cache = cache.setdefault('cross_attn', {})
+        if self.pre_norm == False:
+            tgt2 = cached_multi_head_attention_forward(self.self_attn, tgt, tgt, self_cache)
+            tgt = tgt + tgt2
+            tgt = self.norm1(tgt)
+
+            tgt2 = cached_multi_head_attention_forward(self.cross_attn, tgt, memory, cross_cache, static_kv=True,
+                                                       key_padding_mask=memory_key_padding_mask)
+            tgt = tgt + tgt2
+            tgt = self.norm2(tgt)
+
+            tgt2 = self.ff(tgt)
+            tgt = tgt + tgt2
+            tgt = self.norm3(tgt)
+        else:
+            tgt2 = self.norm1(tgt)
+            tgt2 = cached_multi_head_attention_forward(self.self_attn, tgt2, tgt2, self_cache)
+            tgt = tgt + tgt2
+
+            tgt2 = self.norm2(tgt)
+            tgt2 = cached_multi_head_attention_forward(self.cross_attn, tgt2, memory, cross_cache, static_kv=True,
+                                                       key_padding_mask=memory_key_padding_mask)
+            tgt = tgt + tgt2
+
+            tgt2 = self.norm3(tgt)
+            tgt2 = self.ff(tgt2)
+            tgt = tgt + tgt2
+        return tgt
+
 class RoSCTransformerEncoderLayer(Module):
     def __init__(self, self_att_layer, ff_layer, norm=None, dropout=0.1, angle_decay=False):
         super(RoSCTransformerEncoderLayer, self).__init__()
@@ -1397,6 +1624,22 @@ class TransformerDecoder(Module):
             output = self.norm(output)
 
         return output
+
+    def supports_kv_cache(self):
+        return all(mod.supports_kv_cache() for mod in self.layers)
+
+    def forward_step(self, tgt, memory, cache, memory_key_padding_mask=None):
+        # Decodes the newest position only, see KVCache
+        output = tgt
+        for i, mod in enumerate(self.layers):
+            output = mod.forward_step(output, memory, cache.layers[i],
+                                      memory_key_padding_mask=memory_key_padding_mask)
+        cache.length += tgt.shape[0]
+
+        if self.norm is not None:
+            output = self.norm(output)
+
+        return output
     
 class TransformerEncoderShorter(Module):
     def __init__(self, encoder_layers, norm=None):
@@ -1431,3 +1674,19 @@ class TransformerDecoderShorter(Module):
             output = self.norm(output)
 
         return output
+
+    def supports_kv_cache(self):
+        return all(mod.supports_kv_cache() for mod in self.layers)
+
+    def forward_step(self, tgt, memory, cache, memory_key_padding_mask=None):
+        # Decodes the newest position only, see KVCache
+        output = tgt
+        for i, mod in enumerate(self.layers):
+            output = mod.forward_step(output, memory, cache.layers[i],
+                                      memory_key_padding_mask=memory_key_padding_mask)
+        cache.length += tgt.shape[0]
+
+        if self.norm is not None:
+            output = self.norm(output)
+
+        return output
@@ -169,6 +169,39 @@ def scaled_dot_product_gqa(
 
     return out, attn_weights
 
+def fused_scaled_dot_product_gqa(
+    query: Tensor,
+    key: Tensor,
+    value: Tensor,
+    dropout: float = 0.0,
+    is_causal: bool = False,
+):
+    """scaled_dot_product_gqa without masks and attention weights on F.scaled_dot_product_attention.
+
+    Args:
+        query: Query tensor of shape (b, n, h, d)
+        key: Key tensor of shape (b, s, h_kv, d)
+        value: Value tensor of shape (b, s, h_kv, d)
+
+    Returns:
+        2-tuple of:
+        - Attention output with shape (n, b, h, d), like scaled_dot_product_gqa
+        - None
+    """
+    query = rearrange(query, "b n h d -> b h n d")
+    key = rearrange(key, "b s h d -> b h s d")
+    value = rearrange(value, "b s h d -> b h s d")
+
+    # Query head i attends to key/value head i // num_head_groups, the "(h g)" grouping above
+    num_head_groups = query.shape[1] // key.shape[1]
+    if num_head_groups > 1:
+        key = key.repeat_interleave(num_head_groups, dim=1)
+        value = value.repeat_interleave(num_head_groups, dim=1)
+
+    out = F.scaled_dot_product_attention(query, key, value, dropout_p=dropout, is_causal=is_causal)
+    out = rearrange(out, "b h n d -> n b h d")
+    return out, None
+
 class MultiheadGQA(Module):
     """Multi-head grouped query attention (GQA) layer.
 
@@ -203,7 +236,8 @@ class MultiheadGQA(Module):
         gamma_init: float = 1.0,
         device: Optional[Union[torch.device, str]] = None,
         dtype: Optional[torch.dtype] = None,
-        RoPE = None # OUR MODIFY
+        RoPE = None, # OUR MODIFY
+        attn_backend: str = 'reference'
     ):
         super().__init__()
         self.query_heads = query_heads
@@ -213,6 +247,8 @@ class MultiheadGQA(Module):
         self.gamma_init = gamma_init
         self.RoPE = copy.deepcopy(RoPE) # OUR MODIFY
         self.embed_dim = embed_dim
+        # 'reference' or 'sdpa', see set_attention_backend in custom_transformer.py
+        self.attn_backend = attn_backend
 
         if self.query_heads % self.kv_heads != 0:
             raise ValueError(
@@ -330,18 +366,26 @@ class MultiheadGQA(Module):
         k = rearrange(k, "b n (h d) -> b n h d", h=self.kv_heads)
         v = rearrange(v, "b n (h d) -> b n h d", h=self.kv_heads)
         # Apply attention, then fold 'h' attention heads back into 'd'.
-        x, attn = scaled_dot_product_gqa(
-            query=q,
-            key=k,
-            value=v,
-            num_heads=self.query_heads,
-            # TODO
-            attn_mask=None,
-            key_padding_mask=key_padding_mask,
-            is_causal=is_causal,
-            need_weights=need_weights,
-            average_attn_weights=average_attn_weights
-        )
+        if self.attn_backend == 'sdpa' and key_padding_mask is None and not need_weights:
+            x, attn = fused_scaled_dot_product_gqa(
+                query=q,
+                key=k,
+                value=v,
+                is_causal=is_causal
+            )
+        else:
+            x, attn = scaled_dot_product_gqa(
+                query=q,
+                key=k,
+                value=v,
+                num_heads=self.query_heads,
+                # TODO
+                attn_mask=None,
+                key_padding_mask=key_padding_mask,
+                is_causal=is_causal,
+                need_weights=need_weights,
+                average_attn_weights=average_attn_weights
+            )
         x = rearrange(x, "b n h d -> b n (h d)")
 
         # NOTE: This is different from 'nn.MultiheadAttention'!  We follow the MAGNETO
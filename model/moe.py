@@ -17,8 +17,6 @@ from utilities.device import get_device
 from efficient_kan import KANLinear
 import copy
 from utilities.argument_funcs import parse_train_args
-from third_party.log_experts import update_expert_counts
-from third_party.log_maxvio import update_maxvio
 
 import os
 
@@ -146,6 +144,91 @@ class ShannonEntropy(Module):
 
 #         self.optim.zero_grad()
 
+def can_fuse_experts(experts):
+    # Clones of one GLU expert can run as batched matmuls, anything else (KAN, Sequential) uses the loop
+    expert_type = type(experts[0])
+    return expert_type in (GLUExpert, AngleGLUExpert) and all(type(expert) is expert_type for expert in experts)
+
+def stack_glu_experts(experts):
+    # Expert weights as (n_experts, in, out) and biases as (n_experts, 1, out), ready for baddbmm
+    stacked = []
+    for name in ('linear1', 'gate', 'linear2'):
+        linears = [getattr(expert, name) for expert in experts]
+        stacked.append(torch.stack([linear.weight.t() for linear in linears], dim=0))
+        stacked.append(torch.stack([linear.bias for linear in linears], dim=0).unsqueeze(1))
+    return tuple(stacked)
+
+def dispatch_experts_loop(x, weights, selected_experts, experts, dropout, out):
+    # Reference dispatch: one gather / expert / scatter per expert
+    for i, expert in enumerate(experts):
+        token_idx, batch_idx, topk_idx = torch.where(selected_experts == i)
+
+        if token_idx.shape[0] == 0:
+            continue
+
+        weight = weights[token_idx, batch_idx, topk_idx]
+        out[token_idx, batch_idx] += weight.unsqueeze(1) * dropout(expert(x[token_idx, batch_idx]))
+    return out
+
+def dispatch_experts(x, weights, selected_experts, stacked, dropout, out, expert_dropout=None):
+    # Vectorized dispatch for GLU experts (see stack_glu_experts): the (token, expert) assignments are sorted
+    # by expert once and all experts run as one batched matmul over a zero-padded (n_experts, capacity, d_model)
+    # block. The contributions of a token are added in expert order, like dispatch_experts_loop.
+    w1, b1, wg, bg, w2, b2 = stacked
+    n_experts = w1.shape[0]
+    k = selected_experts.shape[-1]
+    x_flat = x.reshape(-1, x.shape[-1])
+    n_tokens = x_flat.shape[0]
+
+    selected_experts, perm = torch.sort(selected_experts.reshape(n_tokens, k), dim=-1)
+    weights = torch.gather(weights.reshape(n_tokens, k), -1, perm)
+
+    flat_experts = selected_experts.reshape(-1)
+    order = torch.argsort(flat_experts, stable=True)
+    sorted_experts = flat_experts[order]
+    counts = torch.bincount(flat_experts, minlength=n_experts)
+    offsets = torch.cumsum(counts, dim=0) - counts
+    slot = torch.arange(order.shape[0], device=x.device) - offsets[sorted_experts]
+    capacity = int(counts.max())
+
+    x_padded = x_flat.new_zeros((n_experts, capacity, x_flat.shape[-1]))
+    x_padded = x_padded.index_put((sorted_experts, slot), x_flat[order // k])
+
+    x_ff = torch.baddbmm(b1, x_padded, w1)
+    x_gated = torch.baddbmm(bg, x_padded, wg)
+    x_ff = x_ff * F.silu(x_gated)
+    if expert_dropout is not None:
+        x_ff = expert_dropout(x_ff)
+    y_padded = torch.baddbmm(b2, x_ff, w2)
+
+    # Back to (token, k) order
+    y = y_padded[sorted_experts, slot][torch.argsort(order)]
+    y = weights.unsqueeze(-1) * dropout(y).reshape(n_tokens, k, -1)
+
+    out_flat = out.reshape(n_tokens, -1)
+    for i in range(k):
+        out_flat = out_flat + y[:, i]
+    return out_flat.reshape(out.shape)
+
+def layer_stacked_experts(layer):
+    # Stacked expert weights of a MoE layer (MoELayer, SharedMoELayer) for dispatch_experts. Without autograd
+    # they are kept on the layer and only rebuilt once a parameter changed (optimizer step, load_state_dict,
+    # .to(device))
+    if torch.is_grad_enabled():
+        return stack_glu_experts(layer.experts)
+    key = tuple((p.data_ptr(), p._version) for p in layer.experts.parameters())
+    if layer._stacked_key != key:
+        layer._stacked = stack_glu_experts(layer.experts)
+        layer._stacked_key = key
+    return layer._stacked
+
+def dispatch_layer_experts(layer, x, weights, selected_experts, out):
+    # Expert dispatch of a MoE layer, fused unless layer.fused_dispatch is False
+    if layer.fused_dispatch:
+        return dispatch_experts(x, weights, selected_experts, layer_stacked_experts(layer), layer.dropout, out,
+                                getattr(layer.experts[0], 'dropout', None))
+    return dispatch_experts_loop(x, weights, selected_experts, layer.experts, layer.dropout, out)
+
 # Source: https://www.facebook.com/photo?fbid=122146963988123211&set=pcb.122146964084123211
 class MoELayer(Module):
     def __init__(self, expert, d_model, n_experts=8, n_experts_per_token=2, dropout=0.1, topk_scheduler=None, temperature_scheduler=None):
@@ -157,6 +240,16 @@ class MoELayer(Module):
         self.experts = _get_clones(expert, n_experts)
         self.gate = nn.Linear(d_model, n_experts)
 
+        # Set fused_dispatch = False to run the per-expert loop instead
+        self.fused_dispatch = can_fuse_experts(self.experts)
+        self._stacked = None
+        self._stacked_key = None
+
+        # Routing statistics, off by default, see model/routing_stats.py
+        self.routing_stats = None
+        self.routing_layer_idx = 0
+        self.routing_batch_first = False
+
         # If has topk scheduler then no need n_experts and n_experts_per_token
         if topk_scheduler is not None:
             self.topk_scheduler = topk_scheduler
@@ -180,25 +273,14 @@ class MoELayer(Module):
         gate_logits = self.gate(x) / t
 
         weights, selected_experts = torch.topk(gate_logits, k)
-        c = torch.bincount(selected_experts.flatten(), minlength=6).to(torch.float)
-        if not self.training:
-                # Logging
-                update_maxvio(c)       
-        # Logging
-        update_expert_counts(selected_experts, self.training)
-        
+        if self.routing_stats is not None and not self.training:
+            self.routing_stats.record(self.routing_layer_idx, selected_experts, self.routing_batch_first)
+
         weights = softmax(weights, dim=-1, dtype=torch.float).to(get_device())
         out = torch.zeros_like(x)
-        for i, expert in enumerate(self.experts):
-            token_idx, batch_idx, topk_idx = torch.where(selected_experts == i)
-
-            if token_idx.shape[0] == 0:
-                continue
-
-            weight = weights[token_idx, batch_idx, topk_idx]
-            out[token_idx, batch_idx] += weight.unsqueeze(1) * self.dropout(expert(x[token_idx, batch_idx]))
+        out = dispatch_layer_experts(self, x, weights, selected_experts, out)
         return out
-    
+
 class SharedMoELayer(Module):
     def __init__(self, expert, d_model, n_experts=8, n_experts_per_token=2, dropout=0.1, balancing=False, topk_scheduler=None, temperature_scheduler=None, use_KAN=False):
         super(SharedMoELayer, self).__init__()
@@ -209,6 +291,16 @@ class SharedMoELayer(Module):
         self.experts = _get_clones(expert, n_experts)
         self.balancing = balancing
 
+        # Set fused_dispatch = False to run the per-expert loop instead
+        self.fused_dispatch = can_fuse_experts(self.experts)
+        self._stacked = None
+        self._stacked_key = None
+
+        # Routing statistics, off by default, see model/routing_stats.py
+        self.routing_stats = None
+        self.routing_layer_idx = 0
+        self.routing_batch_first = False
+
         # If has topk scheduler then no need n_experts and n_experts_per_token
         if topk_scheduler is not None:
             self.topk_scheduler = topk_scheduler
@@ -245,14 +337,6 @@ class SharedMoELayer(Module):
 
         if not self.balancing:
             weights, selected_experts = torch.topk(gate_logits, k)
-
-            c = torch.bincount(selected_experts.flatten(), minlength=6).to(torch.float)
-            # c = torch.cat((torch.tensor([0]).to(get_device()), c))
-            # c = c[1:]
-
-            if not self.training:
-                # Logging
-                update_maxvio(c)
         else:
             b = self.bias.T.unsqueeze(0)
             if self.training:
@@ -267,35 +351,25 @@ class SharedMoELayer(Module):
                 # Only get gate_logits
                 weights = torch.gather(gate_logits, dim=-1, index=selected_experts)
 
-            c = torch.bincount(selected_experts.flatten(), minlength=6).to(self.bias.dtype)
-            # c = torch.cat((torch.tensor([0]).to(get_device()), c))
-            # c = c[1:]
-
             if self.training: 
+                c = torch.bincount(selected_experts.flatten(), minlength=6).to(self.bias.dtype)
+                # c = torch.cat((torch.tensor([0]).to(get_device()), c))
+                # c = c[1:]
+
                 c_mean = torch.mean(c)
                 e = c_mean - c
 
                 e = e.unsqueeze(1)
                 self.bias += self.update_rate * e
                 # self.bias += self.update_rate * torch.sign(e)
-            else:
-                # Logging
-                update_maxvio(c)
-        
-        # Logging
-        update_expert_counts(selected_experts, self.training)
+
+        if self.routing_stats is not None and not self.training:
+            self.routing_stats.record(self.routing_layer_idx, selected_experts, self.routing_batch_first)
 
         weights = softmax(weights / t, dim=-1, dtype=torch.float).to(get_device())
         # weights = F.sigmoid(weights / t).to(get_device())
         out = torch.zeros((*x.shape[:-1], self.d_model), device=get_device())
-        for i, expert in enumerate(self.experts):
-            token_idx, batch_idx, topk_idx = torch.where(selected_experts == i)
-            
-            if token_idx.shape[0] == 0:
-                continue
-
-            weight = weights[token_idx, batch_idx, topk_idx]
-            out[token_idx, batch_idx] += weight.unsqueeze(1) * self.dropout(expert(x[token_idx, batch_idx]))
+        out = dispatch_layer_experts(self, x, weights, selected_experts, out)
 
         # Sharing
         out += 1.0 / k * self.shared_expert(x)
@@ -358,9 +432,6 @@ class SharedMoELayer(Module):
         
 #         weights, selected_experts = self.gate(x, k, t)
 
-#         # Logging
-#         update_expert_counts(selected_experts)
-
 #         out = torch.zeros_like(x)
 #         for i, expert in enumerate(self.experts):
 #             token_idx, batch_idx, topk_idx = torch.where(selected_experts == i)
@@ -8,7 +8,7 @@ from utilities.device import get_device
 
 from .positional_encoding import PositionalEncoding
 from .rpr import TransformerEncoderRPR, TransformerEncoderLayerRPR
-import json
+from utilities.chord_vocab import get_chord_vocab
 # MusicTransformer
 class MusicTransformer(nn.Module):
     def __init__(self, n_layers=6, num_heads=8, d_model=512, dim_feedforward=1024,
@@ -100,12 +100,7 @@ class MusicTransformer(nn.Module):
     def generate(self, feature_key=None, primer=None, primer_root=None, primer_attr=None, target_seq_length=300, beam=0, beam_chance=1.0):
         assert (not self.training), "Cannot generate while in training mode"
 
-        with open('dataset/vevo_meta/chord_inv.json') as json_file:
-            chordInvDic = json.load(json_file)
-        with open('dataset/vevo_meta/chord_root.json') as json_file:
-            chordRootDic = json.load(json_file)
-        with open('dataset/vevo_meta/chord_attr.json') as json_file:
-            chordAttrDic = json.load(json_file)
+        chord_vocab = get_chord_vocab()
 
         print("Generating sequence of max length:", target_seq_length)
         gen_seq = torch.full((1,target_seq_length), CHORD_PAD, dtype=TORCH_LABEL_TYPE, device=get_device())
@@ -142,23 +137,8 @@ class MusicTransformer(nn.Module):
                 next_token = distrib.sample()
                 #print("next token:",next_token)
                 gen_seq[:, cur_i] = next_token
-                gen_chord = chordInvDic[ str( next_token.item() ) ]
-                
-                chord_arr = gen_chord.split(":")
-                if len(chord_arr) == 1:
-                    chordRootID = chordRootDic[chord_arr[0]]
-                    chordAttrID = 1
-                    chordRootID = torch.tensor([chordRootID]).to(get_device())
-                    chordAttrID = torch.tensor([chordAttrID]).to(get_device())
-                    gen_seq_root[:, cur_i] = chordRootID
-                    gen_seq_attr[:, cur_i] = chordAttrID
-                elif len(chord_arr) == 2:
-                    chordRootID = chordRootDic[chord_arr[0]]
-                    chordAttrID = chordAttrDic[chord_arr[1]]
-                    chordRootID = torch.tensor([chordRootID]).to(get_device())
-                    chordAttrID = torch.tensor([chordAttrID]).to(get_device())
-                    gen_seq_root[:, cur_i] = chordRootID
-                    gen_seq_attr[:, cur_i] = chordAttrID
+                gen_seq_root[:, cur_i] = chord_vocab.tensor("chord_root")[next_token]
+                gen_seq_attr[:, cur_i] = chord_vocab.tensor("chord_quality")[next_token]
                     
                 # Let the transformer decide to end if it wants to
                 if(next_token == CHORD_END):
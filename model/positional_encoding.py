@@ -18,6 +18,7 @@ class PositionalEncoding(nn.Module):
         pe = pe.unsqueeze(0).transpose(0, 1)
         self.register_buffer('pe', pe)
 
-    def forward(self, x):
-        x = x + self.pe[:x.size(0), :]
+    def forward(self, x, offset=0):
+        # offset: position of the first element of x, used by incremental decoding
+        x = x + self.pe[offset:offset + x.size(0), :]
         return self.dropout(x)
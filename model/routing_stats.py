@@ -0,0 +1,97 @@
+import threading
+
+import torch
+
+from .moe import MoELayer, SharedMoELayer
+
+class RoutingStats(object):
+    """
+    MoE routing statistics of one model, see attach_routing_stats.
+
+    counts[layer, expert, emotion] is the number of tokens the layer-th MoE layer of the model routed to expert,
+    split by the dominant emotion of the token (time step). The last emotion column holds the tokens without
+    emotion (padding) or with unknown emotion. Counts are accumulated on the device of the model, nothing is
+    copied to the host until get_counts / maxvio are called. Only eval-mode forwards are recorded.
+
+    Labels of a single video are shared by all rows of a batched decode of it (num_samples candidates).
+    Emotion labels and decoding offsets are kept per thread and counts are updated under a lock, so one model
+    can serve concurrent requests.
+    """
+    def __init__(self, n_layers, n_experts=6, n_emotions=6, device=None):
+        self.n_layers = n_layers
+        self.n_experts = n_experts
+        self.n_emotions = n_emotions
+        self.counts = torch.zeros((n_layers, n_experts, n_emotions + 1), dtype=torch.long, device=device)
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def set_emotion(self, feature_emotion):
+        # feature_emotion (batch_size, seq_len, n_emotions) of the current forward, one label per time step
+        labels = torch.argmax(feature_emotion, dim=-1)
+        labels = labels.masked_fill((feature_emotion == 0).all(dim=-1), self.n_emotions)
+        self._local.labels = labels
+        self._local.offset = 0
+
+    def set_offset(self, offset):
+        # Time step of the first token of the next forward (incremental decoding)
+        self._local.offset = offset
+
+    def record(self, layer_idx, selected_experts, batch_first=False):
+        # selected_experts: (seq_len, batch_size, k), or (batch_size, seq_len, k) if batch_first
+        if not batch_first:
+            selected_experts = selected_experts.transpose(0, 1)
+        batch_size, seq_len = selected_experts.shape[:2]
+
+        labels = getattr(self._local, 'labels', None)
+        offset = getattr(self._local, 'offset', 0)
+        if labels is not None and labels.shape[0] == 1 and batch_size > 1:
+            # One video decoded as batch_size samples (generate_batch), against expanded memory
+            labels = labels.expand(batch_size, -1)
+        if labels is None or labels.shape[0] != batch_size or offset + seq_len > labels.shape[1]:
+            labels = torch.full((batch_size, seq_len), self.n_emotions, dtype=torch.long, device=selected_experts.device)
+        else:
+            labels = labels[:, offset:offset + seq_len].to(selected_experts.device)
+
+        # Flat (expert, emotion) index, index_add_ avoids the host sync of bincount on cuda
+        idx = selected_experts * (self.n_emotions + 1) + labels.unsqueeze(-1)
+        idx = idx.flatten().to(self.counts.device)
+        with self._lock:
+            self.counts[layer_idx].view(-1).index_add_(0, idx, torch.ones_like(idx))
+
+    def get_counts(self):
+        with self._lock:
+            return self.counts.clone()
+
+    def reset(self):
+        with self._lock:
+            self.counts.zero_()
+
+    def maxvio(self, per_layer=False):
+        # Maximal load violation (max_load - mean_load) / mean_load, of the load summed over layers or per layer
+        load = self.get_counts().sum(dim=-1).float()
+        if not per_layer:
+            load = load.sum(dim=0)
+        load_mean = load.mean(dim=-1)
+        return (load.max(dim=-1)[0] - load_mean) / load_mean
+
+def attach_routing_stats(model, batch_first=False, n_emotions=6):
+    # Attaches a new RoutingStats to model and all its MoE layers (in module order) and returns it.
+    # batch_first: layout of the MoE inputs, False for the transformers, True for VideoRegression
+    moe_layers = [module for module in model.modules() if isinstance(module, (MoELayer, SharedMoELayer))]
+    n_experts = max([layer.n_experts for layer in moe_layers], default=0)
+    device = next(model.parameters()).device
+    routing_stats = RoutingStats(len(moe_layers), n_experts, n_emotions, device=device)
+
+    for layer_idx, layer in enumerate(moe_layers):
+        layer.routing_stats = routing_stats
+        layer.routing_layer_idx = layer_idx
+        layer.routing_batch_first = batch_first
+    model.routing_stats = routing_stats
+    return routing_stats
+
+def detach_routing_stats(model):
+    for module in model.modules():
+        if isinstance(module, (MoELayer, SharedMoELayer)):
+            module.routing_stats = None
+    model.routing_stats = None
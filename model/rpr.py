@@ -13,6 +13,13 @@ from torch.nn.init import *
 from torch.nn.functional import linear, softmax, dropout
 from torch.nn import MultiheadAttention
 from typing import Optional
+from functools import lru_cache
+from .custom_transformer import supports_kv_cache, cached_multi_head_attention_forward
+
+# Attention kinds of multi_head_attention_forward_rpr, decide which in-projections are shared
+ATTN_SELF = "self"          # query, key and value are the same tensor
+ATTN_ENCDEC = "encdec"      # key and value are the same tensor (encoder-decoder attention)
+ATTN_GENERAL = "general"    # separate query, key and value
 
 class TransformerDecoderRPR(Module):
     def __init__(self, decoder_layer, num_layers, norm=None):
@@ -33,6 +40,22 @@ class TransformerDecoderRPR(Module):
             output = self.norm(output)
 
         return output
+
+    def supports_kv_cache(self):
+        return all(mod.supports_kv_cache() for mod in self.layers)
+
+    def forward_step(self, tgt, memory, cache, memory_key_padding_mask=None):
+        # Decodes the newest position only, see KVCache
+        output = tgt
+        for i, mod in enumerate(self.layers):
+            output = mod.forward_step(output, memory, cache.layers[i],
+                                      memory_key_padding_mask=memory_key_padding_mask)
+        cache.length += tgt.shape[0]
+
+        if self.norm is not None:
+            output = self.norm(output)
+
+        return output
     
 class TransformerDecoderLayerRPR(Module):
     def __init__(self, d_model, nhead, dim_feedforward=2048, dropout=0.1, er_len=None):
@@ -55,7 +78,7 @@ class TransformerDecoderLayerRPR(Module):
     def forward(self, tgt, memory, tgt_mask=None, memory_mask=None,
                 tgt_key_padding_mask=None, memory_key_padding_mask=None, **kwargs):
         tgt2 = self.self_attn(tgt, tgt, tgt, attn_mask=tgt_mask,
-                              key_padding_mask=tgt_key_padding_mask)[0]
+                              key_padding_mask=tgt_key_padding_mask, attn_kind=ATTN_SELF)[0]
         tgt = tgt + self.dropout1(tgt2)
         tgt = self.norm1(tgt)
 
@@ -69,6 +92,25 @@ class TransformerDecoderLayerRPR(Module):
         tgt = self.norm3(tgt)
         return tgt
 
+    def supports_kv_cache(self):
+        return supports_kv_cache(self.self_attn) and supports_kv_cache(self.multihead_attn)
+
+    def forward_step(self, tgt, memory, cache, memory_key_padding_mask=None):
+        # tgt is only the newest position, the RPR term of its query is the last row of the skewed matrix
+        tgt2 = cached_multi_head_attention_forward(self.self_attn, tgt, tgt, cache.setdefault('self_attn', {}),
+                                                   rpr_mat=self.self_attn.Er)
+        tgt = tgt + self.dropout1(tgt2)
+        tgt = self.norm1(tgt)
+
+        tgt2 = cached_multi_head_attention_forward(self.multihead_attn, tgt, memory, cache.setdefault('cross_attn', {}),
+                                                   static_kv=True, key_padding_mask=memory_key_padding_mask)
+        tgt = tgt + self.dropout2(tgt2)
+        tgt = self.norm2(tgt)
+        tgt2 = self.linear2(self.dropout(F.relu(self.linear1(tgt))))
+        tgt = tgt + self.dropout3(tgt2)
+        tgt = self.norm3(tgt)
+        return tgt
+
 # TransformerEncoderRPR (only for music transformer)
 class TransformerEncoderRPR(Module):
     def __init__(self, encoder_layer, num_layers, norm=None):
@@ -100,7 +142,7 @@ class TransformerEncoderLayerRPR(Module):
         self.dropout2 = Dropout(dropout)
     def forward(self, src, src_mask=None, src_key_padding_mask=None, **kwargs):
         src2 = self.self_attn(src, src, src, attn_mask=src_mask,
-                              key_padding_mask=src_key_padding_mask)[0]
+                              key_padding_mask=src_key_padding_mask, attn_kind=ATTN_SELF)[0]
         src = src + self.dropout1(src2)
         src = self.norm1(src)
         src2 = self.linear2(self.dropout(F.relu(self.linear1(src))))
@@ -168,7 +210,7 @@ class MultiheadAttentionRPR(Module):
             xavier_normal_(self.bias_v)
 
     def forward(self, query, key, value, key_padding_mask=None,
-                need_weights=True, attn_mask=None, **kwargs):
+                need_weights=True, attn_mask=None, attn_kind=None, **kwargs):
 
         if hasattr(self, '_qkv_same_embed_dim') and self._qkv_same_embed_dim is False:
 
@@ -181,7 +223,7 @@ class MultiheadAttentionRPR(Module):
                 key_padding_mask=key_padding_mask, need_weights=need_weights,
                 attn_mask=attn_mask, use_separate_proj_weight=True,
                 q_proj_weight=self.q_proj_weight, k_proj_weight=self.k_proj_weight,
-                v_proj_weight=self.v_proj_weight, rpr_mat=self.Er)
+                v_proj_weight=self.v_proj_weight, rpr_mat=self.Er, attn_kind=attn_kind)
         else:
             if not hasattr(self, '_qkv_same_embed_dim'):
                 warnings.warn('A new version of MultiheadAttention module has been implemented. \
@@ -195,7 +237,7 @@ class MultiheadAttentionRPR(Module):
                 self.dropout, self.out_proj.weight, self.out_proj.bias,
                 training=self.training,
                 key_padding_mask=key_padding_mask, need_weights=need_weights,
-                attn_mask=attn_mask, rpr_mat=self.Er)
+                attn_mask=attn_mask, rpr_mat=self.Er, attn_kind=attn_kind)
 
 # multi_head_attention_forward_rpr
 def multi_head_attention_forward_rpr(query,                       # type: Tensor
@@ -221,7 +263,8 @@ def multi_head_attention_forward_rpr(query,                       # type: Tensor
                                  v_proj_weight=None,              # type: Optional[Tensor]
                                  static_k=None,                   # type: Optional[Tensor]
                                  static_v=None,                   # type: Optional[Tensor]
-                                 rpr_mat=None
+                                 rpr_mat=None,
+                                 attn_kind=None                   # type: Optional[str]
                                  ):
     """
     ----------
@@ -231,12 +274,16 @@ def multi_head_attention_forward_rpr(query,                       # type: Tensor
     For Relative Position Representation support (https://arxiv.org/abs/1803.02155)
     https://pytorch.org/docs/1.2.0/_modules/torch/nn/functional.html
     Modification to take RPR embedding matrix and perform skew optimized RPR (https://arxiv.org/abs/1809.04281)
+    attn_kind (ATTN_SELF, ATTN_ENCDEC or ATTN_GENERAL) selects the in-projection, if None it is
+    inferred from the inputs, see _get_attn_kind
     ----------
     """
     # type: (...) -> Tuple[Tensor, Optional[Tensor]]
 
-    qkv_same = torch.equal(query, key) and torch.equal(key, value)
-    kv_same = torch.equal(key, value)
+    if attn_kind is None:
+        attn_kind = _get_attn_kind(query, key, value)
+    qkv_same = attn_kind == ATTN_SELF
+    kv_same = attn_kind != ATTN_GENERAL
     
     tgt_len, bsz, embed_dim = query.size()
     assert embed_dim == embed_dim_to_check
@@ -423,6 +470,15 @@ def multi_head_attention_forward_rpr(query,                       # type: Tensor
     else:
         return attn_output, None
 
+def _get_attn_kind(query, key, value):
+    # Attention kind of query, key and value. The same tensor object is recognised without looking
+    # at the data, torch.equal (full elementwise compare) is only used for distinct tensor objects
+    if key is value or torch.equal(key, value):
+        if query is key or torch.equal(query, key):
+            return ATTN_SELF
+        return ATTN_ENCDEC
+    return ATTN_GENERAL
+
 def _get_valid_embedding(Er, len_q, len_k):
     """
     ----------
@@ -434,8 +490,14 @@ def _get_valid_embedding(Er, len_q, len_k):
 
     len_e = Er.shape[0]
     start = max(0, len_e - len_q)
+    # Row slice of Er, a contiguous view (no copy) that follows the parameter updates
     return Er[start:, :]
 
+@lru_cache(maxsize=64)
+def _get_skew_mask(sz, device, dtype):
+    # Flipped upper triangular (sz, sz) mask of _skew, cached per length, device and dtype
+    return (torch.triu(torch.ones(sz, sz, device=device)) == 1).to(dtype).flip(0)
+
 def _skew(qe):
     """
     ----------
@@ -445,7 +507,7 @@ def _skew(qe):
     ----------
     """
     sz = qe.shape[1]
-    mask = (torch.triu(torch.ones(sz, sz).to(qe.device)) == 1).float().flip(0)
+    mask = _get_skew_mask(sz, qe.device, qe.dtype)
 
     qe = mask * qe
     qe = F.pad(qe, (1,0, 0,0, 0,0))
@@ -13,12 +13,82 @@ from .grouped_query_attention import *
 from .rotate_operation import *
 from .moe import *
 from datetime import datetime
-import json
+from utilities.chord_vocab import get_chord_vocab
 from gensim.models import Word2Vec
-from third_party.log_experts import get_highest_emotion_indices
 
 chordEmbeddingModelPath = './word2vec_filled.bin'
 
+def _generate_batch(model, feature_semantic_list, feature_key, feature_scene_offset, feature_motion, feature_emotion,
+                    primer, primer_root, primer_attr, num_samples, target_seq_length, max_conseq_N, max_conseq_chord,
+                    temperature, use_cache, memory):
+    # Shared by the generate_batch methods: samples num_samples chord sequences for one video in parallel.
+    # Rows stop independently, a finished row holds CHORD_END followed by CHORD_PAD.
+    # Per-row inputs (one video per row) are also accepted: memory / features with batch num_samples,
+    # feature_key of shape (num_samples, 1), primers of shape (num_samples, P) and a temperature per row.
+    assert (not model.training), "Cannot generate while in training mode"
+    print("Generating", num_samples, "sequences of max length:", target_seq_length)
+
+    # chord id -> root / attr id, same mapping as generate
+    chord_vocab = get_chord_vocab()
+    chord_to_root = chord_vocab.tensor("chord_root")
+    chord_to_attr = chord_vocab.tensor("chord_quality")
+
+    gen_seq = torch.full((num_samples,target_seq_length), CHORD_PAD, dtype=TORCH_LABEL_TYPE, device=get_device())
+    gen_seq_root = torch.full((num_samples,target_seq_length), CHORD_ROOT_PAD, dtype=TORCH_LABEL_TYPE, device=get_device())
+    gen_seq_attr = torch.full((num_samples,target_seq_length), CHORD_ATTR_PAD, dtype=TORCH_LABEL_TYPE, device=get_device())
+
+    num_primer = primer.shape[-1]
+    gen_seq[..., :num_primer] = primer.type(TORCH_LABEL_TYPE).to(get_device())
+    gen_seq_root[..., :num_primer] = primer_root.type(TORCH_LABEL_TYPE).to(get_device())
+    gen_seq_attr[..., :num_primer] = primer_attr.type(TORCH_LABEL_TYPE).to(get_device())
+
+    # Encode the video once and share the memory between all samples
+    if memory is None:
+        memory = model.encode_video(feature_semantic_list, feature_scene_offset, feature_motion, feature_emotion)
+    if memory.shape[1] != num_samples:
+        memory = memory.expand(-1, num_samples, -1)
+    if feature_key.dim() > 1 and feature_key.shape[0] != num_samples:
+        feature_key = feature_key[:1].expand(num_samples, -1)
+    if torch.is_tensor(temperature):
+        temperature = temperature.to(get_device()).reshape(-1, 1, 1)
+    cache = model.init_cache() if use_cache else None
+
+    finished = torch.zeros(num_samples, dtype=torch.bool, device=get_device())
+    cur_i = num_primer
+    while(cur_i < target_seq_length):
+        y = model.softmax( model.decode( memory, gen_seq[..., :cur_i], gen_seq_root[..., :cur_i], gen_seq_attr[..., :cur_i],
+                                        feature_key, cache) / temperature)[..., :CHORD_END + 1]
+
+        # token_probs.shape : [num_samples, 158], CHORD_END included so that rows can end, CHORD_PAD excluded
+        token_probs = y[:, -1, :]
+        if max_conseq_N == 0:
+            token_probs[:, 0] = 0.0
+
+        # Ban the previous chord of the rows that already repeated it max_conseq_chord times
+        if cur_i >= max_conseq_chord:
+            preChord = gen_seq[:, cur_i-1]
+            isMaxChord = (gen_seq[:, cur_i-max_conseq_chord:cur_i] == preChord.unsqueeze(1)).all(dim=1)
+            banned = torch.arange(CHORD_END + 1, device=get_device()).unsqueeze(0) == preChord.unsqueeze(1)
+            token_probs = token_probs.masked_fill(banned & isMaxChord.unsqueeze(1), 0.0)
+
+        distrib = torch.distributions.categorical.Categorical(probs=token_probs)
+        next_token = distrib.sample()
+        next_token = torch.where(finished, torch.full_like(next_token, CHORD_PAD), next_token)
+
+        gen_seq[:, cur_i] = next_token
+        gen_seq_root[:, cur_i] = chord_to_root[next_token]
+        gen_seq_attr[:, cur_i] = chord_to_attr[next_token]
+
+        # Let the transformer decide to end if it wants to, per row
+        finished = finished | (next_token == CHORD_END)
+        cur_i += 1
+        if finished.all():
+            print("Model called end of all sequences at:", cur_i, "/", target_seq_length)
+            break
+        if(cur_i % 50 == 0):
+            print(cur_i, "/", target_seq_length)
+    return gen_seq[:, :cur_i]
+
 class VideoMusicTransformer_V1(nn.Module):
     def __init__(self, version_name='1.1', n_layers=6, num_heads=8, d_model=512, dim_feedforward=1024,
                  dropout=0.1, max_sequence_midi =2048, max_sequence_video=300, 
@@ -26,6 +96,9 @@ class VideoMusicTransformer_V1(nn.Module):
                  chord_embed=False, dropTokenRate=0.0):
         super(VideoMusicTransformer_V1, self).__init__()
 
+        # MoE routing statistics, see model/routing_stats.py
+        self.routing_stats = None
+
         self.nlayers    = n_layers
         self.nhead      = num_heads
         self.d_model    = d_model
@@ -139,12 +212,8 @@ class VideoMusicTransformer_V1(nn.Module):
         del norm, expert, att, moelayer
         torch.cuda.empty_cache()
 
-    def forward(self, x, x_root, x_attr, feature_semantic_list, feature_key, feature_scene_offset, feature_motion, feature_emotion, mask=True):
-        if(mask is True):
-            mask = self.transformer.generate_square_subsequent_mask(x.shape[1]).to(get_device())
-        else:
-            mask = None
-        
+    def _embed_chord(self, x, x_root, x_attr, feature_key, offset=0):
+        # Chord (DECODER) input -> (seq_len, batch_size, d_model), offset is the position of x[:, 0]
         if not self.chord_embed:
             x_root = self.embedding_root(x_root)
             x_attr = self.embedding_attr(x_attr)
@@ -165,6 +234,17 @@ class VideoMusicTransformer_V1(nn.Module):
 
         xf = self.Linear_chord(x)
 
+        ### POSITIONAL EMBEDDING ###
+        xf = xf.permute(1,0,2) # -> (max_seq-1, batch_size, d_model)
+
+        # Generate position indices
+        xf_position_indices = torch.arange(offset, offset + xf.shape[0]).unsqueeze(1).expand(xf.shape[0], xf.shape[1]).to(get_device())
+        xf += self.positional_embedding(xf_position_indices)
+
+        del xf_position_indices
+        return xf
+
+    def _embed_video(self, feature_semantic_list, feature_scene_offset, feature_motion, feature_emotion):
         ### Video (SemanticList + SceneOffset + Motion + Emotion) (ENCODER) ###
         # Semantic
         vf_concat = feature_semantic_list.float() 
@@ -180,7 +260,8 @@ class VideoMusicTransformer_V1(nn.Module):
             vf_concat = torch.cat([vf_concat, feature_motion], dim=-1)
         
         # Emotion
-        get_highest_emotion_indices(feature_emotion, self.training)
+        if self.routing_stats is not None:
+            self.routing_stats.set_emotion(feature_emotion)
         vf_concat = torch.cat([vf_concat, feature_emotion.float()], dim=-1) # -> (max_seq_video, batch_size, d_model+1)
         
         # Video embedding
@@ -197,18 +278,24 @@ class VideoMusicTransformer_V1(nn.Module):
             vf = vf * droptoken_mask
 
         ### POSITIONAL EMBEDDING ###
-        xf = xf.permute(1,0,2) # -> (max_seq-1, batch_size, d_model)
         vf = vf.permute(1,0,2) # -> (max_seq_video, batch_size, d_model)
 
         # Generate position indices
-        xf_position_indices = torch.arange(xf.shape[0]).unsqueeze(1).expand(xf.shape[0], xf.shape[1]).to(get_device())
         vf_position_indices = torch.arange(vf.shape[0]).unsqueeze(1).expand(vf.shape[0], vf.shape[1]).to(get_device())
-
-        xf += self.positional_embedding(xf_position_indices)
         vf += self.positional_embedding_video(vf_position_indices)
 
-        del xf_position_indices, vf_position_indices
+        del vf_position_indices
         torch.cuda.empty_cache()
+        return vf
+
+    def forward(self, x, x_root, x_attr, feature_semantic_list, feature_key, feature_scene_offset, feature_motion, feature_emotion, mask=True):
+        if(mask is True):
+            mask = self.transformer.generate_square_subsequent_mask(x.shape[1]).to(get_device())
+        else:
+            mask = None
+        
+        xf = self._embed_chord(x, x_root, x_attr, feature_key)
+        vf = self._embed_video(feature_semantic_list, feature_scene_offset, feature_motion, feature_emotion)
 
         ### TRANSFORMER ###
         x_out = self.transformer(src=vf, tgt=xf, tgt_mask=mask)
@@ -224,19 +311,58 @@ class VideoMusicTransformer_V1(nn.Module):
             del mask
             return y
         
+    def encode_video(self, feature_semantic_list, feature_scene_offset, feature_motion, feature_emotion):
+        # Encoder memory (max_seq_video, batch_size, d_model), computed once per video and reused by decode
+        vf = self._embed_video(feature_semantic_list, feature_scene_offset, feature_motion, feature_emotion)
+        return self.transformer.encoder(vf)
+
+    def init_cache(self):
+        # KVCache for decode, None if the decoder can only run on the full prefix
+        return init_kv_cache(self.transformer.decoder)
+
+    def decode(self, memory, x, x_root, x_attr, feature_key, cache=None):
+        # Chord logits of prefix x given the encoder memory. With a cache only the positions of x
+        # that are not decoded yet are fed and the output of the last position is returned.
+        if cache is None:
+            if self.routing_stats is not None:
+                self.routing_stats.set_offset(0)
+            mask = self.transformer.generate_square_subsequent_mask(x.shape[1]).to(get_device())
+            xf = self._embed_chord(x, x_root, x_attr, feature_key)
+            x_out = self.transformer.decoder(xf, memory, tgt_mask=mask)
+        else:
+            assert cache.length < x.shape[1], "No new position to decode"
+            while cache.length < x.shape[1]:
+                i = cache.length
+                if self.routing_stats is not None:
+                    self.routing_stats.set_offset(i)
+                xf = self._embed_chord(x[..., i:i+1], x_root[..., i:i+1], x_attr[..., i:i+1], feature_key, offset=i)
+                x_out = self.transformer.decoder.forward_step(xf, memory, cache)
+        x_out = x_out.permute(1,0,2)
+
+        if IS_SEPERATED:
+            y_root = self.Wout_root(x_out)
+            y_attr = self.Wout_attr(x_out)
+            return y_root, y_attr
+        else:
+            y = self.Wout(x_out)
+            return y
+
+    def generate_batch(self, feature_semantic_list = [], feature_key=None, feature_scene_offset=None, feature_motion=None, feature_emotion=None,
+                       primer=None, primer_root=None, primer_attr=None, num_samples=1, target_seq_length=300, max_conseq_N = 0, max_conseq_chord = 2,
+                       temperature=1.0, use_cache=True, memory=None):
+        # num_samples candidate chord sequences for one video in one batched decode, see _generate_batch
+        return _generate_batch(self, feature_semantic_list, feature_key, feature_scene_offset, feature_motion, feature_emotion,
+                               primer, primer_root, primer_attr, num_samples, target_seq_length, max_conseq_N, max_conseq_chord,
+                               temperature, use_cache, memory)
+
     def generate(self, feature_semantic_list = [], feature_key=None, feature_scene_offset=None, feature_motion=None, feature_emotion=None,
                  primer=None, primer_root=None, primer_attr=None, target_seq_length=300, beam=0, beam_chance=1.0, max_conseq_N = 0, max_conseq_chord = 2,
-                 temperature=1.0):
+                 temperature=1.0, use_cache=True, memory=None):
         
         assert (not self.training), "Cannot generate while in training mode"
         print("Generating sequence of max length:", target_seq_length)
 
-        with open('dataset/vevo_meta/chord_inv.json') as json_file:
-            chordInvDic = json.load(json_file)
-        with open('dataset/vevo_meta/chord_root.json') as json_file:
-            chordRootDic = json.load(json_file)
-        with open('dataset/vevo_meta/chord_attr.json') as json_file:
-            chordAttrDic = json.load(json_file)
+        chord_vocab = get_chord_vocab()
 
         gen_seq = torch.full((1,target_seq_length), CHORD_PAD, dtype=TORCH_LABEL_TYPE, device=get_device())
         gen_seq_root = torch.full((1,target_seq_length), CHORD_ROOT_PAD, dtype=TORCH_LABEL_TYPE, device=get_device())
@@ -247,12 +373,17 @@ class VideoMusicTransformer_V1(nn.Module):
         gen_seq_root[..., :num_primer] = primer_root.type(TORCH_LABEL_TYPE).to(get_device())
         gen_seq_attr[..., :num_primer] = primer_attr.type(TORCH_LABEL_TYPE).to(get_device())
 
+        # Encode the video once, with a KV cache only the newest chord is fed per step
+        if memory is None:
+            memory = self.encode_video(feature_semantic_list, feature_scene_offset, feature_motion, feature_emotion)
+        cache = self.init_cache() if (use_cache and beam == 0) else None
+
         cur_i = num_primer
         while(cur_i < target_seq_length):
-            y = self.softmax( self.forward( gen_seq[..., :cur_i], gen_seq_root[..., :cur_i], gen_seq_attr[..., :cur_i], 
-                                           feature_semantic_list, feature_key, feature_scene_offset, feature_motion, feature_emotion) / temperature)[..., :CHORD_END]
+            y = self.softmax( self.decode( memory, gen_seq[..., :cur_i], gen_seq_root[..., :cur_i], gen_seq_attr[..., :cur_i], 
+                                          feature_key, cache) / temperature)[..., :CHORD_END]
             
-            token_probs = y[:, cur_i-1, :]
+            token_probs = y[:, -1, :]
             if(beam == 0):
                 beam_ran = 2.0
             else:
@@ -286,23 +417,8 @@ class VideoMusicTransformer_V1(nn.Module):
                 distrib = torch.distributions.categorical.Categorical(probs=token_probs)
                 next_token = distrib.sample()
                 gen_seq[:, cur_i] = next_token
-                gen_chord = chordInvDic[ str( next_token.item() ) ]
-                
-                chord_arr = gen_chord.split(":")
-                if len(chord_arr) == 1:
-                    chordRootID = chordRootDic[chord_arr[0]]
-                    chordAttrID = 1
-                    chordRootID = torch.tensor([chordRootID]).to(get_device())
-                    chordAttrID = torch.tensor([chordAttrID]).to(get_device())
-                    gen_seq_root[:, cur_i] = chordRootID
-                    gen_seq_attr[:, cur_i] = chordAttrID
-                elif len(chord_arr) == 2:
-                    chordRootID = chordRootDic[chord_arr[0]]
-                    chordAttrID = chordAttrDic[chord_arr[1]]
-                    chordRootID = torch.tensor([chordRootID]).to(get_device())
-                    chordAttrID = torch.tensor([chordAttrID]).to(get_device())
-                    gen_seq_root[:, cur_i] = chordRootID
-                    gen_seq_attr[:, cur_i] = chordAttrID
+                gen_seq_root[:, cur_i] = chord_vocab.tensor("chord_root")[next_token]
+                gen_seq_attr[:, cur_i] = chord_vocab.tensor("chord_quality")[next_token]
                     
                 # Let the transformer decide to end if it wants to
                 if(next_token == CHORD_END):
@@ -320,6 +436,9 @@ class VideoMusicTransformer_V2(nn.Module):
                  chord_embed=False, dropTokenRate=0.0, balancing=False):
         super(VideoMusicTransformer_V2, self).__init__()
 
+        # MoE routing statistics, see model/routing_stats.py
+        self.routing_stats = None
+
         self.nlayers    = n_layers
         self.nhead      = num_heads
         self.d_model    = d_model
@@ -436,12 +555,8 @@ class VideoMusicTransformer_V2(nn.Module):
         del RoPE, expert, att, moelayer
         torch.cuda.empty_cache()
 
-    def forward(self, x, x_root, x_attr, feature_semantic_list, feature_key, feature_scene_offset, feature_motion, feature_emotion, mask=True):
-        if(mask is True):
-            mask = self.transformer.generate_square_subsequent_mask(x.shape[1]).to(get_device())
-        else:
-            mask = None
-        
+    def _embed_chord(self, x, x_root, x_attr, feature_key, offset=0):
+        # Chord (DECODER) input -> (seq_len, batch_size, d_model), offset is the position of x[:, 0]
         if not self.chord_embed:
             x_root = self.embedding_root(x_root)
             x_attr = self.embedding_attr(x_attr)
@@ -460,6 +575,17 @@ class VideoMusicTransformer_V2(nn.Module):
 
         xf = self.Linear_chord(x)
 
+        xf = xf.permute(1,0,2) # -> (max_seq-1, batch_size, d_model)
+
+        if self.version_name in ('2.0'):
+            # Generate position indices
+            xf_position_indices = torch.arange(offset, offset + xf.shape[0]).unsqueeze(1).expand(xf.shape[0], xf.shape[1]).to(get_device())
+            xf += self.positional_embedding(xf_position_indices)
+
+            del xf_position_indices
+        return xf
+
+    def _embed_video(self, feature_semantic_list, feature_scene_offset, feature_motion, feature_emotion):
         ### Video (SemanticList + SceneOffset + Motion + Emotion) (ENCODER) ###
         # Semantic
         vf_concat = feature_semantic_list.float() 
@@ -475,7 +601,8 @@ class VideoMusicTransformer_V2(nn.Module):
             vf_concat = torch.cat([vf_concat, feature_motion], dim=-1)
         
         # Emotion
-        get_highest_emotion_indices(feature_emotion, self.training)
+        if self.routing_stats is not None:
+            self.routing_stats.set_emotion(feature_emotion)
         vf_concat = torch.cat([vf_concat, feature_emotion.float()], dim=-1) # -> (max_seq_video, batch_size, d_model+1)
         
         # Video embedding
@@ -491,19 +618,25 @@ class VideoMusicTransformer_V2(nn.Module):
             droptoken_mask = droptoken_mask.unsqueeze(-1).repeat(1, 1, d_model)
             vf = vf * droptoken_mask
 
-        xf = xf.permute(1,0,2) # -> (max_seq-1, batch_size, d_model)
         vf = vf.permute(1,0,2) # -> (max_seq_video, batch_size, d_model)
 
         if self.version_name in ('2.0'):
             # Generate position indices
-            xf_position_indices = torch.arange(xf.shape[0]).unsqueeze(1).expand(xf.shape[0], xf.shape[1]).to(get_device())
             vf_position_indices = torch.arange(vf.shape[0]).unsqueeze(1).expand(vf.shape[0], vf.shape[1]).to(get_device())
-
-            xf += self.positional_embedding(xf_position_indices)
             vf += self.positional_embedding_video(vf_position_indices)
 
-            del xf_position_indices, vf_position_indices
+            del vf_position_indices
             torch.cuda.empty_cache()
+        return vf
+
+    def forward(self, x, x_root, x_attr, feature_semantic_list, feature_key, feature_scene_offset, feature_motion, feature_emotion, mask=True):
+        if(mask is True):
+            mask = self.transformer.generate_square_subsequent_mask(x.shape[1]).to(get_device())
+        else:
+            mask = None
+        
+        xf = self._embed_chord(x, x_root, x_attr, feature_key)
+        vf = self._embed_video(feature_semantic_list, feature_scene_offset, feature_motion, feature_emotion)
 
         ### TRANSFORMER ###
         x_out = self.transformer(src=vf, tgt=xf, tgt_mask=mask)
@@ -519,19 +652,58 @@ class VideoMusicTransformer_V2(nn.Module):
             y = self.Wout(x_out)
             return y
         
+    def encode_video(self, feature_semantic_list, feature_scene_offset, feature_motion, feature_emotion):
+        # Encoder memory (max_seq_video, batch_size, d_model), computed once per video and reused by decode
+        vf = self._embed_video(feature_semantic_list, feature_scene_offset, feature_motion, feature_emotion)
+        return self.transformer.encoder(vf)
+
+    def init_cache(self):
+        # KVCache for decode, None if the decoder can only run on the full prefix
+        return init_kv_cache(self.transformer.decoder)
+
+    def decode(self, memory, x, x_root, x_attr, feature_key, cache=None):
+        # Chord logits of prefix x given the encoder memory. With a cache only the positions of x
+        # that are not decoded yet are fed and the output of the last position is returned.
+        if cache is None:
+            if self.routing_stats is not None:
+                self.routing_stats.set_offset(0)
+            mask = self.transformer.generate_square_subsequent_mask(x.shape[1]).to(get_device())
+            xf = self._embed_chord(x, x_root, x_attr, feature_key)
+            x_out = self.transformer.decoder(xf, memory, tgt_mask=mask)
+        else:
+            assert cache.length < x.shape[1], "No new position to decode"
+            while cache.length < x.shape[1]:
+                i = cache.length
+                if self.routing_stats is not None:
+                    self.routing_stats.set_offset(i)
+                xf = self._embed_chord(x[..., i:i+1], x_root[..., i:i+1], x_attr[..., i:i+1], feature_key, offset=i)
+                x_out = self.transformer.decoder.forward_step(xf, memory, cache)
+        x_out = x_out.permute(1,0,2)
+
+        if IS_SEPERATED:
+            y_root = self.Wout_root(x_out)
+            y_attr = self.Wout_attr(x_out)
+            return y_root, y_attr
+        else:
+            y = self.Wout(x_out)
+            return y
+
+    def generate_batch(self, feature_semantic_list = [], feature_key=None, feature_scene_offset=None, feature_motion=None, feature_emotion=None,
+                       primer=None, primer_root=None, primer_attr=None, num_samples=1, target_seq_length=300, max_conseq_N = 0, max_conseq_chord = 2,
+                       temperature=1.0, use_cache=True, memory=None):
+        # num_samples candidate chord sequences for one video in one batched decode, see _generate_batch
+        return _generate_batch(self, feature_semantic_list, feature_key, feature_scene_offset, feature_motion, feature_emotion,
+                               primer, primer_root, primer_attr, num_samples, target_seq_length, max_conseq_N, max_conseq_chord,
+                               temperature, use_cache, memory)
+
     def generate(self, feature_semantic_list = [], feature_key=None, feature_scene_offset=None, feature_motion=None, feature_emotion=None,
                  primer=None, primer_root=None, primer_attr=None, target_seq_length=300, beam=0, beam_chance=1.0, max_conseq_N = 0, max_conseq_chord = 2,
-                 temperature=1.0):
+                 temperature=1.0, use_cache=True, memory=None):
         
         assert (not self.training), "Cannot generate while in training mode"
         print("Generating sequence of max length:", target_seq_length)
 
-        with open('dataset/vevo_meta/chord_inv.json') as json_file:
-            chordInvDic = json.load(json_file)
-        with open('dataset/vevo_meta/chord_root.json') as json_file:
-            chordRootDic = json.load(json_file)
-        with open('dataset/vevo_meta/chord_attr.json') as json_file:
-            chordAttrDic = json.load(json_file)
+        chord_vocab = get_chord_vocab()
 
         gen_seq = torch.full((1,target_seq_length), CHORD_PAD, dtype=TORCH_LABEL_TYPE, device=get_device())
         gen_seq_root = torch.full((1,target_seq_length), CHORD_ROOT_PAD, dtype=TORCH_LABEL_TYPE, device=get_device())
@@ -542,12 +714,17 @@ class VideoMusicTransformer_V2(nn.Module):
         gen_seq_root[..., :num_primer] = primer_root.type(TORCH_LABEL_TYPE).to(get_device())
         gen_seq_attr[..., :num_primer] = primer_attr.type(TORCH_LABEL_TYPE).to(get_device())
 
+        # Encode the video once, with a KV cache only the newest chord is fed per step
+        if memory is None:
+            memory = self.encode_video(feature_semantic_list, feature_scene_offset, feature_motion, feature_emotion)
+        cache = self.init_cache() if (use_cache and beam == 0) else None
+
         cur_i = num_primer
         while(cur_i < target_seq_length):
-            y = self.softmax( self.forward( gen_seq[..., :cur_i], gen_seq_root[..., :cur_i], gen_seq_attr[..., :cur_i], 
-                                           feature_semantic_list, feature_key, feature_scene_offset, feature_motion, feature_emotion) / temperature)[..., :CHORD_END]
+            y = self.softmax( self.decode( memory, gen_seq[..., :cur_i], gen_seq_root[..., :cur_i], gen_seq_attr[..., :cur_i], 
+                                          feature_key, cache) / temperature)[..., :CHORD_END]
             
-            token_probs = y[:, cur_i-1, :]
+            token_probs = y[:, -1, :]
             if(beam == 0):
                 beam_ran = 2.0
             else:
@@ -581,23 +758,8 @@ class VideoMusicTransformer_V2(nn.Module):
                 distrib = torch.distributions.categorical.Categorical(probs=token_probs)
                 next_token = distrib.sample()
                 gen_seq[:, cur_i] = next_token
-                gen_chord = chordInvDic[ str( next_token.item() ) ]
-                
-                chord_arr = gen_chord.split(":")
-                if len(chord_arr) == 1:
-                    chordRootID = chordRootDic[chord_arr[0]]
-                    chordAttrID = 1
-                    chordRootID = torch.tensor([chordRootID]).to(get_device())
-                    chordAttrID = torch.tensor([chordAttrID]).to(get_device())
-                    gen_seq_root[:, cur_i] = chordRootID
-                    gen_seq_attr[:, cur_i] = chordAttrID
-                elif len(chord_arr) == 2:
-                    chordRootID = chordRootDic[chord_arr[0]]
-                    chordAttrID = chordAttrDic[chord_arr[1]]
-                    chordRootID = torch.tensor([chordRootID]).to(get_device())
-                    chordAttrID = torch.tensor([chordAttrID]).to(get_device())
-                    gen_seq_root[:, cur_i] = chordRootID
-                    gen_seq_attr[:, cur_i] = chordAttrID
+                gen_seq_root[:, cur_i] = chord_vocab.tensor("chord_root")[next_token]
+                gen_seq_attr[:, cur_i] = chord_vocab.tensor("chord_quality")[next_token]
                     
                 # Let the transformer decide to end if it wants to
                 if(next_token == CHORD_END):
@@ -615,6 +777,9 @@ class VideoMusicTransformer_V3(nn.Module):
                  chord_embed=False, dropTokenRate=0.0):
         super(VideoMusicTransformer_V3, self).__init__()
 
+        # MoE routing statistics, see model/routing_stats.py
+        self.routing_stats = None
+
         self.nlayers    = n_layers
         self.nhead      = num_heads
         self.d_model    = d_model
@@ -746,12 +911,8 @@ class VideoMusicTransformer_V3(nn.Module):
         del RoPE, expert, difatt_list, att, swiglu, moelayer
         torch.cuda.empty_cache()
 
-    def forward(self, x, x_root, x_attr, feature_semantic_list, feature_key, feature_scene_offset, feature_motion, feature_emotion, mask=True):
-        if(mask is True):
-            mask = self.transformer.generate_square_subsequent_mask(x.shape[1]).to(get_device())
-        else:
-            mask = None
-        
+    def _embed_chord(self, x, x_root, x_attr, feature_key, offset=0):
+        # Chord (DECODER) input -> (seq_len, batch_size, d_model), positions come from RoPE
         if not self.chord_embed:
             x_root = self.embedding_root(x_root)
             x_attr = self.embedding_attr(x_attr)
@@ -770,6 +931,10 @@ class VideoMusicTransformer_V3(nn.Module):
 
         xf = self.Linear_chord(x)
 
+        xf = xf.permute(1,0,2) # -> (max_seq-1, batch_size, d_model)
+        return xf
+
+    def _embed_video(self, feature_semantic_list, feature_scene_offset, feature_motion, feature_emotion):
         ### Video (SemanticList + SceneOffset + Motion + Emotion) (ENCODER) ###
         # Semantic
         vf_concat = feature_semantic_list.float() 
@@ -785,7 +950,8 @@ class VideoMusicTransformer_V3(nn.Module):
             vf_concat = torch.cat([vf_concat, feature_motion], dim=-1)
         
         # Emotion
-        get_highest_emotion_indices(feature_emotion, self.training)
+        if self.routing_stats is not None:
+            self.routing_stats.set_emotion(feature_emotion)
         vf_concat = torch.cat([vf_concat, feature_emotion.float()], dim=-1) # -> (max_seq_video, batch_size, d_model+1)
         
         # Video embedding
@@ -801,8 +967,17 @@ class VideoMusicTransformer_V3(nn.Module):
             droptoken_mask = droptoken_mask.unsqueeze(-1).repeat(1, 1, d_model)
             vf = vf * droptoken_mask
 
-        xf = xf.permute(1,0,2) # -> (max_seq-1, batch_size, d_model)
         vf = vf.permute(1,0,2) # -> (max_seq_video, batch_size, d_model)
+        return vf
+
+    def forward(self, x, x_root, x_attr, feature_semantic_list, feature_key, feature_scene_offset, feature_motion, feature_emotion, mask=True):
+        if(mask is True):
+            mask = self.transformer.generate_square_subsequent_mask(x.shape[1]).to(get_device())
+        else:
+            mask = None
+        
+        xf = self._embed_chord(x, x_root, x_attr, feature_key)
+        vf = self._embed_video(feature_semantic_list, feature_scene_offset, feature_motion, feature_emotion)
 
         ### TRANSFORMER ###
         x_out = self.transformer(src=vf, tgt=xf, tgt_mask=mask)
@@ -818,19 +993,58 @@ class VideoMusicTransformer_V3(nn.Module):
             y = self.Wout(x_out)
             return y
         
+    def encode_video(self, feature_semantic_list, feature_scene_offset, feature_motion, feature_emotion):
+        # Encoder memory (max_seq_video, batch_size, d_model), computed once per video and reused by decode
+        vf = self._embed_video(feature_semantic_list, feature_scene_offset, feature_motion, feature_emotion)
+        return self.transformer.encoder(vf)
+
+    def init_cache(self):
+        # KVCache for decode, None if the decoder can only run on the full prefix
+        return init_kv_cache(self.transformer.decoder)
+
+    def decode(self, memory, x, x_root, x_attr, feature_key, cache=None):
+        # Chord logits of prefix x given the encoder memory. With a cache only the positions of x
+        # that are not decoded yet are fed and the output of the last position is returned.
+        if cache is None:
+            if self.routing_stats is not None:
+                self.routing_stats.set_offset(0)
+            mask = self.transformer.generate_square_subsequent_mask(x.shape[1]).to(get_device())
+            xf = self._embed_chord(x, x_root, x_attr, feature_key)
+            x_out = self.transformer.decoder(xf, memory, tgt_mask=mask)
+        else:
+            assert cache.length < x.shape[1], "No new position to decode"
+            while cache.length < x.shape[1]:
+                i = cache.length
+                if self.routing_stats is not None:
+                    self.routing_stats.set_offset(i)
+                xf = self._embed_chord(x[..., i:i+1], x_root[..., i:i+1], x_attr[..., i:i+1], feature_key, offset=i)
+                x_out = self.transformer.decoder.forward_step(xf, memory, cache)
+        x_out = x_out.permute(1,0,2)
+
+        if IS_SEPERATED:
+            y_root = self.Wout_root(x_out)
+            y_attr = self.Wout_attr(x_out)
+            return y_root, y_attr
+        else:
+            y = self.Wout(x_out)
+            return y
+
+    def generate_batch(self, feature_semantic_list = [], feature_key=None, feature_scene_offset=None, feature_motion=None, feature_emotion=None,
+                       primer=None, primer_root=None, primer_attr=None, num_samples=1, target_seq_length=300, max_conseq_N = 0, max_conseq_chord = 2,
+                       temperature=1.0, use_cache=True, memory=None):
+        # num_samples candidate chord sequences for one video in one batched decode, see _generate_batch
+        return _generate_batch(self, feature_semantic_list, feature_key, feature_scene_offset, feature_motion, feature_emotion,
+                               primer, primer_root, primer_attr, num_samples, target_seq_length, max_conseq_N, max_conseq_chord,
+                               temperature, use_cache, memory)
+
     def generate(self, feature_semantic_list = [], feature_key=None, feature_scene_offset=None, feature_motion=None, feature_emotion=None,
                  primer=None, primer_root=None, primer_attr=None, target_seq_length=300, beam=0, beam_chance=1.0, max_conseq_N = 0, max_conseq_chord = 2,
-                 temperature=1.0):
+                 temperature=1.0, use_cache=True, memory=None):
         
         assert (not self.training), "Cannot generate while in training mode"
         print("Generating sequence of max length:", target_seq_length)
 
-        with open('dataset/vevo_meta/chord_inv.json') as json_file:
-            chordInvDic = json.load(json_file)
-        with open('dataset/vevo_meta/chord_root.json') as json_file:
-            chordRootDic = json.load(json_file)
-        with open('dataset/vevo_meta/chord_attr.json') as json_file:
-            chordAttrDic = json.load(json_file)
+        chord_vocab = get_chord_vocab()
 
         gen_seq = torch.full((1,target_seq_length), CHORD_PAD, dtype=TORCH_LABEL_TYPE, device=get_device())
         gen_seq_root = torch.full((1,target_seq_length), CHORD_ROOT_PAD, dtype=TORCH_LABEL_TYPE, device=get_device())
@@ -841,12 +1055,17 @@ class VideoMusicTransformer_V3(nn.Module):
         gen_seq_root[..., :num_primer] = primer_root.type(TORCH_LABEL_TYPE).to(get_device())
         gen_seq_attr[..., :num_primer] = primer_attr.type(TORCH_LABEL_TYPE).to(get_device())
 
+        # Encode the video once, with a KV cache only the newest chord is fed per step
+        if memory is None:
+            memory = self.encode_video(feature_semantic_list, feature_scene_offset, feature_motion, feature_emotion)
+        cache = self.init_cache() if (use_cache and beam == 0) else None
+
         cur_i = num_primer
         while(cur_i < target_seq_length):
-            y = self.softmax( self.forward( gen_seq[..., :cur_i], gen_seq_root[..., :cur_i], gen_seq_attr[..., :cur_i], 
-                                           feature_semantic_list, feature_key, feature_scene_offset, feature_motion, feature_emotion) / temperature)[..., :CHORD_END]
+            y = self.softmax( self.decode( memory, gen_seq[..., :cur_i], gen_seq_root[..., :cur_i], gen_seq_attr[..., :cur_i], 
+                                          feature_key, cache) / temperature)[..., :CHORD_END]
             
-            token_probs = y[:, cur_i-1, :]
+            token_probs = y[:, -1, :]
             if(beam == 0):
                 beam_ran = 2.0
             else:
@@ -880,23 +1099,8 @@ class VideoMusicTransformer_V3(nn.Module):
                 distrib = torch.distributions.categorical.Categorical(probs=token_probs)
                 next_token = distrib.sample()
                 gen_seq[:, cur_i] = next_token
-                gen_chord = chordInvDic[ str( next_token.item() ) ]
-                
-                chord_arr = gen_chord.split(":")
-                if len(chord_arr) == 1:
-                    chordRootID = chordRootDic[chord_arr[0]]
-                    chordAttrID = 1
-                    chordRootID = torch.tensor([chordRootID]).to(get_device())
-                    chordAttrID = torch.tensor([chordAttrID]).to(get_device())
-                    gen_seq_root[:, cur_i] = chordRootID
-                    gen_seq_attr[:, cur_i] = chordAttrID
-                elif len(chord_arr) == 2:
-                    chordRootID = chordRootDic[chord_arr[0]]
-                    chordAttrID = chordAttrDic[chord_arr[1]]
-                    chordRootID = torch.tensor([chordRootID]).to(get_device())
-                    chordAttrID = torch.tensor([chordAttrID]).to(get_device())
-                    gen_seq_root[:, cur_i] = chordRootID
-                    gen_seq_attr[:, cur_i] = chordAttrID
+                gen_seq_root[:, cur_i] = chord_vocab.tensor("chord_root")[next_token]
+                gen_seq_attr[:, cur_i] = chord_vocab.tensor("chord_quality")[next_token]
                     
                 # Let the transformer decide to end if it wants to
                 if(next_token == CHORD_END):
@@ -913,6 +1117,10 @@ class VideoMusicTransformer(nn.Module):
                  max_sequence_chord=300, total_vf_dim = 0, rpr=False, scene_embed=False,
                  chord_embed=False):
         super(VideoMusicTransformer, self).__init__()
+
+        # MoE routing statistics, see model/routing_stats.py
+        self.routing_stats = None
+
         self.nlayers    = n_layers
         self.nhead      = num_heads
         self.d_model    = d_model
@@ -975,12 +1183,8 @@ class VideoMusicTransformer(nn.Module):
         self.Wout       = nn.Linear(self.d_model, CHORD_SIZE)
         self.softmax    = nn.Softmax(dim=-1)
     
-    def forward(self, x, x_root, x_attr, feature_semantic_list, feature_key, feature_scene_offset, feature_motion, feature_emotion, mask=True):
-        if(mask is True):
-            mask = self.transformer.generate_square_subsequent_mask(x.shape[1]).to(get_device())
-        else:
-            mask = None
-        
+    def _embed_chord(self, x, x_root, x_attr, feature_key, offset=0):
+        # Chord (DECODER) input -> (seq_len, batch_size, d_model), offset is the position of x[:, 0]
         if not self.chord_embed:
             x_root = self.embedding_root(x_root)
             x_attr = self.embedding_attr(x_attr)
@@ -1000,6 +1204,12 @@ class VideoMusicTransformer(nn.Module):
 
         xf = self.Linear_chord(x)
 
+        ### POSITIONAL ENCODING ###
+        xf = xf.permute(1,0,2) # -> (max_seq-1, batch_size, d_model)
+        xf = self.positional_encoding(xf, offset)
+        return xf
+
+    def _embed_video(self, feature_semantic_list, feature_scene_offset, feature_motion, feature_emotion):
         ### Video (SemanticList + SceneOffset + Motion + Emotion) (ENCODER) ###
         # Semantic
         vf_concat = feature_semantic_list.float()
@@ -1015,6 +1225,8 @@ class VideoMusicTransformer(nn.Module):
             vf_concat = torch.cat([vf_concat, feature_motion], dim=-1)
         
         # Emotion
+        if self.routing_stats is not None:
+            self.routing_stats.set_emotion(feature_emotion)
         vf_concat = torch.cat([vf_concat, feature_emotion.float()], dim=-1) # -> (max_seq_video, batch_size, d_model+1)
         
         # Video embedding
@@ -1024,10 +1236,18 @@ class VideoMusicTransformer(nn.Module):
             vf = self.Linear_vis(vf_concat) + self.scene_embedding(feature_scene_offset.int())
         
         ### POSITIONAL ENCODING ###
-        xf = xf.permute(1,0,2) # -> (max_seq-1, batch_size, d_model)
         vf = vf.permute(1,0,2) # -> (max_seq_video, batch_size, d_model)
-        xf = self.positional_encoding(xf)
         vf = self.positional_encoding_video(vf)
+        return vf
+
+    def forward(self, x, x_root, x_attr, feature_semantic_list, feature_key, feature_scene_offset, feature_motion, feature_emotion, mask=True):
+        if(mask is True):
+            mask = self.transformer.generate_square_subsequent_mask(x.shape[1]).to(get_device())
+        else:
+            mask = None
+        
+        xf = self._embed_chord(x, x_root, x_attr, feature_key)
+        vf = self._embed_video(feature_semantic_list, feature_scene_offset, feature_motion, feature_emotion)
 
         ### TRANSFORMER ###
         x_out = self.transformer(src=vf, tgt=xf, tgt_mask=mask)
@@ -1043,18 +1263,58 @@ class VideoMusicTransformer(nn.Module):
             del mask
             return y
     
+    def encode_video(self, feature_semantic_list, feature_scene_offset, feature_motion, feature_emotion):
+        # Encoder memory (max_seq_video, batch_size, d_model), computed once per video and reused by decode
+        vf = self._embed_video(feature_semantic_list, feature_scene_offset, feature_motion, feature_emotion)
+        return self.transformer.encoder(vf)
+
+    def init_cache(self):
+        # KVCache for decode, None if the decoder can only run on the full prefix
+        return init_kv_cache(self.transformer.decoder)
+
+    def decode(self, memory, x, x_root, x_attr, feature_key, cache=None):
+        # Chord logits of prefix x given the encoder memory. With a cache only the positions of x
+        # that are not decoded yet are fed and the output of the last position is returned.
+        if cache is None:
+            if self.routing_stats is not None:
+                self.routing_stats.set_offset(0)
+            mask = self.transformer.generate_square_subsequent_mask(x.shape[1]).to(get_device())
+            xf = self._embed_chord(x, x_root, x_attr, feature_key)
+            x_out = self.transformer.decoder(xf, memory, tgt_mask=mask)
+        else:
+            assert cache.length < x.shape[1], "No new position to decode"
+            while cache.length < x.shape[1]:
+                i = cache.length
+                if self.routing_stats is not None:
+                    self.routing_stats.set_offset(i)
+                xf = self._embed_chord(x[..., i:i+1], x_root[..., i:i+1], x_attr[..., i:i+1], feature_key, offset=i)
+                x_out = decoder_forward_step(self.transformer.decoder, xf, memory, cache)
+        x_out = x_out.permute(1,0,2)
+
+        if IS_SEPERATED:
+            y_root = self.Wout_root(x_out)
+            y_attr = self.Wout_attr(x_out)
+            return y_root, y_attr
+        else:
+            y = self.Wout(x_out)
+            return y
+
+    def generate_batch(self, feature_semantic_list = [], feature_key=None, feature_scene_offset=None, feature_motion=None, feature_emotion=None,
+                       primer=None, primer_root=None, primer_attr=None, num_samples=1, target_seq_length=300, max_conseq_N = 0, max_conseq_chord = 2,
+                       temperature=1.0, use_cache=True, memory=None):
+        # num_samples candidate chord sequences for one video in one batched decode, see _generate_batch
+        return _generate_batch(self, feature_semantic_list, feature_key, feature_scene_offset, feature_motion, feature_emotion,
+                               primer, primer_root, primer_attr, num_samples, target_seq_length, max_conseq_N, max_conseq_chord,
+                               temperature, use_cache, memory)
+
     def generate(self, feature_semantic_list = [], feature_key=None, feature_scene_offset=None, feature_motion=None, feature_emotion=None,
-                 primer=None, primer_root=None, primer_attr=None, target_seq_length=300, beam=0, beam_chance=1.0, max_conseq_N = 0, max_conseq_chord = 2):
+                 primer=None, primer_root=None, primer_attr=None, target_seq_length=300, beam=0, beam_chance=1.0, max_conseq_N = 0, max_conseq_chord = 2,
+                 use_cache=True, memory=None):
         
         assert (not self.training), "Cannot generate while in training mode"
         print("Generating sequence of max length:", target_seq_length)
 
-        with open('dataset/vevo_meta/chord_inv.json') as json_file:
-            chordInvDic = json.load(json_file)
-        with open('dataset/vevo_meta/chord_root.json') as json_file:
-            chordRootDic = json.load(json_file)
-        with open('dataset/vevo_meta/chord_attr.json') as json_file:
-            chordAttrDic = json.load(json_file)
+        chord_vocab = get_chord_vocab()
 
         gen_seq = torch.full((1,target_seq_length), CHORD_PAD, dtype=TORCH_LABEL_TYPE, device=get_device())
         gen_seq_root = torch.full((1,target_seq_length), CHORD_ROOT_PAD, dtype=TORCH_LABEL_TYPE, device=get_device())
@@ -1065,12 +1325,17 @@ class VideoMusicTransformer(nn.Module):
         gen_seq_root[..., :num_primer] = primer_root.type(TORCH_LABEL_TYPE).to(get_device())
         gen_seq_attr[..., :num_primer] = primer_attr.type(TORCH_LABEL_TYPE).to(get_device())
 
+        # Encode the video once, with a KV cache only the newest chord is fed per step
+        if memory is None:
+            memory = self.encode_video(feature_semantic_list, feature_scene_offset, feature_motion, feature_emotion)
+        cache = self.init_cache() if (use_cache and beam == 0) else None
+
         cur_i = num_primer
         while(cur_i < target_seq_length):
-            y = self.softmax( self.forward( gen_seq[..., :cur_i], gen_seq_root[..., :cur_i], gen_seq_attr[..., :cur_i], 
-                                           feature_semantic_list, feature_key, feature_scene_offset, feature_motion, feature_emotion) )[..., :CHORD_END]
+            y = self.softmax( self.decode( memory, gen_seq[..., :cur_i], gen_seq_root[..., :cur_i], gen_seq_attr[..., :cur_i], 
+                                          feature_key, cache) )[..., :CHORD_END]
             
-            token_probs = y[:, cur_i-1, :]
+            token_probs = y[:, -1, :]
             if(beam == 0):
                 beam_ran = 2.0
             else:
@@ -1104,23 +1369,8 @@ class VideoMusicTransformer(nn.Module):
                 distrib = torch.distributions.categorical.Categorical(probs=token_probs)
                 next_token = distrib.sample()
                 gen_seq[:, cur_i] = next_token
-                gen_chord = chordInvDic[ str( next_token.item() ) ]
-                
-                chord_arr = gen_chord.split(":")
-                if len(chord_arr) == 1:
-                    chordRootID = chordRootDic[chord_arr[0]]
-                    chordAttrID = 1
-                    chordRootID = torch.tensor([chordRootID]).to(get_device())
-                    chordAttrID = torch.tensor([chordAttrID]).to(get_device())
-                    gen_seq_root[:, cur_i] = chordRootID
-                    gen_seq_attr[:, cur_i] = chordAttrID
-                elif len(chord_arr) == 2:
-                    chordRootID = chordRootDic[chord_arr[0]]
-                    chordAttrID = chordAttrDic[chord_arr[1]]
-                    chordRootID = torch.tensor([chordRootID]).to(get_device())
-                    chordAttrID = torch.tensor([chordAttrID]).to(get_device())
-                    gen_seq_root[:, cur_i] = chordRootID
-                    gen_seq_attr[:, cur_i] = chordAttrID
+                gen_seq_root[:, cur_i] = chord_vocab.tensor("chord_root")[next_token]
+                gen_seq_attr[:, cur_i] = chord_vocab.tensor("chord_quality")[next_token]
                     
                 # Let the transformer decide to end if it wants to
                 if(next_token == CHORD_END):
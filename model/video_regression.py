@@ -105,6 +105,7 @@ class VideoRegression(nn.Module):
     def __init__(self, n_layers=2, d_model=64, d_hidden=1024, dropout=0.1, use_KAN=False, max_sequence_video=300, 
                  total_vf_dim=0, regModel="bilstm", scene_embed=False, chord_embed=False):
         super(VideoRegression, self).__init__()
+
         self.n_layers    = n_layers
         self.d_model    = d_model
         self.d_hidden = d_hidden
@@ -115,6 +116,9 @@ class VideoRegression(nn.Module):
         self.scene_embed = scene_embed
         self.chord_embed = chord_embed
 
+        # MoE routing statistics, see model/routing_stats.py (attach with batch_first=True)
+        self.routing_stats = None
+
         # Scene offsets embedding
         # if self.scene_embed:
         #     self.scene_embedding = nn.Embedding(SCENE_OFFSET_MAX, self.d_model)
@@ -220,6 +224,8 @@ class VideoRegression(nn.Module):
         #     vf_concat = torch.cat([vf_concat, feature_motion], dim=-1)
         
         # Emotion
+        if self.routing_stats is not None:
+            self.routing_stats.set_emotion(feature_emotion)
         vf_concat = torch.cat([vf_concat, feature_emotion.float()], dim=-1) # -> (batch_size, max_seq_video, total_vf_dim)
         
         # Video embedding
@@ -0,0 +1,181 @@
+import sys
+import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+import argparse
+import json
+import time
+import importlib
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import torch
+
+# Builds the per-video dataset features with the extractor scripts as stages, one process pool per stage.
+# Every stage module provides list_ids(dataset_root), output_path(dataset_root, fid), load(device) (run once
+# per worker process) and build(context, dataset_root, fid), plus USES_GPU.
+#
+# A manifest (json) records every finished or failed video per stage and is rewritten as the run goes,
+# an interrupted run skips the videos that are done and whose output still exists. Usage (repo root):
+#     python script/build_features.py -dataset_root ./dataset/ -stages scene scene_offset loudness -workers 8
+
+# Stage name -> module, in execution order (scene_offset reads the output of scene)
+STAGES = {
+    "semantic": "script.semantic_feature",
+    "emotion": "script.emotion_feature",
+    "scene": "script.scene_feature",
+    "scene_offset": "script.scene_offset_feature",
+    "motion": "script.motion_feature",
+    "loudness": "script.loudness_feature",
+    "note_density": "script.note_density_feature",
+}
+
+def parse_build_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-dataset_root", type=str, default="./dataset/", help="Dataset root with vevo/, vevo_chord/, ...")
+    parser.add_argument("-stages", type=str, nargs="+", default=list(STAGES), help="Stages to run: " + " ".join(STAGES))
+    parser.add_argument("-ids", type=str, nargs="+", default=None, help="Only these video ids (default: all of each stage)")
+    parser.add_argument("-workers", type=int, default=os.cpu_count(), help="Worker processes of the CPU stages")
+    parser.add_argument("-gpu_workers", type=int, default=1, help="Worker processes of the GPU stages (each loads its model)")
+    parser.add_argument("-device", type=str, default="cuda" if torch.cuda.is_available() else "cpu", help="Device of the GPU stages")
+    parser.add_argument("-manifest", type=str, default=None, help="Manifest path (default: <dataset_root>/feature_manifest.json)")
+    parser.add_argument("--force", action="store_true", help="Rebuild the videos that are already done")
+    parser.add_argument("--trust_existing", action="store_true", help="Count existing outputs without a manifest entry as done")
+    return parser.parse_args()
+
+class FeatureManifest:
+    """
+    Per-stage, per-video completion record of build_features:
+        {stage: {video id: {"status": "done" | "failed", "seconds": float, "error": str}}}
+    Saved atomically (temporary file + os.replace), at most every save_interval seconds while recording.
+    """
+    def __init__(self, path, save_interval=2.0):
+        self.path = path
+        self.save_interval = save_interval
+        self._last_save = time.monotonic()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def is_done(self, stage, fid):
+        return self.entries.get(stage, {}).get(fid, {}).get("status") == "done"
+
+    def record(self, stage, fid, error, seconds):
+        entry = {"status": "done" if error is None else "failed", "seconds": round(seconds, 3)}
+        if error is not None:
+            entry["error"] = error
+        self.entries.setdefault(stage, {})[fid] = entry
+        if time.monotonic() - self._last_save >= self.save_interval:
+            self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self._last_save = time.monotonic()
+
+# Worker process state, set by _init_worker
+_stage = None
+_context = None
+
+def _init_worker(module_name, device):
+    global _stage, _context
+    _stage = importlib.import_module(module_name)
+    _context = _stage.load(device)
+
+def _build_one(dataset_root, fid):
+    start = time.perf_counter()
+    try:
+        os.makedirs(os.path.dirname(_stage.output_path(dataset_root, fid)), exist_ok=True)
+        _stage.build(_context, dataset_root, fid)
+        error = None
+    except Exception:
+        error = traceback.format_exc(limit=4)
+    return fid, error, time.perf_counter() - start
+
+def run_stage(name, args, manifest):
+    # Returns the stats of the stage
+    stage = importlib.import_module(STAGES[name])
+    ids = stage.list_ids(args.dataset_root)
+    if args.ids is not None:
+        wanted = set(args.ids)
+        ids = [fid for fid in ids if fid in wanted]
+
+    todo = []
+    for fid in ids:
+        exists = os.path.exists(stage.output_path(args.dataset_root, fid))
+        if not args.force and exists and (manifest.is_done(name, fid) or args.trust_existing):
+            if not manifest.is_done(name, fid):
+                manifest.record(name, fid, None, 0.0)
+            continue
+        todo.append(fid)
+
+    stats = {"total": len(ids), "skipped": len(ids) - len(todo), "done": 0, "failed": 0, "seconds": 0.0, "busy": 0.0}
+    if len(todo) == 0:
+        return stats
+
+    workers = args.gpu_workers if stage.USES_GPU else args.workers
+    workers = max(1, min(workers, len(todo)))
+    device = args.device if stage.USES_GPU else "cpu"
+    print(f"[{name}] {len(todo)} videos ({stats['skipped']} already done), {workers} workers on {device}")
+
+    start = time.perf_counter()
+    # spawn: the GPU stages must not inherit a CUDA context
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(STAGES[name], device)) as executor:
+        futures = [executor.submit(_build_one, args.dataset_root, fid) for fid in todo]
+        for future in as_completed(futures):
+            try:
+                fid, error, seconds = future.result()
+            except Exception:
+                # Broken pool (e.g. the model failed to load in a worker), the remaining videos fail too
+                fid, error, seconds = todo[futures.index(future)], traceback.format_exc(limit=2), 0.0
+            manifest.record(name, fid, error, seconds)
+            stats["busy"] += seconds
+            if error is None:
+                stats["done"] += 1
+            else:
+                stats["failed"] += 1
+                print(f"[{name}] {fid} failed: {error.strip().splitlines()[-1]}")
+    manifest.save()
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+def print_stats(all_stats):
+    print("%14s %7s %8s %7s %7s %10s %10s %14s" % ("stage", "total", "skipped", "done", "failed", "wall (s)", "videos/s", "s per video"))
+    for name, stats in all_stats.items():
+        built = stats["done"] + stats["failed"]
+        rate = stats["done"] / stats["seconds"] if stats["seconds"] > 0 else 0.0
+        per_video = stats["busy"] / built if built > 0 else 0.0
+        print("%14s %7d %8d %7d %7d %10.1f %10.2f %14.2f" % (name, stats["total"], stats["skipped"], stats["done"],
+                                                              stats["failed"], stats["seconds"], rate, per_video))
+
+def main():
+    args = parse_build_args()
+    for name in args.stages:
+        if name not in STAGES:
+            raise SystemExit(f"Unknown stage {name}, expected one of: {' '.join(STAGES)}")
+    manifest_path = args.manifest or os.path.join(args.dataset_root, "feature_manifest.json")
+    manifest = FeatureManifest(manifest_path)
+
+    all_stats = {}
+    try:
+        for name in STAGES:
+            if name in args.stages:
+                all_stats[name] = run_stage(name, args, manifest)
+    finally:
+        manifest.save()
+        print_stats(all_stats)
+        print("Manifest:", manifest_path)
+
+if __name__ == "__main__":
+    main()
@@ -14,8 +14,7 @@ train_dataset, val_dataset, test_dataset = create_vevo_datasets(
     emo_model = args.emo_model, 
     split_ver = SPLIT_VER, 
     random_seq = True, 
-    is_video = args.is_video,
-    augmentation = args.augmentation)
+    is_video = args.is_video)
 
 chord_count = np.array([1 for _ in range(CHORD_SIZE)]) # Including PAD and EOS
 
@@ -1,48 +1,68 @@
+import sys
 import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
 import math
 import torch
 import clip
 import numpy as np
 from PIL import Image
+from utilities.frame_encoding import preprocess_frames, encode_batched
+from utilities.video_loader import read_frames_1fps
 
 import time
 
-def main():
-    device = "cuda" if torch.cuda.is_available() else "cpu"
+# Frames per CLIP forward
+BATCH_SIZE = 32
+# Threads preprocessing the frames while the previous batch is encoded
+NUM_WORKERS = 4
+
+# Stage interface of script/build_features.py: list_ids, output_path, load (once per worker), build (per video)
+USES_GPU = True
+
+def list_ids(dataset_root):
+    directory_vevo = os.path.join(dataset_root, "vevo")
+    return [ fname[:-4] for fname in sorted(os.listdir(directory_vevo)) if fname.endswith(".mp4") ]
+
+def output_path(dataset_root, fid):
+    return os.path.join(dataset_root, "vevo_emotion", "6c_l14p", fid + ".lab")
+
+def load(device):
     model, preprocess = clip.load("ViT-L/14@336px", device=device)
     text = clip.tokenize(["exciting", "fearful", "tense", "sad", "relaxing", "neutral"]).to(device)
-    directory_vevo = "../dataset/vevo/"
-    directory_vevo_emotion = "../dataset/vevo_emotion/6c_l14p/"
-
-    for fname in sorted(os.listdir(directory_vevo)):
-        if fname.endswith(".mp4"):
-            print("id: ", fname[:-4])
-            emolab_path = os.path.join( directory_vevo_emotion, fname[:-4] + ".lab" )
-            directory_vevo_jpg = os.path.join( "../dataset/vevo_frame/", fname[:-4] )
-            file_names = os.listdir(directory_vevo_jpg)
-            sorted_file_names = sorted(file_names)
-            emolist = []
-            for file_name in sorted_file_names:
-                fpath = os.path.join( directory_vevo_jpg, file_name )
-                image = preprocess(Image.open(fpath)).unsqueeze(0).to(device)                
-                with torch.no_grad():  
-                    logits_per_image, logits_per_text = model(image, text)
-                    probs = logits_per_image.softmax(dim=-1).cpu().numpy()
-
-                fp1 = format(probs[0][0], ".4f")
-                fp2 = format(probs[0][1], ".4f")
-                fp3 = format(probs[0][2], ".4f")
-                fp4 = format(probs[0][3], ".4f")
-                fp5 = format(probs[0][4], ".4f")
-                fp6 = format(probs[0][5], ".4f")
-                
-                emo_val = str(fp1) +" "+ str(fp2) +" "+ str(fp3) +" "+ str(fp4) +" "+ str(fp5) + " " + str(fp6)
-                emolist.append(emo_val)
-            
-            with open(emolab_path ,'w' ,encoding = 'utf-8') as f:
-                f.write("time exciting_prob fearful_prob tense_prob sad_prob relaxing_prob neutral_prob\n")
-                for i in range(0, len(emolist) ):
-                    f.write(str(i) + " "+emolist[i]+"\n")
+    return model, preprocess, text, device
+
+def build(context, dataset_root, fid):
+    model, preprocess, text, device = context
+    # 1-fps frames decoded in memory, same frames as script/video2jpg.py
+    frames = read_frames_1fps( os.path.join( dataset_root, "vevo", fid + ".mp4" ) )
+    images = preprocess_frames(frames, preprocess, num_workers=NUM_WORKERS)
+    logits_per_image = torch.stack(list(encode_batched(lambda batch: model(batch, text)[0], images, device,
+                                                       batch_size=BATCH_SIZE)))
+    probs = logits_per_image.softmax(dim=-1).numpy()
+
+    emolist = []
+    for prob in probs:
+        emo_val = " ".join(format(p, ".4f") for p in prob)
+        emolist.append(emo_val)
+    
+    with open(output_path(dataset_root, fid) ,'w' ,encoding = 'utf-8') as f:
+        f.write("time exciting_prob fearful_prob tense_prob sad_prob relaxing_prob neutral_prob\n")
+        for i in range(0, len(emolist) ):
+            f.write(str(i) + " "+emolist[i]+"\n")
+
+def main():
+    dataset_root = "../dataset/"
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    context = load(device)
+    for fid in list_ids(dataset_root):
+        print("id: ", fid)
+        build(context, dataset_root, fid)
 
 if __name__ == "__main__":
     main()
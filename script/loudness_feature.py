@@ -10,43 +10,46 @@ import audioop
 def loudness_to_normalized(loudness):
     return 10 ** (loudness / 20)
 
+# Stage interface of script/build_features.py: list_ids, output_path, load (once per worker), build (per video)
+USES_GPU = False
+
+def list_ids(dataset_root):
+    directory_vevo_chord = os.path.join(dataset_root, "vevo_chord", "lab_v2_norm", "all")
+    return [ filename.split(".")[0] for filename in sorted(os.listdir(directory_vevo_chord)) if filename.endswith(".lab") ]
+
+def output_path(dataset_root, fname):
+    return os.path.join(dataset_root, "vevo_loudness", "all", fname + ".lab")
+
+def load(device):
+    return None
+
+def build(context, dataset_root, fname):
+    wavpath = os.path.join(dataset_root, "vevo_audio", "wav", fname + ".wav")
+
+    audio_data = AudioSegment.from_file(wavpath)
+    audio_data = audio_data.set_channels(1)  # convert to mono
+    audio_data = audio_data.set_frame_rate(44100)  # set sample rate to 44100 Hz
+    chunk_length = 1000  # chunk length in milliseconds
+    chunks = make_chunks(audio_data, chunk_length)
+    loudness_per_second = []
+    for chunk in chunks:
+        data = chunk.raw_data  # get raw data as bytes
+        rms = audioop.rms(data, 2)  # calculate RMS loudness using audioop module
+        loudness = 20 * np.log10(rms / 32767)  # convert to decibels
+        normalized_loudness = loudness_to_normalized(loudness)  # convert to 0-1 scale
+        normalized_loudness = format(normalized_loudness, ".4f")
+        loudness_per_second.append(normalized_loudness)
+    
+    fpathname = output_path(dataset_root, fname)
+    with open(fpathname, 'w', encoding = 'utf-8') as f:
+        for i in range(0, len(loudness_per_second)):
+            f.write(str(i) + " "+str(loudness_per_second[i])+"\n")
+
 def main():
-    directory_vevo_chord = "../dataset/vevo_chord/lab_v2_norm/all/"
-    directory_vevo_wav = "../dataset/vevo_audio/wav/"
-
-    for filename in sorted(os.listdir(directory_vevo_chord)):
-        chord_filepath = os.path.join( directory_vevo_chord, filename)
-        print(chord_filepath)
-        ct = 0
-        with open(chord_filepath, encoding = 'utf-8') as f:
-            for line in f:
-                line = line.strip()
-                line_arr = line.split(" ")
-                if len(line_arr) > 1:
-                    ct = ct+1
-
-        fname = filename.split(".")[0]
-        wavpath = os.path.join(directory_vevo_wav, filename.replace("lab", "wav"))
-
-        audio_data = AudioSegment.from_file(wavpath)
-        audio_data = audio_data.set_channels(1)  # convert to mono
-        audio_data = audio_data.set_frame_rate(44100)  # set sample rate to 44100 Hz
-        chunk_length = 1000  # chunk length in milliseconds
-        chunks = make_chunks(audio_data, chunk_length)
-        loudness_per_second = []
-        for chunk in chunks:
-            data = chunk.raw_data  # get raw data as bytes
-            rms = audioop.rms(data, 2)  # calculate RMS loudness using audioop module
-            loudness = 20 * np.log10(rms / 32767)  # convert to decibels
-            normalized_loudness = loudness_to_normalized(loudness)  # convert to 0-1 scale
-            normalized_loudness = format(normalized_loudness, ".4f")
-            loudness_per_second.append(normalized_loudness)
-        
-        fpathname = "../dataset/vevo_loudness/all/" + fname + ".lab"
-        with open(fpathname, 'w', encoding = 'utf-8') as f:
-            for i in range(0, len(loudness_per_second)):
-                f.write(str(i) + " "+str(loudness_per_second[i])+"\n")
+    dataset_root = "../dataset/"
+    for fname in list_ids(dataset_root):
+        print(fname)
+        build(None, dataset_root, fname)
 
 if __name__ == "__main__":
     main()
-
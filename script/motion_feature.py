@@ -1,4 +1,12 @@
+import sys
 import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
 import math
 import cv2
 import numpy as np
@@ -7,6 +15,13 @@ from tqdm import tqdm
 import torch
 from PIL import Image
 import clip
+from utilities.frame_encoding import preprocess_frames, encode_batched
+from utilities.video_loader import read_motion_diffs
+
+# Motion differences per MaxViT forward
+BATCH_SIZE = 32
+# Threads preprocessing the frames while the previous batch is encoded
+NUM_WORKERS = 4
 
 TORCH_CPU_DEVICE = torch.device("cpu")
 
@@ -34,20 +49,49 @@ def get_device():
     else:
         return TORCH_CUDA_DEVICE
 
-def main():
-    directory = "../dataset/vevo_chord/lab/all/"
-    directory_vevo = "../dataset/vevo/"
-    datadict = {}
+# Stage interface of script/build_features.py: list_ids, output_path, load (once per worker), build (per video).
+# Our option 1.
+USES_GPU = True
 
-    # === Our option 1 === #
+def list_ids(dataset_root):
+    directory_vevo = os.path.join(dataset_root, "vevo")
+    return [ filename.split(".")[0] for filename in sorted(os.listdir(directory_vevo)) if filename.endswith(".mp4") ]
+
+def output_path(dataset_root, fname):
+    return os.path.join(dataset_root, "vevo_motion", "option1", fname + ".npy")
+
+def load(device):
     model = models.maxvit_t(weights=models.MaxVit_T_Weights.DEFAULT)   
     model.classifier = torch.nn.Sequential(
         torch.nn.AdaptiveAvgPool2d(1),
         torch.nn.Flatten()
     )
-    model = model.to(get_device())
+    model = model.to(device)
     model.eval()
     transform = models.MaxVit_T_Weights.IMAGENET1K_V1.transforms()
+    return model, transform, device
+
+def build(context, dataset_root, fname):
+    model, transform, device = context
+    videopath = os.path.join(dataset_root, "vevo", fname + ".mp4")
+    # Only the frames around each second boundary are retrieved, BATCH_SIZE differences per forward
+    images = preprocess_frames(read_motion_diffs(videopath), transform, num_workers=NUM_WORKERS)
+    features = [np.zeros(512)]
+    for motion_features in encode_batched(model, images, device, batch_size=BATCH_SIZE):
+        features.append(motion_features.numpy())
+
+    features = np.stack(features, axis=0)
+    np.save(output_path(dataset_root, fname), features)
+    return features
+
+def main():
+    dataset_root = "../dataset/"
+    directory = "../dataset/vevo_chord/lab/all/"
+    directory_vevo = "../dataset/vevo/"
+    datadict = {}
+
+    # === Our option 1 === #
+    context = load(get_device())
 
     # === Our option 2 === #
     # model, preprocess = clip.load("ViT-L/14@336px", device=get_device())
@@ -101,38 +145,9 @@ def main():
         #         f.write(str(i) + " "+motiondict[i]+"\n")
 
         # === Our option 1 === #
-        features = [np.zeros(512)]
-        while cap.isOpened():
-            # Read the frame and get its time stamp
-            ret, frame = cap.read()
-            if not ret:
-                break
-            curr_time = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
-            
-            # Calculate the RGB difference between consecutive frames per second
-            if prev_frame is not None and curr_time - prev_time >= 1:
-                diff = cv2.absdiff(frame, prev_frame)
-                diff_rgb = cv2.cvtColor(diff, cv2.COLOR_BGR2RGB)
-
-                diff_image = transform(Image.fromarray(diff_rgb)).unsqueeze(0).to(get_device())
-                with torch.no_grad():
-                    motion_features = model(diff_image).squeeze()
-
-                # print("Motion value for second {}: {}".format(int(curr_time), motion_features.shape))
-                motion_features = motion_features.cpu().numpy()
-                features.append(motion_features)
-
-                prev_time = int(curr_time)
-
-            # Update the variables
-            prev_frame = frame.copy()
-        # Release the video file and close all windows
         cap.release()
-        cv2.destroyAllWindows()
-
-        features = np.stack(features, axis=0)
+        features = build(context, dataset_root, fname)
         print(features.shape)
-        np.save("../dataset/vevo_motion/option1/" + fname + ".npy", features)
 
         # === Our option 2 === #
         # features = [np.zeros(768)]
@@ -2,49 +2,60 @@ import os
 import math
 import pretty_midi
 
+# Stage interface of script/build_features.py: list_ids, output_path, load (once per worker), build (per video)
+USES_GPU = False
+
+def list_ids(dataset_root):
+    directory_vevo_chord = os.path.join(dataset_root, "vevo_chord", "lab_v2_norm", "all")
+    return [ filename.split(".")[0] for filename in sorted(os.listdir(directory_vevo_chord)) if filename.endswith(".lab") ]
+
+def output_path(dataset_root, fname):
+    return os.path.join(dataset_root, "vevo_note_density", "all", fname + ".lab")
+
+def load(device):
+    return None
+
+def build(context, dataset_root, fname):
+    chord_filepath = os.path.join(dataset_root, "vevo_chord", "lab_v2_norm", "all", fname + ".lab")
+    ct = 0
+    with open(chord_filepath, encoding = 'utf-8') as f:
+        for line in f:
+            line = line.strip()
+            line_arr = line.split(" ")
+            if len(line_arr) > 1:
+                ct = ct+1
+
+    midipath = os.path.join(dataset_root, "vevo_midi", "all", fname + ".mid")
+
+    midi_data = pretty_midi.PrettyMIDI(midipath)
+    total_time = midi_data.get_end_time()
+    
+    note_density_list = []
+    for i in range(int(total_time)+1):
+        start_time = i
+        end_time = i + 1
+        total_notes = 0
+        for instrument in midi_data.instruments:
+            for note in instrument.notes:
+                if note.start < end_time and note.end > start_time:
+                    total_notes += 1
+        note_density = total_notes / float(end_time - start_time)
+        note_density_list.append(note_density)
+    
+    fpathname = output_path(dataset_root, fname)
+    with open(fpathname, 'w', encoding = 'utf-8') as f:
+        for i in range(0, ct-1):
+            if i < len(note_density_list):
+                f.write(str(i) + " "+str(note_density_list[i])+"\n")
+            else:
+                f.write(str(i) + " "+"0"+"\n")
+
 def main():
-    directory_vevo_chord = "../dataset/vevo_chord/lab_v2_norm/all/"
-    directory_vevo_midi = "../dataset/vevo_midi/all/"
-
-    for filename in sorted(os.listdir(directory_vevo_chord)):
-        chord_filepath = os.path.join( directory_vevo_chord, filename)
-        print(chord_filepath)
-        ct = 0
-        with open(chord_filepath, encoding = 'utf-8') as f:
-            for line in f:
-                line = line.strip()
-                line_arr = line.split(" ")
-                if len(line_arr) > 1:
-                    ct = ct+1
-
-        fname = filename.split(".")[0]
-        midipath = os.path.join(directory_vevo_midi, filename.replace("lab", "mid"))
-
-        midi_data = pretty_midi.PrettyMIDI(midipath)
-        total_time = midi_data.get_end_time()
-        
-        note_density_list = []
-        for i in range(int(total_time)+1):
-            start_time = i
-            end_time = i + 1
-            total_notes = 0
-            for instrument in midi_data.instruments:
-                for note in instrument.notes:
-                    if note.start < end_time and note.end > start_time:
-                        total_notes += 1
-            note_density = total_notes / float(end_time - start_time)
-            note_density_list.append(note_density)
-        
-        fpathname = "../../dataset/vevo_note_density/all/" + fname + ".lab"
-        #fname = '{:0>3}'.format(i) + ".lab"
-        with open(fpathname, 'w', encoding = 'utf-8') as f:
-            for i in range(0, ct-1):
-                if i < len(note_density_list):
-                    f.write(str(i) + " "+str(note_density_list[i])+"\n")
-                else:
-                    f.write(str(i) + " "+"0"+"\n")
+    dataset_root = "../dataset/"
+    for fname in list_ids(dataset_root):
+        print(fname)
+        build(None, dataset_root, fname)
 
 
 if __name__ == "__main__":
     main()
-
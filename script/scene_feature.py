@@ -6,36 +6,46 @@ from scenedetect.video_splitter import split_video_ffmpeg
 from scenedetect.scene_manager import save_images
 from tqdm import tqdm
 
+# Stage interface of script/build_features.py: list_ids, output_path, load (once per worker), build (per video)
+USES_GPU = False
+
+def list_ids(dataset_root):
+    directory_vevo = os.path.join(dataset_root, "vevo")
+    return [ filename.split(".")[0] for filename in sorted(os.listdir(directory_vevo)) if filename.endswith(".mp4") ]
+
+def output_path(dataset_root, fname):
+    return os.path.join(dataset_root, "vevo_scene", fname + ".lab")
+
+def load(device):
+    return None
+
+def build(context, dataset_root, fname):
+    videopath = os.path.join(dataset_root, "vevo", fname + ".mp4")
+    video = open_video(videopath)
+    
+    scene_manager = SceneManager()
+    scene_manager.add_detector(AdaptiveDetector())
+    scene_manager.detect_scenes(video, show_progress=False)
+    scene_list = scene_manager.get_scene_list()
+
+    sec = 0
+    scenedict = {}
+    for idx, scene in enumerate(scene_list):
+        end_int = math.ceil(scene[1].get_seconds())
+        for s in range (sec, end_int):
+            scenedict[s] = str(idx)
+            sec += 1
+    
+    fpathname = output_path(dataset_root, fname)
+    with open(fpathname,'w',encoding = 'utf-8') as f:
+        for i in range(0, len(scenedict)):
+            f.write(str(i) + " "+scenedict[i]+"\n")
+
 def main():
-    directory = "../dataset/vevo_chord/lab/all/"
-    directory_vevo = "../dataset/vevo/"
-    datadict = {}
-
-    # for filename in sorted(os.listdir(directory)):
-    for filename in tqdm(sorted(os.listdir(directory_vevo))):
-        print(filename)
-        fname = filename.split(".")[0]
-        #fname = int(fname)
-        videopath = os.path.join(directory_vevo, filename.replace("lab", "mp4"))
-        video = open_video(videopath)
-        
-        scene_manager = SceneManager()
-        scene_manager.add_detector(AdaptiveDetector())
-        scene_manager.detect_scenes(video, show_progress=False)
-        scene_list = scene_manager.get_scene_list()
-
-        sec = 0
-        scenedict = {}
-        for idx, scene in enumerate(scene_list):
-            end_int = math.ceil(scene[1].get_seconds())
-            for s in range (sec, end_int):
-                scenedict[s] = str(idx)
-                sec += 1
-        
-        fpathname = "../dataset/vevo_scene/" + fname + ".lab"
-        with open(fpathname,'w',encoding = 'utf-8') as f:
-            for i in range(0, len(scenedict)):
-                f.write(str(i) + " "+scenedict[i]+"\n")
+    dataset_root = "../dataset/"
+    for fname in tqdm(list_ids(dataset_root)):
+        print(fname)
+        build(None, dataset_root, fname)
 
         
 if __name__ == "__main__":
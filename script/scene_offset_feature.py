@@ -15,29 +15,52 @@ def convert_format_id_to_offset(id_list):
         offset += 1
     return offset_list
 
+# Stage interface of script/build_features.py: list_ids, output_path, load (once per worker), build (per video).
+# Runs on the output of the scene stage.
+USES_GPU = False
+
+def list_ids(dataset_root):
+    directory_vevo = os.path.join(dataset_root, "vevo")
+    return [ filename.split(".")[0] for filename in sorted(os.listdir(directory_vevo)) if filename.endswith(".mp4") ]
+
+def output_path(dataset_root, fname):
+    return os.path.join(dataset_root, "vevo_scene_offset", fname + ".lab")
+
+def load(device):
+    return None
+
+def convert_file(src, tgt):
+    id_list = []
+    with open(src, encoding = 'utf-8') as f:
+        for line in f:
+            line = line.strip()
+            line_arr = line.split(" ")
+            if len(line_arr) == 2 :
+                time = int(line_arr[0])
+                scene_id = int(line_arr[1])
+                id_list.append(scene_id)
+    if len(id_list) == 0:
+        print("empty file...")
+        print(src)
+        return False
+    offset_list = convert_format_id_to_offset(id_list)
+    with open(tgt,'w',encoding = 'utf-8') as f:
+        for i in range(0, len(offset_list)):
+            f.write(str(i) + " " + str(offset_list[i]) + "\n")
+    return True
+
+def build(context, dataset_root, fname):
+    src = os.path.join(dataset_root, "vevo_scene", fname + ".lab")
+    if not convert_file(src, output_path(dataset_root, fname)):
+        raise ValueError("empty scene file: " + src)
+
 def main():
     pp = "../dataset/vevo_scene/"
     for path, subdirs, files in os.walk( pp ):
         for fname in files:
             src = os.path.join(path,fname)
             tgt = src.replace("vevo_scene", "vevo_scene_offset" )        
-            id_list = []
-            with open(src, encoding = 'utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    line_arr = line.split(" ")
-                    if len(line_arr) == 2 :
-                        time = int(line_arr[0])
-                        scene_id = int(line_arr[1])
-                        id_list.append(scene_id)
-            if len(id_list) == 0:
-                print("empty file...")
-                print(src)
-            else:
-                offset_list = convert_format_id_to_offset(id_list)
-                with open(tgt,'w',encoding = 'utf-8') as f:
-                    for i in range(0, len(offset_list)):
-                        f.write(str(i) + " " + str(offset_list[i]) + "\n")
+            convert_file(src, tgt)
 
 if __name__ == "__main__":
     main()
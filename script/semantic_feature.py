@@ -1,31 +1,57 @@
+import sys
 import os
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(current_dir)
+
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
 import math
 import torch
 import clip
 import numpy as np
 from PIL import Image
+from utilities.frame_encoding import preprocess_frames, encode_batched
+from utilities.video_loader import read_frames_1fps
 
 import time
+
+# Frames per CLIP forward
+BATCH_SIZE = 32
+# Threads preprocessing the frames while the previous batch is encoded
+NUM_WORKERS = 4
+
+# Stage interface of script/build_features.py: list_ids, output_path, load (once per worker), build (per video)
+USES_GPU = True
+
+def list_ids(dataset_root):
+    directory_vevo = os.path.join(dataset_root, "vevo")
+    return [ fname[:-4] for fname in sorted(os.listdir(directory_vevo)) if fname.endswith(".mp4") ]
+
+def output_path(dataset_root, fid):
+    return os.path.join(dataset_root, "vevo_semantic", fid + ".npy")
+
+def load(device):
+    model, preprocess = clip.load("ViT-L/14@336px", device=device)
+    return model, preprocess, device
+
+def build(context, dataset_root, fid):
+    model, preprocess, device = context
+    # 1-fps frames decoded in memory, same frames as script/video2jpg.py
+    frames = read_frames_1fps( os.path.join( dataset_root, "vevo", fid + ".mp4" ) )
+    images = preprocess_frames(frames, preprocess, num_workers=NUM_WORKERS)
+    features = torch.stack(list(encode_batched(model.encode_image, images, device, batch_size=BATCH_SIZE)))
+    features = features.numpy()
+    np.save(output_path(dataset_root, fid), features)
+
 def main():
+    dataset_root = "../dataset/"
     device = "cuda" if torch.cuda.is_available() else "cpu"
-    model, preprocess = clip.load("ViT-L/14@336px", device=device)
-    directory_vevo = "../dataset/vevo/"
-    
-    for fname in sorted(os.listdir(directory_vevo)):
-        if fname.endswith(".mp4"):
-            print("id: ", fname[:-4])
-            directory_vevo_jpg = os.path.join( "../dataset/vevo_frame/", fname[:-4] )
-            file_names = os.listdir(directory_vevo_jpg)
-            sorted_file_names = sorted(file_names)
-            output_path = "../dataset/vevo_semantic/" + fname[:-4] + ".npy"
-            features = torch.cuda.FloatTensor(len(sorted_file_names), 768).fill_(0)
-            for idx, file_name in enumerate(sorted_file_names):
-                fpath = os.path.join( directory_vevo_jpg, file_name )
-                image = preprocess(Image.open(fpath)).unsqueeze(0).to(device)          
-                with torch.no_grad():
-                    image_features = model.encode_image(image)
-                features[idx] = image_features[0]
-            features = features.cpu().numpy()
-            np.save(output_path, features)
+    context = load(device)
+    for fid in list_ids(dataset_root):
+        print("id: ", fid)
+        build(context, dataset_root, fid)
+
 if __name__ == "__main__":
     main()
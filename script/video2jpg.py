@@ -3,6 +3,9 @@ import subprocess
 from moviepy.video.io.VideoFileClip import VideoFileClip
 import datetime
 
+# Exports the 1-fps frames as JPEG files. The feature scripts decode the same frames in memory
+# (utilities/video_loader.py read_frames_1fps) and do not need them.
+
 def main():
     input_dir = "../dataset/vevo/"
     output_dir = "../dataset/vevo_frame/"
@@ -0,0 +1,13 @@
+import os
+import sys
+
+import pytest
+
+# Tests run from the repository root, like the scripts: the modules are imported as top-level
+# packages and the vocabularies are read from ./dataset/vevo_meta
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+@pytest.fixture(autouse=True)
+def repo_root(monkeypatch):
+    monkeypatch.chdir(ROOT)
@@ -0,0 +1,60 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+vmt = pytest.importorskip("model.video_music_transformer")
+
+from utilities.constants import CHORD_END, CHORD_PAD, CHORD_SIZE
+from utilities.device import get_device
+
+NUM_PRIMER = 1
+TARGET_SEQ_LENGTH = 12
+
+class EndingModel(torch.nn.Module):
+    # Decoder stub for _generate_batch: uniform over chords 1-20, CHORD_END only for the rows of end_at
+    # (row -> position at which the row emits CHORD_END)
+    def __init__(self, end_at):
+        super().__init__()
+        self.end_at = end_at
+        self.softmax = torch.nn.Softmax(dim=-1)
+        self.eval()
+
+    def encode_video(self, feature_semantic_list, feature_scene_offset, feature_motion, feature_emotion):
+        return torch.zeros((1, 1, 4), device=get_device())
+
+    def init_cache(self):
+        return None
+
+    def decode(self, memory, x, x_root, x_attr, feature_key, cache=None):
+        batch_size, seq_len = x.shape
+        logits = torch.full((batch_size, seq_len, CHORD_SIZE), -1e9, device=get_device())
+        logits[..., 1:21] = 0.0
+        for row, position in self.end_at.items():
+            if seq_len == position:
+                logits[row, -1, CHORD_END] = 1e9
+        return logits
+
+def generate(model, num_samples):
+    primer = torch.ones((1, NUM_PRIMER), dtype=torch.long)
+    return vmt._generate_batch(model, None, torch.zeros(1), None, None, None, primer, primer, primer, num_samples,
+                               TARGET_SEQ_LENGTH, 0, 2, 1.0, True, None).cpu()
+
+def test_row_ending_is_padded_while_other_rows_continue():
+    torch.manual_seed(0)
+    end_position = NUM_PRIMER + 3
+    seq = generate(EndingModel({0: end_position}), 3)
+
+    assert seq.shape == (3, TARGET_SEQ_LENGTH)
+    assert seq[0, end_position] == CHORD_END
+    assert (seq[0, end_position + 1:] == CHORD_PAD).all()
+    assert ((seq[0, NUM_PRIMER:end_position] >= 1) & (seq[0, NUM_PRIMER:end_position] <= 20)).all()
+    # The other rows never end and keep sampling chords up to target_seq_length
+    assert ((seq[1:, NUM_PRIMER:] >= 1) & (seq[1:, NUM_PRIMER:] <= 20)).all()
+
+def test_stops_when_all_rows_ended():
+    torch.manual_seed(0)
+    seq = generate(EndingModel({0: NUM_PRIMER + 2, 1: NUM_PRIMER + 4}), 2)
+
+    assert seq.shape == (2, NUM_PRIMER + 5)
+    assert seq[0, NUM_PRIMER + 2] == CHORD_END
+    assert (seq[0, NUM_PRIMER + 3:] == CHORD_PAD).all()
+    assert seq[1, NUM_PRIMER + 4] == CHORD_END
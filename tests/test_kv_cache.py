@@ -0,0 +1,25 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+custom_transformer = pytest.importorskip("model.custom_transformer")
+
+@pytest.mark.parametrize("norm_first", [False, True])
+def test_stock_decoder_steps_match_full_decode(norm_first):
+    # Cached stepping of nn.TransformerDecoder (nn.Transformer without custom_decoder) against its forward
+    torch.manual_seed(0)
+    d_model, seq_len, mem_len, batch_size = 32, 7, 5, 3
+    layer = torch.nn.TransformerDecoderLayer(d_model, 4, 64, dropout=0.1, norm_first=norm_first)
+    decoder = torch.nn.TransformerDecoder(layer, 2, torch.nn.LayerNorm(d_model)).eval()
+    tgt = torch.randn(seq_len, batch_size, d_model)
+    memory = torch.randn(mem_len, batch_size, d_model)
+
+    mask = torch.nn.Transformer.generate_square_subsequent_mask(seq_len)
+    with torch.no_grad():
+        reference = decoder(tgt, memory, tgt_mask=mask)
+
+        cache = custom_transformer.init_kv_cache(decoder)
+        assert cache is not None
+        steps = [custom_transformer.decoder_forward_step(decoder, tgt[i:i+1], memory, cache) for i in range(seq_len)]
+
+    assert cache.length == seq_len
+    torch.testing.assert_close(torch.cat(steps, dim=0), reference, rtol=1e-4, atol=1e-5)
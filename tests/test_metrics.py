@@ -0,0 +1,377 @@
+import json
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+vevo_dataset = pytest.importorskip("dataset.vevo_dataset")
+
+import numpy as np
+import torch.nn as nn
+
+from utilities.constants import *
+from utilities.device import get_device
+from dataset.vevo_dataset import EMOTION_CHORD_TABLE, compute_hits_k, compute_hits_k_root_attr, \
+    compute_vevo_correspondence, compute_vevo_correspondence_root_attr, compute_vevo_accuracy_root_attr
+
+# Parity of the batched evaluation metrics of dataset/vevo_dataset.py with the former per-time-step
+# implementations (the *_loop functions below, copied unchanged). The loops only support batch size 1
+# (compute_hits_k_root_attr_loop only length 299), so a batch is flattened into one sequence for them:
+# (1, 299) and (13, 23) batches have 299 time steps.
+
+BATCH_SHAPES = [(1, 299), (13, 23)]
+N_BATCHES = 5
+TOLERANCE = 1e-6
+
+def compute_hits_k_loop(out, tgt, k):
+    softmax = nn.Softmax(dim=-1)
+    out = softmax(out)
+    _, topk_indices = torch.topk(out, k, dim=-1)  # Get the indices of top-k values
+
+    tgt = tgt.flatten()
+
+    topk_indices = torch.squeeze(topk_indices, dim = 0)
+
+    num_right = 0 
+    pt = 0
+    for i, tlist in enumerate(topk_indices):
+        if tgt[i] == CHORD_PAD:
+            num_right += 0
+        else:
+            pt += 1 
+            if tgt[i].item() in tlist:
+                num_right += 1
+
+    # Empty
+    if len(tgt) == 0:
+        return 1.0
+    
+    num_right = torch.tensor(num_right, dtype=torch.float32)
+    hitk = num_right / pt
+
+    return hitk
+
+def compute_hits_k_root_attr_loop(out_root, out_attr, tgt, k):
+    softmax = nn.Softmax(dim=-1)
+    out_root = softmax(out_root)
+    out_attr = softmax(out_attr)
+
+    tensor_shape = torch.Size([1, 299, 159])
+    out = torch.zeros(tensor_shape)
+    for i in range(out.shape[-1]):
+        if i == 0 :
+            out[0, :, i] = out_root[0, :, 0] * out_attr[0, :, 0] 
+        elif i == 157:
+            out[0, :, i] = out_root[0, :, 13] * out_attr[0, :, 14]
+        elif i == 158:
+            out[0, :, i] = out_root[0, :, 14] * out_attr[0, :, 15]
+        else:
+            rootindex =  int( (i-1)/13 ) + 1
+            attrindex =  (i-1)%13 + 1
+            out[0, :, i] = out_root[0, :, rootindex] * out_attr[0, :, attrindex]
+
+    out = softmax(out)
+    _, topk_indices = torch.topk(out, k, dim=-1)  # Get the indices of top-k values
+
+    tgt = tgt.flatten()
+
+    topk_indices = torch.squeeze(topk_indices, dim = 0)
+
+    num_right = 0 
+    pt = 0
+    for i, tlist in enumerate(topk_indices):
+        if tgt[i] == CHORD_PAD:
+            num_right += 0
+        else:
+            pt += 1 
+            if tgt[i].item() in tlist:
+                num_right += 1
+
+    if len(tgt) == 0:
+        return 1.0
+    
+    num_right = torch.tensor(num_right, dtype=torch.float32)
+    hitk = num_right / pt
+
+    return hitk
+
+def compute_vevo_correspondence_loop(out, tgt, tgt_emotion, tgt_emotion_prob, emotion_threshold):
+
+    tgt_emotion = tgt_emotion.squeeze()
+    tgt_emotion_prob = tgt_emotion_prob.squeeze()
+
+    dataset_root = "./dataset/"
+    chordRootInvDicPath = os.path.join( dataset_root, "vevo_meta/chord_root_inv.json")
+    chordAttrInvDicPath = os.path.join( dataset_root, "vevo_meta/chord_attr_inv.json")
+    chordAttrDicPath = os.path.join( dataset_root, "vevo_meta/chord_attr.json")
+    
+    chordDicPath = os.path.join( dataset_root, "vevo_meta/chord.json")
+    chordInvDicPath = os.path.join( dataset_root, "vevo_meta/chord_inv.json")
+
+    with open(chordRootInvDicPath) as json_file:
+        chordRootInvDic = json.load(json_file)
+    with open(chordAttrDicPath) as json_file:
+        chordAttrDic = json.load(json_file)
+    with open(chordAttrInvDicPath) as json_file:
+        chordAttrInvDic = json.load(json_file)
+    with open(chordDicPath) as json_file:
+        chordDic = json.load(json_file)
+    with open(chordInvDicPath) as json_file:
+        chordInvDic = json.load(json_file)
+
+    softmax = nn.Softmax(dim=-1)
+    out = torch.argmax(softmax(out), dim=-1)
+    out = out.flatten()
+
+    tgt = tgt.flatten()
+
+    num_right = 0
+    tgt_emotion_quality = tgt_emotion[:, 0:14]
+    pt = 0 
+    for i, out_element in enumerate( out ):
+
+        all_zeros = torch.all(tgt_emotion_quality[i] == 0)
+        if tgt_emotion[i][-1] == 1 or all_zeros or tgt_emotion_prob[i] < emotion_threshold:
+            num_right += 0
+        else:
+            pt += 1
+            if out_element.item() != CHORD_END and out_element.item() != CHORD_PAD:
+                gen_chord = chordInvDic[ str( out_element.item() ) ]
+
+                chord_arr = gen_chord.split(":")
+                if len(chord_arr) == 1:
+                    out_quality = 1
+                elif len(chord_arr) == 2:
+                    chordAttrID = chordAttrDic[chord_arr[1]]
+                    out_quality = chordAttrID # 0:N, 1:maj ... 13:maj7
+
+                if tgt_emotion_quality[i][out_quality] == 1:
+                    num_right += 1
+                    
+
+    if(len(tgt_emotion) == 0):
+        return 1.0
+    
+    if(pt == 0):
+        return -1
+    
+    num_right = torch.tensor(num_right, dtype=torch.float32)
+    acc = num_right / pt
+
+    return acc
+
+def compute_vevo_correspondence_root_attr_loop(y_root, y_attr, tgt, tgt_emotion, tgt_emotion_prob, emotion_threshold):
+
+    tgt_emotion = tgt_emotion.squeeze()
+    tgt_emotion_prob = tgt_emotion_prob.squeeze()
+
+    dataset_root = "./dataset/"
+    chordRootInvDicPath = os.path.join( dataset_root, "vevo_meta/chord_root_inv.json")
+    chordAttrInvDicPath = os.path.join( dataset_root, "vevo_meta/chord_attr_inv.json")
+    chordAttrDicPath = os.path.join( dataset_root, "vevo_meta/chord_attr.json")
+    
+    chordDicPath = os.path.join( dataset_root, "vevo_meta/chord.json")
+    chordInvDicPath = os.path.join( dataset_root, "vevo_meta/chord_inv.json")
+
+    with open(chordRootInvDicPath) as json_file:
+        chordRootInvDic = json.load(json_file)
+    with open(chordAttrDicPath) as json_file:
+        chordAttrDic = json.load(json_file)
+    with open(chordAttrInvDicPath) as json_file:
+        chordAttrInvDic = json.load(json_file)
+    with open(chordDicPath) as json_file:
+        chordDic = json.load(json_file)
+    with open(chordInvDicPath) as json_file:
+        chordInvDic = json.load(json_file)
+
+    softmax = nn.Softmax(dim=-1)
+
+    y_root = torch.argmax(softmax(y_root), dim=-1)
+    y_attr = torch.argmax(softmax(y_attr), dim=-1)
+    
+    y_root = y_root.flatten()
+    y_attr = y_attr.flatten()
+
+    tgt = tgt.flatten()
+    y = np.empty( len(tgt) )
+
+    y.fill(CHORD_PAD)
+
+    for i in range(len(tgt)):
+        if y_root[i].item() == CHORD_ROOT_PAD or y_attr[i].item() == CHORD_ATTR_PAD:
+            y[i] = CHORD_PAD
+        elif y_root[i].item() == CHORD_ROOT_END or y_attr[i].item() == CHORD_ATTR_END:
+            y[i] = CHORD_END
+        else:
+            chordRoot = chordRootInvDic[str(y_root[i].item())]
+            chordAttr = chordAttrInvDic[str(y_attr[i].item())]
+            if chordRoot == "N":
+                y[i] = 0
+            else:
+                if chordAttr == "N" or chordAttr == "maj":
+                    y[i] = chordDic[chordRoot]
+                else:
+                    chord = chordRoot + ":" + chordAttr
+                    y[i] = chordDic[chord]
+
+    y = torch.from_numpy(y)
+    y = y.to(torch.long)
+    y = y.to(get_device())
+    y = y.flatten()
+
+    num_right = 0
+    tgt_emotion_quality = tgt_emotion[:, 0:14]
+    pt = 0 
+    for i, y_element in enumerate( y ):
+        all_zeros = torch.all(tgt_emotion_quality[i] == 0)
+        if tgt_emotion[i][-1] == 1 or all_zeros or tgt_emotion_prob[i] < emotion_threshold:
+            num_right += 0
+        else:
+            pt += 1
+            if y_element.item() != CHORD_END and y_element.item() != CHORD_PAD:
+                gen_chord = chordInvDic[ str( y_element.item() ) ]
+                chord_arr = gen_chord.split(":")
+                if len(chord_arr) == 1:
+                    y_quality = 1
+                elif len(chord_arr) == 2:
+                    chordAttrID = chordAttrDic[chord_arr[1]]
+                    y_quality = chordAttrID # 0:N, 1:maj ... 13:maj7
+
+                if tgt_emotion_quality[i][y_quality] == 1:
+                    num_right += 1
+                    
+    if(len(tgt_emotion) == 0):
+        return 1.0
+    
+    if(pt == 0):
+        return -1
+    
+    num_right = torch.tensor(num_right, dtype=torch.float32)
+    acc = num_right / pt
+    return acc
+
+def compute_vevo_accuracy_root_attr_loop(y_root, y_attr, tgt):
+
+    dataset_root = "./dataset/"
+    chordRootInvDicPath = os.path.join( dataset_root, "vevo_meta/chord_root_inv.json")
+    chordAttrInvDicPath = os.path.join( dataset_root, "vevo_meta/chord_attr_inv.json")
+    chordDicPath = os.path.join( dataset_root, "vevo_meta/chord.json")
+    
+    with open(chordRootInvDicPath) as json_file:
+        chordRootInvDic = json.load(json_file)
+    with open(chordAttrInvDicPath) as json_file:
+        chordAttrInvDic = json.load(json_file)
+    with open(chordDicPath) as json_file:
+        chordDic = json.load(json_file)
+
+    softmax = nn.Softmax(dim=-1)
+
+    y_root = torch.argmax(softmax(y_root), dim=-1)
+    y_attr = torch.argmax(softmax(y_attr), dim=-1)
+    
+    y_root = y_root.flatten()
+    y_attr = y_attr.flatten()
+
+    tgt = tgt.flatten()
+
+    mask = (tgt != CHORD_PAD)
+    y = np.empty( len(tgt) )
+    y.fill(CHORD_PAD)
+
+    for i in range(len(tgt)):
+        if y_root[i].item() == CHORD_ROOT_PAD or y_attr[i].item() == CHORD_ATTR_PAD:
+            y[i] = CHORD_PAD
+        elif y_root[i].item() == CHORD_ROOT_END or y_attr[i].item() == CHORD_ATTR_END:
+            y[i] = CHORD_END
+        else:
+            chordRoot = chordRootInvDic[str(y_root[i].item())]
+            chordAttr = chordAttrInvDic[str(y_attr[i].item())]
+            if chordRoot == "N":
+                y[i] = 0
+            else:
+                if chordAttr == "N" or chordAttr == "maj":
+                    y[i] = chordDic[chordRoot]
+                else:
+                    chord = chordRoot + ":" + chordAttr
+                    y[i] = chordDic[chord]
+
+    y = torch.from_numpy(y)
+    y = y.to(torch.long)
+    y = y.to(get_device())
+
+    y = y[mask]
+    tgt = tgt[mask]
+
+    # Empty
+    if(len(tgt) == 0):
+        return 1.0
+
+    num_right = (y == tgt)
+    num_right = torch.sum(num_right).type(TORCH_FLOAT)
+
+    acc = num_right / len(tgt)
+    
+    return acc
+
+def random_batch(batch_size, seq_len):
+    device = get_device()
+    out = torch.randn(batch_size, seq_len, CHORD_SIZE, device=device)
+    y_root = torch.randn(batch_size, seq_len, CHORD_ROOT_SIZE, device=device)
+    y_attr = torch.randn(batch_size, seq_len, CHORD_ATTR_SIZE, device=device)
+
+    # Random chord lengths, END then PAD like VevoDataset
+    tgt = torch.full((batch_size, seq_len), CHORD_PAD, dtype=torch.long, device=device)
+    for b in range(batch_size):
+        length = torch.randint(1, seq_len, (1,)).item()
+        tgt[b, :length] = torch.randint(0, CHORD_END, (length,), device=device)
+        tgt[b, length] = CHORD_END
+
+    emotion = torch.randint(0, 6, (batch_size, seq_len), device=device)
+    emotion_row = emotion.masked_fill(tgt == CHORD_END, 6).masked_fill(tgt == CHORD_PAD, 7)
+    tgt_emotion = EMOTION_CHORD_TABLE.to(device)[emotion_row]
+    tgt_emotion_prob = torch.rand(batch_size, seq_len, device=device)
+    return out, y_root, y_attr, tgt, tgt_emotion, tgt_emotion_prob
+
+def random_batches(batch_size, seq_len):
+    torch.manual_seed(batch_size * 1000 + seq_len)
+    return [random_batch(batch_size, seq_len) for _ in range(N_BATCHES)]
+
+def flat(x):
+    return x.reshape(1, -1, *x.shape[2:])
+
+@pytest.mark.parametrize("batch_size,seq_len", BATCH_SHAPES)
+@pytest.mark.parametrize("k", [1, 3, 5])
+def test_hits_k(batch_size, seq_len, k):
+    for out, y_root, y_attr, tgt, tgt_emotion, tgt_emotion_prob in random_batches(batch_size, seq_len):
+        expected = float(compute_hits_k_loop(flat(out), flat(tgt), k))
+        assert float(compute_hits_k(out, tgt, k)) == pytest.approx(expected, abs=TOLERANCE)
+
+@pytest.mark.parametrize("batch_size,seq_len", BATCH_SHAPES)
+@pytest.mark.parametrize("k", [1, 3, 5])
+def test_hits_k_root_attr(batch_size, seq_len, k):
+    for out, y_root, y_attr, tgt, tgt_emotion, tgt_emotion_prob in random_batches(batch_size, seq_len):
+        expected = float(compute_hits_k_root_attr_loop(flat(y_root), flat(y_attr), flat(tgt), k))
+        assert float(compute_hits_k_root_attr(y_root, y_attr, tgt, k)) == pytest.approx(expected, abs=TOLERANCE)
+
+@pytest.mark.parametrize("batch_size,seq_len", BATCH_SHAPES)
+def test_vevo_correspondence(batch_size, seq_len):
+    for out, y_root, y_attr, tgt, tgt_emotion, tgt_emotion_prob in random_batches(batch_size, seq_len):
+        expected = float(compute_vevo_correspondence_loop(flat(out), flat(tgt), flat(tgt_emotion), flat(tgt_emotion_prob),
+                                                          EMOTION_THRESHOLD))
+        result = float(compute_vevo_correspondence(out, tgt, tgt_emotion, tgt_emotion_prob, EMOTION_THRESHOLD))
+        assert result == pytest.approx(expected, abs=TOLERANCE)
+
+@pytest.mark.parametrize("batch_size,seq_len", BATCH_SHAPES)
+def test_vevo_correspondence_root_attr(batch_size, seq_len):
+    for out, y_root, y_attr, tgt, tgt_emotion, tgt_emotion_prob in random_batches(batch_size, seq_len):
+        expected = float(compute_vevo_correspondence_root_attr_loop(flat(y_root), flat(y_attr), flat(tgt), flat(tgt_emotion),
+                                                                    flat(tgt_emotion_prob), EMOTION_THRESHOLD))
+        result = float(compute_vevo_correspondence_root_attr(y_root, y_attr, tgt, tgt_emotion, tgt_emotion_prob,
+                                                             EMOTION_THRESHOLD))
+        assert result == pytest.approx(expected, abs=TOLERANCE)
+
+@pytest.mark.parametrize("batch_size,seq_len", BATCH_SHAPES)
+def test_vevo_accuracy_root_attr(batch_size, seq_len):
+    for out, y_root, y_attr, tgt, tgt_emotion, tgt_emotion_prob in random_batches(batch_size, seq_len):
+        expected = float(compute_vevo_accuracy_root_attr_loop(flat(y_root), flat(y_attr), flat(tgt)))
+        assert float(compute_vevo_accuracy_root_attr(y_root, y_attr, tgt)) == pytest.approx(expected, abs=TOLERANCE)
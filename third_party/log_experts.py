@@ -5,84 +5,14 @@ import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 
-is_logging = False
-n_layers = 6  # Number of layers
-index_layer = 0
-# Global variable to store indices
-indices = []
-
-# Global 3D array to count selections for each emotion-expert pair for n-layers
-counts = [
-    [[0 for _ in range(6)] for _ in range(6)] for _ in range(n_layers)
-]  # 6 emotions and 6 experts
-
-
-# Change logging state
-def change_logging_state(state):
-    global is_logging
-    is_logging = state
-
-def get_highest_emotion_indices(emotion_feature, training=False):
-    if training:
-        return None
-    
-    global is_logging
-    if not is_logging:
-        return
-    global indices  # Declare that we are using the global variable
-    indices = []  # Reset the global indices list
-
-    # Remove the batch dimension for easier processing
-    emotion_feature = emotion_feature.squeeze(0)
-
-    for i in range(emotion_feature.size(0)):  # Iterate over the sequence length
-        # Get the maximum probability and its index for each token
-        max_prob, max_index = torch.max(emotion_feature[i], dim=0)
-
-        # Check if all probabilities are zero
-        if torch.all(emotion_feature[i] == 0):
-            indices.append(-1)
-        else:
-            indices.append(max_index.item())  # Convert to Python integer
-    return indices
-
-
-def update_expert_counts(selected_expert, training=False):
-    if training:
-        return
-    
-    global is_logging
-    if not is_logging:
-        return
-    global indices  # Use the global indices
-    global counts  # Use the global counts
-    global index_layer  # Use the global index_layer
-
-    # Remove unnecessary dimensions for easier processing
-    selected_expert = selected_expert.squeeze(1)
-    # Iterate over the global indices
-    for i in range(selected_expert.size(0)):
-        index = indices[i]
-        if index != -1:  # Skip if index is -1
-            # Get the selected experts for the current index
-            experts = selected_expert[i]  # This will be a tensor of shape (2)
-
-            # Increment the count for each selected expert
-            for expert in experts:
-                counts[index_layer][index][expert.item()] += 1  # Increment count
-    index_layer += 1
-    if index_layer == n_layers:
-        index_layer = 0
-
+# Routing counts are collected by model/routing_stats.py (RoutingStats.get_counts)
 
 def save_and_plot(
-    filename="log/experts_emotion_count", plotname="log/experts_emotion_count_plot"
+    routing_counts, filename="log/experts_emotion_count", plotname="log/experts_emotion_count_plot"
 ):
-    global is_logging
-    if not is_logging:
-        return
-    global counts
-    for i in range(n_layers):
+    # routing_counts: (n_layers, n_experts, n_emotions + 1) tensor, the last column (no emotion) is not plotted
+    counts = routing_counts[:, :, :-1].transpose(1, 2).cpu().tolist()  # [layer][emotion][expert]
+    for i in range(len(counts)):
         f = filename + str(i) + ".json"
         # Create the directory if it does not exist
         directory = os.path.dirname(f)
@@ -9,7 +9,7 @@ from torch.optim import Adam, AdamW, RAdam
 from model.RAdanW import RAdanW
 from lion_pytorch import Lion
 
-from dataset.vevo_dataset import compute_vevo_accuracy, create_vevo_datasets
+from dataset.vevo_dataset import compute_vevo_accuracy, create_vevo_datasets, MixupCollate
 
 from model.music_transformer import MusicTransformer
 from model.video_music_transformer import *
@@ -22,7 +22,7 @@ from utilities.lr_scheduling import LrStepTracker, get_lr
 from utilities.argument_funcs import parse_train_args, print_train_args, write_model_params
 
 from utilities.run_model_vevo import train_epoch, eval_model
-from third_party.log_maxvio import change_maxvio_logging_state
+from model.routing_stats import attach_routing_stats
 from utilities.constants import *
 
 torch.autograd.set_detect_anomaly(True)
@@ -46,10 +46,6 @@ VIS_MODELS_ARR = [
 def main( vm = "" , isPrintArgs = True ):
     args = parse_train_args()[0]
 
-    # Logging
-    if args.music_gen_version != None and args.music_gen_version in ('2.3'):
-        change_maxvio_logging_state(True)
-
     if isPrintArgs:
         print_train_args(args)
     if vm != "":
@@ -105,7 +101,8 @@ def main( vm = "" , isPrintArgs = True ):
         split_ver = SPLIT_VER, 
         random_seq = True, 
         is_video = args.is_video,
-        augmentation = args.augmentation)
+        lazy = args.lazy_dataset,
+        lazy_cache_size = args.lazy_cache_size)
     
     total_vf_dim = 0
 
@@ -129,7 +126,9 @@ def main( vm = "" , isPrintArgs = True ):
         else:
             total_vf_dim += 5
 
-    train_loader = DataLoader(train_dataset, batch_size=args.batch_size, num_workers=args.n_workers, shuffle=True)
+    # Augmentation: mixup of a mix_prob share of the training samples
+    train_collate_fn = MixupCollate(mix_prob=args.mix_prob) if args.augmentation else None
+    train_loader = DataLoader(train_dataset, batch_size=args.batch_size, num_workers=args.n_workers, shuffle=True, collate_fn=train_collate_fn)
     train_loader_tmp = DataLoader(train_dataset, batch_size=1, num_workers=args.n_workers, shuffle=True)
     val_loader = DataLoader(val_dataset, batch_size=1, num_workers=args.n_workers)
 
@@ -183,6 +182,10 @@ def main( vm = "" , isPrintArgs = True ):
         print("ERROR: Need continue weights (-continue_weights) when using continue_epoch")
         assert(False)
 
+    # Logging: maxvio of the MoE routing, saved after every evaluation
+    if args.music_gen_version != None and args.music_gen_version in ('2.3'):
+        attach_routing_stats(model)
+
     ##### Lr Scheduler vs static lr #####
     if(args.lr is None):
         if(args.continue_epoch is None):
@@ -376,9 +379,6 @@ def main( vm = "" , isPrintArgs = True ):
     if(not args.no_tensorboard):
         tensorboard_summary.flush()
 
-    # Turn off logging
-    change_maxvio_logging_state(False)
-
     return
 
 if __name__ == "__main__":
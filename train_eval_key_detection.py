@@ -55,8 +55,7 @@ def main():
         emo_model = args.emo_model, 
         motion_type = args.motion_type,
         split_ver = SPLIT_VER, 
-        random_seq = True,
-        augmentation = args.augmentation)
+        random_seq = True)
     
     total_vf_dim = 0
     total_vf_dim += train_dataset[0]["semanticList"].shape[1]
@@ -8,7 +8,7 @@ from torch.utils.data import DataLoader
 from torch.optim import Adam, AdamW, RAdam
 from lion_pytorch import Lion
 
-from dataset.vevo_dataset import create_vevo_datasets
+from dataset.vevo_dataset import create_vevo_datasets, MixupCollate
 from model.video_regression import VideoRegression
 
 from utilities.constants import *
@@ -86,8 +86,7 @@ def main( vm = "" , isPrintArgs = True ):
         emo_model = args.emo_model, 
         motion_type = args.motion_type,
         split_ver = SPLIT_VER, 
-        random_seq = True,
-        augmentation = args.augmentation)
+        random_seq = True)
     
     total_vf_dim = 0
     total_vf_dim += train_dataset[0]["semanticList"].shape[1]
@@ -108,7 +107,9 @@ def main( vm = "" , isPrintArgs = True ):
     else:
         total_vf_dim += 5
 
-    train_loader = DataLoader(train_dataset, batch_size=args.batch_size, num_workers=args.n_workers, shuffle=True)
+    # Augmentation: mixup of a mix_prob share of the training samples (all regression targets are continuous)
+    train_collate_fn = MixupCollate(mix_prob=args.mix_prob) if args.augmentation else None
+    train_loader = DataLoader(train_dataset, batch_size=args.batch_size, num_workers=args.n_workers, shuffle=True, collate_fn=train_collate_fn)
     val_loader = DataLoader(val_dataset, batch_size=args.batch_size, num_workers=args.n_workers)
     
     model = VideoRegression(n_layers=args.n_layers, d_model=args.d_model, d_hidden=args.dim_feedforward, 
@@ -66,6 +66,9 @@ def parse_train_args():
     parser.add_argument("-chord_embed", type=bool, default=chord_embed, help="Use chord embedding or not")
     parser.add_argument("-rpr", type=bool, default=rpr, help="...")
     parser.add_argument("-augmentation", type=bool, default=augmentation, help="Use data augmentation or not")
+    parser.add_argument("-mix_prob", type=float, default=2/3, help="Probability of a training sample to be mixed (with -augmentation)")
+    parser.add_argument("-lazy_dataset", type=bool, default=False, help="Build dataset samples on demand instead of loading the whole split")
+    parser.add_argument("-lazy_cache_size", type=int, default=64, help="Number of samples kept per dataset (and dataloader worker) in lazy mode")
     parser.add_argument("-droptoken", type=float, default=droptoken, help="Drop Token rate")
     parser.add_argument("-optimizer", type=str, default=optimizer, help="Choose optimizer")
     parser.add_argument("-auxiliary_loss", type=bool, default=auxiliary_loss, help="False / True")
@@ -119,6 +122,8 @@ def print_train_args(args):
     print("chord embedding:", args.chord_embed)
     print("music_gen_version:", args.music_gen_version)
     print("augmentation:", args.augmentation)
+    print("mix_prob:", args.mix_prob)
+    print("lazy_dataset:", args.lazy_dataset)
     print("droptoken:", args.droptoken)
     print("optimizer:", args.optimizer)
     print("auxiliary_loss:", args.auxiliary_loss)
@@ -171,6 +176,7 @@ def parse_eval_args():
     parser.add_argument("-chord_embed", type=bool, default=chord_embed, help="Use chord embedding or not")
     parser.add_argument("-rpr", type=bool, default=rpr, help="...")
     parser.add_argument("-balancing", type=bool, default=balancing, help="False / True")
+    parser.add_argument("-attn_backend", type=str, default="reference", help="Attention backend of the custom attention modules: reference or sdpa")
     return parser.parse_known_args()
 
 def print_eval_args(args):
@@ -202,6 +208,7 @@ def print_eval_args(args):
     print("chord embedding:", args.chord_embed)
     print("music_gen_version:", args.music_gen_version)
     print("balancing:", args.balancing)
+    print("attn_backend:", args.attn_backend)
 
     print(SEPERATOR)
     print("")
@@ -235,6 +242,8 @@ def write_model_params(args, output_file):
     o_stream.write("scene_embed: " + str(args.scene_embed) + "\n")
     o_stream.write("chord_embed: " + str(args.chord_embed) + "\n")
     o_stream.write("augmentation: " + str(args.augmentation) + "\n")
+    o_stream.write("mix_prob: " + str(args.mix_prob) + "\n")
+    o_stream.write("lazy_dataset: " + str(args.lazy_dataset) + "\n")
     o_stream.write("droptoken: " + str(args.droptoken) + "\n")
     o_stream.write("input_dir_music: " + str(args.input_dir_music) + "\n")
     o_stream.write("input_dir_video: " + str(args.input_dir_video) + "\n")
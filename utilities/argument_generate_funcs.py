@@ -1,5 +1,6 @@
 import argparse
 from .constants import *
+from .video_mux import MUX_MODES
 
 version = VERSION
 split_ver = SPLIT_VER
@@ -54,6 +55,13 @@ def parse_generate_args():
 
     parser.add_argument("-primer_file", type=str, default=None, help="File path or integer index to the evaluation dataset. Default is to select a random index.")
     parser.add_argument("--force_cpu", action="store_true", help="Forces model to run on a cpu even when gpu is available")
+    parser.add_argument("--lazy_extractors", action="store_true", help="Load the video feature extractors (CLIP, MaxViT) on first use instead of at startup, without warm-up")
+    parser.add_argument("-extract_batch_size", type=int, default=32, help="Frames per forward of the video feature extractors")
+    parser.add_argument("-extract_workers", type=int, default=4, help="Threads preprocessing the frames of the video feature extractors while the previous batch is encoded, 0 preprocesses in the request thread")
+    parser.add_argument("-mux", type=str, default="copy", choices=MUX_MODES, help="Output video: copy the video stream and encode only the audio, or re-encode with moviepy (copy falls back to moviepy)")
+    parser.add_argument("-export_dir", type=str, default=None, help="Write the intermediate files of every request (features, MIDI, audio) to export_dir/<request id>, nothing is written without it")
+    parser.add_argument("-workspace_ttl", type=float, default=3600.0, help="Seconds the output video of a request is kept in its temporary workspace")
+    parser.add_argument("-render_workers", type=int, default=4, help="FluidSynth worker processes, renders of different soundfonts run concurrently")
 
     parser.add_argument("-target_seq_length_midi", type=int, default=1024, help="Target length you'd like the midi to be")
     parser.add_argument("-target_seq_length_chord", type=int, default=300, help="Target length you'd like the midi to be")
@@ -82,6 +90,7 @@ def parse_generate_args():
     parser.add_argument('-music_gen_version', type=str, default='2.2', help="Version number. None is original musgic generation AMT model")
     parser.add_argument("-scene_embed", type=bool, default=False, help="Use scene offset embedding or not")
     parser.add_argument("-balancing", type=bool, default=True, help="False / True")
+    parser.add_argument("-attn_backend", type=str, default="reference", help="Attention backend of the custom attention modules: reference or sdpa")
 
     # Reg model
     parser.add_argument("-n_layers_reg", type=int, default=6, help="Number of layers to use")
@@ -112,6 +121,13 @@ def print_generate_args(args):
     print("output_dir:", args.output_dir)
     print("primer_file:", args.primer_file)
     print("force_cpu:", args.force_cpu)
+    print("lazy_extractors:", args.lazy_extractors)
+    print("extract_batch_size:", args.extract_batch_size)
+    print("extract_workers:", args.extract_workers)
+    print("mux:", args.mux)
+    print("export_dir:", args.export_dir)
+    print("workspace_ttl:", args.workspace_ttl)
+    print("render_workers:", args.render_workers)
     print("")
 
     print("target_seq_length_midi:", args.target_seq_length_midi)
@@ -142,6 +158,7 @@ def print_generate_args(args):
     print("vis_models: ", args.vis_models)
     print("emo_model: ", args.emo_model)
     print("motion_type: ", args.motion_type)
+    print("attn_backend: ", args.attn_backend)
 
     print("")
     print("REGRESSION MODEL")
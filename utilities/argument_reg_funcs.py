@@ -70,6 +70,7 @@ def parse_train_args():
 
     parser.add_argument("-emo_model", type=str, default="6c_l14p", help="...")
     parser.add_argument("-augmentation", type=bool, default=augmentation, help="Use data augmentation or not")
+    parser.add_argument("-mix_prob", type=float, default=2/3, help="Probability of a training sample to be mixed (with -augmentation)")
     parser.add_argument("-motion_type", type=int, default=motion_type, help="0 as original, 1 as our option 1, 2 as out option 2")
     parser.add_argument("-scene_embed", type=bool, default=scene_embed, help="Use scene offset embedding or not")
     parser.add_argument("-optimizer", type=str, default=optimizer, help="optimizer")
@@ -117,6 +118,7 @@ def print_train_args(args):
     print("motion_type:", args.motion_type)
     print("scene embedding:", args.scene_embed)
     print("augmentation:", args.augmentation)
+    print("mix_prob:", args.mix_prob)
     print("optimizer:", args.optimizer)
 
     print(SEPERATOR)
@@ -235,6 +237,7 @@ def write_model_params(args, output_file):
     o_stream.write("motion_type: " + str(args.motion_type) + "\n")
     o_stream.write("scene_embed: " + str(args.scene_embed) + "\n")
     o_stream.write("augmentation: " + str(args.augmentation) + "\n")
+    o_stream.write("mix_prob: " + str(args.mix_prob) + "\n")
     o_stream.write("optimizer: " + str(args.optimizer) + "\n")
 
     o_stream.close()
@@ -0,0 +1,39 @@
+import math
+import subprocess
+import numpy as np
+
+# Mixing of rendered tracks ((n_samples, 2) int16 PCM, e.g. SoundfontRenderPool) into one stereo track.
+# Every track gets a (left, right) gain pair, the tracks are accumulated into one float32 buffer of the
+# longest track, so the memory is the output plus one track on top of the inputs.
+
+def pan_gains(pan, gain=1.0):
+    # MIDI pan values 0-127 (64 center) and gains -> (n, 2) float32 left / right gains.
+    # Constant power (GM2 pan law), scaled so a centered track keeps its level.
+    pan = np.clip(np.asarray(pan, dtype=np.float64), 1, 127)
+    theta = (pan - 1) / 126 * (math.pi / 2)
+    gains = np.stack([np.cos(theta), np.sin(theta)], axis=-1) * math.sqrt(2)
+    gains *= np.asarray(gain, dtype=np.float64)[..., None]
+    return gains.reshape(-1, 2).astype(np.float32)
+
+def mix_tracks(tracks, gains):
+    # tracks: list of (n_i, 2) int16 PCM, gains: (len(tracks), 2) -> (max n_i, 2) int16, saturated like pydub overlay
+    length = max((len(pcm) for pcm in tracks), default=0)
+    mixed = np.zeros((length, 2), dtype=np.float32)
+    for pcm, gain in zip(tracks, np.asarray(gains, dtype=np.float32)):
+        mixed[:len(pcm)] += pcm * gain
+    np.rint(mixed, out=mixed)
+    np.clip(mixed, -32768, 32767, out=mixed)
+    return mixed.astype(np.int16)
+
+def write_audio(path, pcm, sample_rate):
+    # (n_samples, 2) int16 PCM -> audio file, format from the extension (ffmpeg)
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-f", "s16le", "-ar", str(sample_rate), "-ac", "2",
+           "-i", "pipe:", str(path)]
+    process = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+    try:
+        process.stdin.write(np.ascontiguousarray(pcm).data)
+    finally:
+        process.stdin.close()
+        process.wait()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg could not write {path}")
@@ -0,0 +1,124 @@
+import numpy as np
+
+# Table-driven note events of the rendered chord tracks (Video2music.render).
+# Every chord gets one pattern: (voice, onset, velocity scale) rows played from the start of the chord,
+# chosen by arpeggio / block, note density and chord offset parity, and whether the chord has a fifth voice.
+# note_events computes the notes of all tracks at once, add_note_events writes a track with MIDIFile.addNote
+# in the order of the former per-chord addChord, so the written MIDI files are unchanged.
+
+# Velocity scale per chord voice (first .. fifth)
+VOICE_VELO = (1.1, 0.95, 0.98, 1.0, 0.95)
+# Extra velocity scale of the block (non-arpeggio) chords
+DIMINISH_VELO = 0.6
+
+# Arpeggio per density level: ((voice, onset) of even chord offsets, of odd chord offsets, onset of the fifth voice)
+ARPEGGIO_PATTERNS = (
+    (((0, 0), (1, 1)),
+     ((2, 0), (3, 1)), 2),
+    (((0, 0), (1, 0.5), (2, 1)),
+     ((3, 0), (1, 0.5), (2, 1)), 1.5),
+    (((0, 0), (1, 0.5), (2, 1), (3, 1.5)),
+     ((2, 0), (1, 0.5), (2, 1), (3, 1.5)), 2),
+    (((0, 0), (1, 0.25), (2, 0.5), (1, 0.75), (3, 1), (2, 1.5)),
+     ((1, 0), (0, 0.25), (1, 0.5), (2, 0.75), (3, 1), (2, 1.5)), 2),
+    (((0, 0), (1, 0.25), (2, 0.5), (1, 0.75), (3, 1), (2, 1.25), (1, 1.5), (2, 1.75)),
+     ((1, 0), (0, 0.25), (1, 0.5), (2, 0.75), (3, 1), (2, 1.25), (1, 1.5), (2, 1.75)), 2),
+)
+# Block chord: all voices at once
+BLOCK_PATTERN = ((0, 0), (1, 0), (2, 0), (3, 0))
+
+NOTE_EVENT = np.dtype([("track", np.int64), ("pitch", np.int64), ("time", np.float64), ("volume", np.int64)])
+
+def _build_patterns():
+    # Pattern 0 is empty (chords with less than 4 voices, unknown densities, inactive chords).
+    # Arpeggio patterns: 1 + (density * 2 + parity) * 2 + has_fifth, block patterns: BLOCK_ID + has_fifth.
+    patterns = [[]]
+    for even, odd, fifth_onset in ARPEGGIO_PATTERNS:
+        for notes in (even, odd):
+            for has_fifth in (False, True):
+                rows = [(voice, onset, VOICE_VELO[voice], 1.0) for voice, onset in notes]
+                if has_fifth:
+                    rows.append((4, fifth_onset, VOICE_VELO[4], 1.0))
+                patterns.append(rows)
+    for has_fifth in (False, True):
+        notes = BLOCK_PATTERN + ((4, 0),) if has_fifth else BLOCK_PATTERN
+        patterns.append([(voice, onset, VOICE_VELO[voice], DIMINISH_VELO) for voice, onset in notes])
+
+    width = max(len(rows) for rows in patterns)
+    length = np.array([len(rows) for rows in patterns], dtype=np.int64)
+    voice = np.zeros((len(patterns), width), dtype=np.int64)
+    onset = np.zeros((len(patterns), width), dtype=np.float64)
+    velo = np.zeros((len(patterns), width), dtype=np.float64)
+    diminish = np.ones((len(patterns), width), dtype=np.float64)
+    for i, rows in enumerate(patterns):
+        for j, row in enumerate(rows):
+            voice[i, j], onset[i, j], velo[i, j], diminish[i, j] = row
+    for array in (length, voice, onset, velo, diminish):
+        array.flags.writeable = False
+    return length, voice, onset, velo, diminish
+
+PATTERN_LEN, PATTERN_VOICE, PATTERN_ONSET, PATTERN_VELO, PATTERN_DIMINISH = _build_patterns()
+BLOCK_ID = len(PATTERN_LEN) - 2
+
+def chord_pitch_table(chords):
+    # Voiced chords (lists of MIDI pitches, e.g. voice()) -> (n_chords, max(5, longest)) pitches, zero padded, and lengths
+    lengths = np.array([len(chord) for chord in chords], dtype=np.int64)
+    pitches = np.zeros((len(chords), max(5, int(lengths.max(initial=0)))), dtype=np.int64)
+    for i, chord in enumerate(chords):
+        pitches[i, :len(chord)] = chord
+    return pitches, lengths
+
+def note_events(pitches, lengths, chord_offsets, densities, velocities, arpeggio, duration, active=None, start=0):
+    """
+    Note events (NOTE_EVENT array) of one or several tracks, chord i starting at start + i * duration:
+        pitches, lengths    chord_pitch_table
+        chord_offsets       position of the chord in its run of equal chords, the parity picks the arpeggio
+        densities           note density level 0-4 of the arpeggio
+        velocities          velocity per chord, scaled per voice and truncated to int
+        arpeggio            bool (False: block chords)
+        active              bool, chords without notes are False (default: all chords play)
+    velocities, arpeggio and active broadcast to (n_chords,) for one track or (n_tracks, n_chords),
+    the "track" field of the events is the track index (0 for one track).
+    Only chords with at least 4 voices play, the fifth voice of 5-voice chords is added last.
+    Events are ordered by track, chord, then pattern row.
+    """
+    n_chords = len(lengths)
+    velocities = np.asarray(velocities, dtype=np.float64)
+    arpeggio = np.asarray(arpeggio, dtype=bool)
+    shape = np.broadcast_shapes(velocities.shape, arpeggio.shape, np.shape(active) if active is not None else (),
+                                (n_chords,))
+    shape = (1,) * (2 - len(shape)) + shape
+
+    has_fifth = (lengths == 5).astype(np.int64)
+    densities = np.asarray(densities, dtype=np.int64)
+    known_density = (densities >= 0) & (densities < len(ARPEGGIO_PATTERNS))
+    arpeggio_id = 1 + (np.clip(densities, 0, len(ARPEGGIO_PATTERNS) - 1) * 2
+                       + np.asarray(chord_offsets, dtype=np.int64) % 2) * 2 + has_fifth
+    arpeggio_id = np.where(known_density, arpeggio_id, 0)
+    pattern = np.where(np.broadcast_to(arpeggio, shape), arpeggio_id, BLOCK_ID + has_fifth)
+    pattern[:, lengths < 4] = 0
+    if active is not None:
+        pattern[~np.broadcast_to(np.asarray(active, dtype=bool), shape)] = 0
+
+    # Row-major nonzero: track, chord, then pattern order
+    track, chord_idx, row = np.nonzero(np.arange(PATTERN_VOICE.shape[1]) < PATTERN_LEN[pattern][..., None])
+    pattern = pattern[track, chord_idx]
+
+    events = np.empty(len(chord_idx), dtype=NOTE_EVENT)
+    events["track"] = track
+    events["pitch"] = pitches[chord_idx, PATTERN_VOICE[pattern, row]]
+    events["time"] = (start + chord_idx * duration) + PATTERN_ONSET[pattern, row]
+    # Same rounding as int(velocity * voice_velo * diminish_velo)
+    velocities = np.broadcast_to(velocities, shape)[track, chord_idx]
+    events["volume"] = np.trunc(velocities * PATTERN_VELO[pattern, row] * PATTERN_DIMINISH[pattern, row])
+    return events
+
+def split_tracks(events, n_tracks):
+    # note_events of several tracks -> one event array per track
+    bounds = np.searchsorted(events["track"], np.arange(1, n_tracks))
+    return np.split(events, bounds)
+
+def add_note_events(midifile, events, duration, track=0, channel=0):
+    # Writes note_events to midifile, in order
+    for pitch, time, volume in zip(events["pitch"].tolist(), events["time"].tolist(), events["volume"].tolist()):
+        midifile.addNote(track, channel, pitch, time, duration, volume)
@@ -0,0 +1,132 @@
+import os
+import json
+import threading
+import numpy as np
+import torch
+
+from types import MappingProxyType
+from functools import lru_cache
+from .constants import *
+from .device import get_device
+
+class ChordVocab(object):
+    """
+    Chord vocabularies of dataset/vevo_meta (chord.json, chord_root.json, chord_attr.json), use
+    get_chord_vocab to share one instance per process. Read-only after construction, pickles as a
+    reference to the shared instance of its meta_dir (DataLoader workers).
+
+    Maps:   chord_to_id, root_to_id, attr_to_id (symbol -> id), id_to_chord, id_to_root, id_to_attr (id -> symbol)
+
+    Dense lookup arrays (numpy, int64), indexed by chord id (CHORD_SIZE entries, CHORD_END / CHORD_PAD included):
+        chord_root      root id of the chord, CHORD_ROOT_END / CHORD_ROOT_PAD for CHORD_END / CHORD_PAD
+        chord_attr      attr id as encoded by VevoDataset: N -> N, chords without attribute -> maj
+        chord_quality   attr id of the chord symbol as used by the samplers and metrics: chords without
+                        ":" (N included) -> maj. CHORD_ATTR_END / CHORD_ATTR_PAD for CHORD_END / CHORD_PAD
+    and root_attr_chord, (CHORD_ROOT_SIZE, CHORD_ATTR_SIZE) root id x attr id -> chord id (N root -> N,
+    N / maj attr -> chord without attribute, END or PAD on either side -> CHORD_END / CHORD_PAD).
+
+    tensor(name, device) returns a lookup array as a tensor on device, copied once per device.
+    """
+    def __init__(self, meta_dir="./dataset/vevo_meta"):
+        meta_dir = os.path.abspath(meta_dir)
+        chord_to_id = _load_json(meta_dir, "chord.json")
+        root_to_id = _load_json(meta_dir, "chord_root.json")
+        attr_to_id = _load_json(meta_dir, "chord_attr.json")
+
+        id_to_chord = _inverse(chord_to_id)
+        id_to_root = _inverse(root_to_id)
+        id_to_attr = _inverse(attr_to_id)
+
+        chord_root = np.full(CHORD_SIZE, CHORD_ROOT_PAD, dtype=np.int64)
+        chord_attr = np.full(CHORD_SIZE, CHORD_ATTR_PAD, dtype=np.int64)
+        chord_quality = np.full(CHORD_SIZE, CHORD_ATTR_PAD, dtype=np.int64)
+        chord_root[CHORD_END] = CHORD_ROOT_END
+        chord_attr[CHORD_END] = CHORD_ATTR_END
+        chord_quality[CHORD_END] = CHORD_ATTR_END
+        for chord_id, chord in enumerate(id_to_chord):
+            chord_arr = chord.split(":")
+            chord_root[chord_id] = root_to_id[chord_arr[0]]
+            if len(chord_arr) == 1:
+                chord_attr[chord_id] = attr_to_id["N"] if chord == "N" else attr_to_id["maj"]
+                chord_quality[chord_id] = attr_to_id["maj"]
+            else:
+                chord_attr[chord_id] = attr_to_id[chord_arr[1]]
+                chord_quality[chord_id] = attr_to_id[chord_arr[1]]
+
+        root_attr_chord = np.full((CHORD_ROOT_SIZE, CHORD_ATTR_SIZE), CHORD_PAD, dtype=np.int64)
+        for root_id in range(CHORD_ROOT_SIZE):
+            for attr_id in range(CHORD_ATTR_SIZE):
+                if root_id == CHORD_ROOT_PAD or attr_id == CHORD_ATTR_PAD:
+                    root_attr_chord[root_id, attr_id] = CHORD_PAD
+                elif root_id == CHORD_ROOT_END or attr_id == CHORD_ATTR_END:
+                    root_attr_chord[root_id, attr_id] = CHORD_END
+                elif id_to_root[root_id] == "N":
+                    root_attr_chord[root_id, attr_id] = chord_to_id["N"]
+                elif id_to_attr[attr_id] in ("N", "maj"):
+                    root_attr_chord[root_id, attr_id] = chord_to_id[id_to_root[root_id]]
+                else:
+                    root_attr_chord[root_id, attr_id] = chord_to_id[id_to_root[root_id] + ":" + id_to_attr[attr_id]]
+
+        arrays = {
+            "chord_root": chord_root,
+            "chord_attr": chord_attr,
+            "chord_quality": chord_quality,
+            "root_attr_chord": root_attr_chord,
+        }
+        for array in arrays.values():
+            array.flags.writeable = False
+
+        object.__setattr__(self, "meta_dir", meta_dir)
+        object.__setattr__(self, "chord_to_id", MappingProxyType(chord_to_id))
+        object.__setattr__(self, "root_to_id", MappingProxyType(root_to_id))
+        object.__setattr__(self, "attr_to_id", MappingProxyType(attr_to_id))
+        object.__setattr__(self, "id_to_chord", tuple(id_to_chord))
+        object.__setattr__(self, "id_to_root", tuple(id_to_root))
+        object.__setattr__(self, "id_to_attr", tuple(id_to_attr))
+        object.__setattr__(self, "_arrays", arrays)
+        object.__setattr__(self, "_tensors", {})
+        object.__setattr__(self, "_lock", threading.Lock())
+        for name, array in arrays.items():
+            object.__setattr__(self, name, array)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ChordVocab is read-only")
+
+    def __reduce__(self):
+        return (_get_chord_vocab, (self.meta_dir,))
+
+    def tensor(self, name, device=None):
+        # Lookup array name as a long tensor on device (default: get_device())
+        device = torch.device(device) if device is not None else get_device()
+        key = (name, device)
+        tensor = self._tensors.get(key)
+        if tensor is None:
+            with self._lock:
+                tensor = self._tensors.get(key)
+                if tensor is None:
+                    tensor = torch.from_numpy(self._arrays[name].copy()).to(device)
+                    self._tensors[key] = tensor
+        return tensor
+
+    def chord_names(self, chord_ids):
+        # Chord ids (iterable of ints) -> chord symbols
+        return [self.id_to_chord[int(chord_id)] for chord_id in chord_ids]
+
+def _load_json(meta_dir, name):
+    with open(os.path.join(meta_dir, name)) as json_file:
+        return json.load(json_file)
+
+def _inverse(symbol_to_id):
+    # Dense id -> symbol list, ids are 0..len-1
+    id_to_symbol = [None] * len(symbol_to_id)
+    for symbol, symbol_id in symbol_to_id.items():
+        id_to_symbol[symbol_id] = symbol
+    return id_to_symbol
+
+def get_chord_vocab(dataset_root="./dataset/"):
+    # Shared ChordVocab of dataset_root, loaded on first use
+    return _get_chord_vocab(os.path.abspath(os.path.join(dataset_root, "vevo_meta")))
+
+@lru_cache(maxsize=None)
+def _get_chord_vocab(meta_dir):
+    return ChordVocab(meta_dir)
@@ -0,0 +1,46 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from PIL import Image
+
+# Batched frame encoding for the video feature extractors (CLIP, MaxViT).
+# Decoded (H, W, 3) uint8 RGB frames (e.g. utilities/video_loader.py read_frames_1fps) are preprocessed
+# by num_workers threads (preprocess_frames, PIL resize and tensor conversion release the GIL), the
+# network sees batch_size frames per forward (encode_batched).
+# Outputs are (D,) float32 cpu tensors, output i belongs to frame i.
+
+def preprocess_frames(frames, transform, num_workers=0, prefetch=2):
+    # Generator: transform(PIL image) of every frame, in order. With num_workers > 0 up to
+    # num_workers * prefetch frames are preprocessed ahead in a thread pool while the caller encodes,
+    # with 0 the frames are preprocessed one by one in the calling thread.
+    def preprocess(frame):
+        return transform(Image.fromarray(frame))
+
+    if num_workers <= 0:
+        yield from map(preprocess, frames)
+        return
+    with ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="frame_preprocess") as executor:
+        pending = deque()
+        for frame in frames:
+            pending.append(executor.submit(preprocess, frame))
+            if len(pending) >= num_workers * prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def _encode(encode, images, device):
+    with torch.no_grad():
+        return encode(images.to(device, non_blocking=True)).float().cpu()
+
+def encode_batched(encode, images, device, batch_size=32):
+    # Generator: encode over an iterable of preprocessed (C, H, W) tensors, batch_size at a time,
+    # yields one (D,) output per input. For frames produced sequentially (e.g. decoded or motion differences).
+    batch = []
+    for image in images:
+        batch.append(image)
+        if len(batch) == batch_size:
+            yield from _encode(encode, torch.stack(batch), device)
+            batch = []
+    if len(batch) > 0:
+        yield from _encode(encode, torch.stack(batch), device)
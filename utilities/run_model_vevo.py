@@ -3,6 +3,7 @@ import time
 
 from .constants import *
 from utilities.device import get_device
+from utilities.chord_vocab import get_chord_vocab
 from utilities.argument_funcs import parse_train_args
 from .lr_scheduling import get_lr
 import numpy as np
@@ -13,7 +14,7 @@ import random
 
 from dataset.vevo_dataset import compute_vevo_accuracy, compute_vevo_correspondence, compute_hits_k, compute_hits_k_root_attr, compute_vevo_accuracy_root_attr, compute_vevo_correspondence_root_attr
 
-from third_party.log_maxvio import save_maxvio, reset_maxvio
+from third_party.log_maxvio import save_maxvio
 
 args = parse_train_args()[0]
 
@@ -44,6 +45,9 @@ def train_epoch(cur_epoch, model, dataloader,
         feature_motion = batch["motion"].to(get_device())
         feature_emotion = batch["emotion"].to(get_device())
 
+        # Mixup batch (MixupCollate): features are mixed, the chord labels of both samples are weighted
+        mix_lambda = float(batch["mix_lambda"]) if "mix_lambda" in batch else None
+
         if isVideo:
             # use VideoMusicTransformer
             if IS_SEPERATED:
@@ -66,6 +70,11 @@ def train_epoch(cur_epoch, model, dataloader,
 
                 loss_chord_root = train_loss_func.forward(y_root, tgt_root)
                 loss_chord_attr = train_loss_func.forward(y_attr, tgt_attr)
+                if mix_lambda is not None:
+                    tgt_root_mix = batch["tgt_root_mix"].to(get_device()).flatten()
+                    tgt_attr_mix = batch["tgt_attr_mix"].to(get_device()).flatten()
+                    loss_chord_root = mix_lambda * loss_chord_root + (1 - mix_lambda) * train_loss_func.forward(y_root, tgt_root_mix)
+                    loss_chord_attr = mix_lambda * loss_chord_attr + (1 - mix_lambda) * train_loss_func.forward(y_attr, tgt_attr_mix)
                 loss_chord = loss_chord_root + loss_chord_attr
 
                 first_14 = tgt_emotion[:, :14]
@@ -99,6 +108,9 @@ def train_epoch(cur_epoch, model, dataloader,
                 # loss_emotion = train_loss_emotion_func.forward(y, tgt_emotion)               
                 # ====
                 loss_chord = train_loss_func.forward(y.permute(0,2,1), tgt)
+                if mix_lambda is not None:
+                    tgt_mix = batch["tgt_mix"].to(get_device())
+                    loss_chord = mix_lambda * loss_chord + (1 - mix_lambda) * train_loss_func.forward(y.permute(0,2,1), tgt_mix)
                 loss_emotion = train_loss_emotion_func.forward(y.permute(0,2,1), tgt_emotion.permute(0,2,1))
                 # y = y.reshape(y.shape[0] * y.shape[1], -1)
                 # tgt = tgt.flatten()
@@ -435,8 +447,10 @@ def eval_model(model, dataloader,
                     sum_total_loss += float(total_loss)
 
             # Logging
-            save_maxvio()
-            reset_maxvio()
+            routing_stats = getattr(model, 'routing_stats', None)
+            if routing_stats is not None:
+                save_maxvio(routing_stats.maxvio())
+                routing_stats.reset()
 
         avg_loss_chord    = sum_loss_chord / n_test
         avg_loss_emotion    = sum_loss_emotion / n_test
@@ -452,16 +466,7 @@ def eval_model(model, dataloader,
         avg_acc_cor = (avg_acc + avg_cor)/ 2.0
 
     if isGenConfusionMatrix:
-        chordInvDicPath = "./dataset/vevo_meta/chord_inv.json"
-        chordRootInvDicPath = "./dataset/vevo_meta/chord_root_inv.json"
-        chordAttrInvDicPath = "./dataset/vevo_meta/chord_attr_inv.json"
-        
-        with open(chordInvDicPath) as json_file:
-            chordInvDic = json.load(json_file)
-        with open(chordRootInvDicPath) as json_file:
-            chordRootInvDic = json.load(json_file)
-        with open(chordAttrInvDicPath) as json_file:
-            chordAttrInvDic = json.load(json_file)
+        chord_vocab = get_chord_vocab()
 
         # Confusion matrix (CHORD)
         topChordList = []
@@ -479,7 +484,7 @@ def eval_model(model, dataloader,
         pred_labels = np.array(pred_labels)[mask]
 
         conf_matrix = confusion_matrix(true_labels, pred_labels, labels=topChordList)
-        label_names = [ chordInvDic[str(label_id)] for label_id in topChordList ]
+        label_names = chord_vocab.chord_names(topChordList)
         
         plt.figure(figsize=(8, 6))
         plt.imshow(conf_matrix, cmap=plt.cm.Blues)
@@ -509,7 +514,7 @@ def eval_model(model, dataloader,
         chordRootList = np.arange(1, 13)
         conf_matrix = confusion_matrix(true_root_labels, pred_root_labels, labels= chordRootList )
         
-        label_names = [ chordRootInvDic[str(label_id)] for label_id in chordRootList ]
+        label_names = [ chord_vocab.id_to_root[label_id] for label_id in chordRootList ]
         
         plt.figure(figsize=(8, 6))
         plt.imshow(conf_matrix, cmap=plt.cm.Blues)
@@ -539,7 +544,7 @@ def eval_model(model, dataloader,
         chordAttrList = np.arange(1, 14)
         conf_matrix = confusion_matrix(true_attr_labels, pred_attr_labels, labels= chordAttrList )
         
-        label_names = [ chordAttrInvDic[str(label_id)] for label_id in chordAttrList ]
+        label_names = [ chord_vocab.id_to_attr[label_id] for label_id in chordAttrList ]
         
         plt.figure(figsize=(8, 6))
         plt.imshow(conf_matrix, cmap=plt.cm.Blues)
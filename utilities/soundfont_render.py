@@ -0,0 +1,142 @@
+import ctypes
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Renders MIDI with FluidSynth soundfonts in worker processes, like `fluidsynth -ni sf2 midi -F out -r rate`
+# (midi2audio) but without the audio file, and without reloading the soundfont for every render:
+# each soundfont is assigned to one worker, which keeps a synthesizer with it loaded. Renders of different
+# soundfonts run concurrently. Output is int16 PCM, (n_samples, 2) interleaved stereo.
+
+RENDER_BLOCK = 4096 # Samples per synthesis call, the render ends at most one block after the MIDI
+
+# Worker process state: soundfont path -> fluidsynth.Synth with the soundfont loaded
+_synths = {}
+_player_add_mem = None
+
+def _get_synth(sound_font, sample_rate, gain):
+    global _player_add_mem
+    import fluidsynth
+
+    key = (sound_font, sample_rate, gain)
+    synth = _synths.get(key)
+    if synth is None:
+        # Settings of the fluidsynth CLI file rendering: player driven by the rendered samples
+        synth = fluidsynth.Synth(gain=gain, samplerate=sample_rate,
+                                 **{"player.timing-source": "sample", "synth.lock-memory": 0})
+        if synth.sfload(sound_font) == -1:
+            raise RuntimeError(f"Could not load soundfont {sound_font}")
+        _synths[key] = synth
+    if _player_add_mem is None:
+        # Not wrapped by pyfluidsynth, the player copies the data
+        _player_add_mem = fluidsynth.cfunc("fluid_player_add_mem", ctypes.c_int, ("player", ctypes.c_void_p, 1),
+                                           ("buffer", ctypes.c_char_p, 1), ("len", ctypes.c_size_t, 1))
+    return synth
+
+def _render(sound_font, midi_bytes, sample_rate, gain):
+    # Returns (pcm, render seconds, soundfont load seconds)
+    import fluidsynth
+
+    start = time.perf_counter()
+    loaded = (sound_font, sample_rate, gain) in _synths
+    synth = _get_synth(sound_font, sample_rate, gain)
+    load_time = 0.0 if loaded else time.perf_counter() - start
+
+    start = time.perf_counter()
+    # Stops the notes and clears the reverb / chorus of the previous render
+    synth.system_reset()
+    player = fluidsynth.new_fluid_player(synth.synth)
+    try:
+        if _player_add_mem(player, midi_bytes, len(midi_bytes)) == fluidsynth.FLUID_FAILED:
+            raise RuntimeError("FluidSynth could not read the MIDI data")
+        fluidsynth.fluid_player_play(player)
+        blocks = []
+        while fluidsynth.fluid_player_get_status(player) == fluidsynth.FLUID_PLAYER_PLAYING:
+            blocks.append(synth.get_samples(RENDER_BLOCK))
+    finally:
+        fluidsynth.delete_fluid_player(player)
+    pcm = np.concatenate(blocks).reshape(-1, 2) if blocks else np.zeros((0, 2), dtype=np.int16)
+    return pcm, time.perf_counter() - start, load_time
+
+class SoundfontRenderPool:
+    """
+    FluidSynth rendering in num_workers spawned processes. A soundfont is assigned to a worker on first use
+    (least assigned worker) and always rendered there, so it is loaded once per pool.
+        render(midi_bytes, sound_font)    Future of the (n_samples, 2) int16 PCM
+        render_many({name: (midi_bytes, sound_font)}, times=None)
+                                          {name: PCM}, all renders submitted at once, times gets the
+                                          render seconds per name
+    Render time is accumulated per name (e.g. instrument), soundfont load time per soundfont, see print_stats.
+    """
+    def __init__(self, num_workers=4, sample_rate=44100, gain=0.2):
+        self.sample_rate = sample_rate
+        self.gain = gain
+
+        context = multiprocessing.get_context("spawn")
+        self._workers = [ProcessPoolExecutor(max_workers=1, mp_context=context) for _ in range(max(1, num_workers))]
+        self._assigned = {}
+        self._lock = threading.Lock()
+
+        self.load_time = {}
+        self.render_time = {}
+        self.num_renders = {}
+
+    def _worker(self, sound_font):
+        with self._lock:
+            index = self._assigned.get(sound_font)
+            if index is None:
+                counts = [0] * len(self._workers)
+                for assigned in self._assigned.values():
+                    counts[assigned] += 1
+                index = counts.index(min(counts))
+                self._assigned[sound_font] = index
+        return self._workers[index]
+
+    def render(self, midi_bytes, sound_font, name=None):
+        future = self._worker(sound_font).submit(_render, sound_font, midi_bytes, self.sample_rate, self.gain)
+        return _PCMFuture(self, future, sound_font, name if name is not None else sound_font)
+
+    def render_many(self, jobs, times=None):
+        futures = {name: self.render(midi_bytes, sound_font, name) for name, (midi_bytes, sound_font) in jobs.items()}
+        pcms = {name: future.result() for name, future in futures.items()}
+        if times is not None:
+            times.update({name: future.render_time for name, future in futures.items()})
+        return pcms
+
+    def _record(self, sound_font, name, render_time, load_time):
+        with self._lock:
+            if load_time > 0:
+                self.load_time[sound_font] = load_time
+            self.render_time[name] = self.render_time.get(name, 0.0) + render_time
+            self.num_renders[name] = self.num_renders.get(name, 0) + 1
+
+    def print_stats(self):
+        print("%40s %8s %16s %16s" % ("render", "renders", "render time (s)", "per render (s)"))
+        for name, render_time in self.render_time.items():
+            num_renders = self.num_renders[name]
+            print("%40s %8d %16.2f %16.3f" % (name, num_renders, render_time, render_time / num_renders))
+        for sound_font, load_time in self.load_time.items():
+            print("loaded %s in %.2fs" % (sound_font, load_time))
+
+    def shutdown(self):
+        for worker in self._workers:
+            worker.shutdown()
+
+class _PCMFuture:
+    # Future of one render, records its times in the pool when the result is taken
+    def __init__(self, pool, future, sound_font, name):
+        self._pool = pool
+        self._future = future
+        self._sound_font = sound_font
+        self._name = name
+        self._pcm = None
+        self.render_time = None
+
+    def result(self):
+        if self._pcm is None:
+            self._pcm, self.render_time, load_time = self._future.result()
+            self._pool._record(self._sound_font, self._name, self.render_time, load_time)
+        return self._pcm
@@ -4,6 +4,80 @@ import pandas as pd
 import os
 import numpy as np
 import ffmpeg
+import subprocess
+import cv2
+
+# First frame of every second, the frame selection of script/video2jpg.py
+SELECT_1FPS = "select=bitor(gte(t-prev_selected_t\\,1)\\,isnan(prev_selected_t))"
+
+def get_rotation(video_stream):
+    # Rotation in degrees of the display matrix (side data) or the rotate tag of a probed video stream
+    for side_data in video_stream.get('side_data_list', []):
+        if 'rotation' in side_data:
+            return int(float(side_data['rotation']))
+    return int(float(video_stream.get('tags', {}).get('rotate', 0)))
+
+def get_video_dim(video_path):
+    # Size of the decoded frames: ffmpeg autorotates, so width and height of the coded stream are
+    # swapped for videos rotated by +-90 degrees (e.g. portrait phone videos)
+    probe = ffmpeg.probe(str(video_path))
+    video_stream = next((stream for stream in probe['streams']
+                         if stream['codec_type'] == 'video'), None)
+    width = int(video_stream['width'])
+    height = int(video_stream['height'])
+    if get_rotation(video_stream) % 180 != 0:
+        height, width = width, height
+    return height, width
+
+def read_frames_1fps(video_path):
+    # Generator: the 1-fps frames of video_path as (H, W, 3) uint8 RGB arrays, decoded by one ffmpeg
+    # process into a rawvideo pipe, without image files. Frame i is the one saved as frame i + 1 by
+    # script/video2jpg.py (without the JPEG compression).
+    height, width = get_video_dim(video_path)
+    frame_size = height * width * 3
+    cmd = ["ffmpeg", "-loglevel", "error", "-i", str(video_path), "-vf", SELECT_1FPS, "-vsync", "0",
+           "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:"]
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    try:
+        while True:
+            buffer = process.stdout.read(frame_size)
+            if len(buffer) < frame_size:
+                break
+            yield np.frombuffer(buffer, np.uint8).reshape(height, width, 3)
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+
+def read_motion_diffs(video_path):
+    # Generator: the RGB differences (H, W, 3) uint8 of the option 1 motion feature, one per second boundary:
+    # the first frame at or after the boundary minus the frame before it (cv2.absdiff of the BGR frames).
+    # Every frame is grabbed (inter-coded video has to be decoded in order), but only the frames within two
+    # frame intervals of the next boundary are retrieved (converted and copied), about 3 frames per second.
+    cap = cv2.VideoCapture(str(video_path))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    margin = 2.0 / fps if fps > 0 else float("inf")
+
+    idx = 0
+    prev_frame = None
+    prev_time = 0
+    try:
+        while cap.grab():
+            curr_time = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+            if idx > 0 and curr_time - prev_time >= 1:
+                # prev_frame is the frame before this one unless the frame rate varies by more than the margin
+                _, frame = cap.retrieve()
+                diff = cv2.absdiff(frame, prev_frame)
+                yield cv2.cvtColor(diff, cv2.COLOR_BGR2RGB)
+                prev_time = int(curr_time)
+                prev_frame = frame
+            elif idx == 0 or curr_time + margin >= prev_time + 1:
+                # Candidate for the frame before the next boundary
+                _, prev_frame = cap.retrieve()
+            idx += 1
+    finally:
+        cap.release()
 
 class VideoLoader(Dataset):
     def __init__(
@@ -24,12 +98,7 @@ class VideoLoader(Dataset):
         return len(self.fileList)
 
     def _get_video_dim(self, video_path):
-        probe = ffmpeg.probe(video_path)
-        video_stream = next((stream for stream in probe['streams']
-                             if stream['codec_type'] == 'video'), None)
-        width = int(video_stream['width'])
-        height = int(video_stream['height'])
-        return height, width
+        return get_video_dim(video_path)
 
     def _get_output_dim(self, h, w):
         if isinstance(self.size, tuple) and len(self.size) == 2:
@@ -0,0 +1,71 @@
+import os
+import subprocess
+import ffmpeg
+import numpy as np
+
+from .audio_mix import write_audio
+
+# Output video of Video2music.render: the input video with the generated audio, the audio cut to the
+# shorter of both.
+#   copy      ffmpeg, the video stream is copied as is (no decoding), only the audio is encoded (AAC)
+#   moviepy   the former path, decodes and re-encodes every frame (libx264), through a temporary audio file
+# mux_video uses copy and falls back to moviepy when ffmpeg fails (e.g. a video codec mp4 cannot hold).
+# The audio is an audio file or (n_samples, 2) int16 PCM, which copy pipes to ffmpeg and moviepy writes
+# to a FLAC file next to the output first.
+
+MUX_MODES = ("copy", "moviepy")
+
+def media_duration(path):
+    # Container duration in seconds
+    return float(ffmpeg.probe(str(path))["format"]["duration"])
+
+def mux_copy(video_path, audio, output_path, duration, sample_rate=44100):
+    if isinstance(audio, np.ndarray):
+        audio_input = ["-f", "s16le", "-ar", str(sample_rate), "-ac", "2", "-i", "pipe:"]
+        pcm = memoryview(np.ascontiguousarray(audio, dtype=np.int16)).cast("B")
+    else:
+        audio_input = ["-i", str(audio)]
+        pcm = None
+    # -t before the audio input: only the audio is cut
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-i", str(video_path), "-t", repr(float(duration)), *audio_input,
+           "-map", "0:v:0", "-map", "1:a:0", "-c:v", "copy", "-c:a", "aac", "-movflags", "+faststart", str(output_path)]
+    result = subprocess.run(cmd, input=pcm, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg could not mux {video_path}: {result.stderr.decode(errors='replace').strip()}")
+
+def mux_moviepy(video_path, audio, output_path, duration, sample_rate=44100):
+    import moviepy.editor as mp
+
+    audio_path = audio
+    if isinstance(audio, np.ndarray):
+        audio_path = os.path.join(os.path.dirname(str(output_path)), "audio.flac")
+        write_audio(audio_path, audio, sample_rate)
+    audio_mp = mp.AudioFileClip(str(audio_path)).subclip(0, duration)
+    video_mp = mp.VideoFileClip(str(video_path))
+    final = video_mp.set_audio(audio_mp)
+    # temp audio next to the output, concurrent renders must not share it
+    final.write_videofile(str(output_path),
+        codec='libx264',
+        audio_codec='aac',
+        temp_audiofile=os.path.join(os.path.dirname(str(output_path)), 'temp-audio.m4a'),
+        remove_temp=True
+    )
+
+def mux_video(video_path, audio, output_path, sample_rate=44100, mode="copy"):
+    # Returns the mode used. sample_rate is the rate of PCM audio
+    video_duration = media_duration(video_path)
+    if isinstance(audio, np.ndarray):
+        audio_duration = len(audio) / sample_rate
+    else:
+        audio_duration = media_duration(audio)
+    assert video_duration > 0 and audio_duration > 0
+    duration = min(video_duration, audio_duration)
+
+    if mode == "copy":
+        try:
+            mux_copy(video_path, audio, output_path, duration, sample_rate)
+            return "copy"
+        except RuntimeError as e:
+            print(f"{e}, falling back to moviepy")
+    mux_moviepy(video_path, audio, output_path, duration, sample_rate)
+    return "moviepy"
@@ -0,0 +1,73 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Per-request working directories of Video2music.generate, so concurrent requests never share files.
+# A workspace is a fresh temporary directory holding only what has to be a file (the output video);
+# it is removed in the background once it is older than ttl seconds (the caller has to pick up the
+# output before) or on release(). With export_root, every request also gets export_root/<request id>
+# for the intermediate files (features, MIDI, audio), which are kept.
+
+class Workspace:
+    def __init__(self, request_id, path, export_dir=None):
+        self.request_id = request_id
+        self.path = path
+        self.export_dir = export_dir
+        self.created = time.monotonic()
+
+    def export_path(self, *names):
+        # Path of an intermediate file under export_dir (parents created), None if exports are off
+        if self.export_dir is None:
+            return None
+        path = self.export_dir.joinpath(*names)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+class WorkspaceManager:
+    def __init__(self, root=None, export_root=None, ttl=3600.0):
+        self.root = root
+        self.export_root = Path(export_root) if export_root is not None else None
+        self.ttl = ttl
+
+        self._workspaces = {}
+        self._lock = threading.Lock()
+        self._cleaner = ThreadPoolExecutor(max_workers=1, thread_name_prefix="workspace_cleanup")
+
+    def create(self):
+        # New workspace, expired ones are removed in the background
+        self._remove_expired()
+        request_id = uuid.uuid4().hex[:12]
+        if self.root is not None:
+            os.makedirs(self.root, exist_ok=True)
+        path = Path(tempfile.mkdtemp(prefix=f"video2music_{request_id}_", dir=self.root))
+        export_dir = self.export_root / request_id if self.export_root is not None else None
+        workspace = Workspace(request_id, path, export_dir)
+        with self._lock:
+            self._workspaces[request_id] = workspace
+        return workspace
+
+    def release(self, workspace):
+        # Removes the workspace in the background
+        with self._lock:
+            self._workspaces.pop(workspace.request_id, None)
+        self._cleaner.submit(shutil.rmtree, str(workspace.path), ignore_errors=True)
+
+    def _remove_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [workspace for workspace in self._workspaces.values() if now - workspace.created > self.ttl]
+        for workspace in expired:
+            self.release(workspace)
+
+    def close(self):
+        # Removes every workspace, waits for the cleanup
+        with self._lock:
+            workspaces = list(self._workspaces.values())
+        for workspace in workspaces:
+            self.release(workspace)
+        self._cleaner.shutdown(wait=True)
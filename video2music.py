@@ -21,14 +21,26 @@ from utilities.chord_to_midi import *
 
 from model.video_music_transformer import *
 from model.video_regression import VideoRegression
+from model.custom_transformer import set_attention_backend
+from utilities.chord_vocab import get_chord_vocab
+from utilities.chord_events import chord_pitch_table, note_events, split_tracks, add_note_events
+from utilities.soundfont_render import SoundfontRenderPool
+from utilities.audio_mix import pan_gains, mix_tracks, write_audio
+from utilities.video_mux import mux_video
+from utilities.workspace import WorkspaceManager
+from utilities.frame_encoding import preprocess_frames, encode_batched
+from utilities.video_loader import read_frames_1fps, read_motion_diffs
 
 import json
-from midi2audio import FluidSynth
 import moviepy.editor as mp
 from moviepy.video.io.ffmpeg_tools import ffmpeg_extract_subclip
 import random
 from moviepy.editor import *
 import time
+import tempfile
+import io
+import threading
+from concurrent.futures import Future
 
 from tqdm import tqdm
 from huggingface_hub import snapshot_download
@@ -36,7 +48,6 @@ from huggingface_hub import snapshot_download
 from gradio import Markdown
 
 from pytube import YouTube
-from pydub import AudioSegment
 import pandas as pd
 
 from utilities.argument_generate_funcs import parse_generate_args, print_generate_args
@@ -106,6 +117,8 @@ right_panning_val = 96
 
 low_velocity_instrument_list = [14]
 
+EMOTION_LABELS = ["exciting", "fearful", "tense", "sad", "relaxing", "neutral"]
+
 max_conseq_N = 0
 max_conseq_chord = 2
 base_tempo = 120
@@ -121,94 +134,46 @@ max_loudness = 50  # Maximum loudness level in the input range
 min_velocity = 49  # Minimum velocity value in the output range
 max_velocity = 112  # Maximum velocity value in the output range
 
-def find_longest_flac_file(flac_files):
-    if not flac_files:
-        return None
-
-    max_duration = 0
-    longest_file = None
-
-    for file_path in flac_files:
-        try:
-            audio = AudioSegment.from_file(file_path)
-            duration = len(audio)
-            if duration > max_duration:
-                max_duration = duration
-                longest_file = file_path
-        except Exception as e:
-            print(f"Error loading file {file_path}: {e}")
-
-    return longest_file
-
-
-def split_video_into_frames(video, frame_dir):
-    output_path = os.path.join(frame_dir, f"%03d.jpg")
-    cmd = f"ffmpeg -i {video} -vf \"select=bitor(gte(t-prev_selected_t\,1)\,isnan(prev_selected_t))\" -vsync 0 -qmin 1 -q:v 1 {output_path}"        
-    subprocess.call(cmd, shell=True)
-
-def gen_semantic_feature(frame_dir, semantic_dir):
-    device = "cuda:0" if torch.cuda.is_available() else "cpu"
-    model, preprocess = clip.load("ViT-L/14@336px", device=device)
-    file_names = os.listdir(frame_dir)
-    sorted_file_names = sorted(file_names)
-
-    output_path = semantic_dir / "semantic.npy"
-    if torch.cuda.is_available():
-        features = torch.FloatTensor(len(sorted_file_names), 768).fill_(0)
-        features = features.to(device)
-        
-        for idx, file_name in enumerate(sorted_file_names):
-            fpath = frame_dir / file_name
-            image = preprocess(Image.open(fpath)).unsqueeze(0).to(device)          
-            with torch.no_grad():
-                image_features = model.encode_image(image)
-            features[idx] = image_features[0]
-        features = features.cpu().numpy()
-        np.save(output_path, features)
+def midi_to_bytes(midifile):
+    # MIDIFile -> contents of its .mid file
+    buffer = io.BytesIO()
+    midifile.writeFile(buffer)
+    return buffer.getvalue()
+
+def instrument_panning(inst_id):
+    # MIDI pan value (0-127) of an instrument track
+    if inst_id in left_panning_instrument_list:
+        return left_panning_val
+    elif inst_id in center_panning_instrument_list:
+        return center_panning_val
     else:
-        features = torch.FloatTensor(len(sorted_file_names), 768).fill_(0)
-        for idx, file_name in enumerate(sorted_file_names):
-            fpath = frame_dir / file_name
-            image = preprocess(Image.open(fpath)).unsqueeze(0).to(device)          
-            with torch.no_grad():
-                image_features = model.encode_image(image)
-            features[idx] = image_features[0]
-        features = features.numpy()
-        np.save(output_path, features)
-
-def gen_emotion_feature(frame_dir, emotion_dir):
-    device = "cuda:0" if torch.cuda.is_available() else "cpu"
-    model, preprocess = clip.load("ViT-L/14@336px", device=device)
-    text = clip.tokenize(["exciting", "fearful", "tense", "sad", "relaxing", "neutral"]).to(device)
-
-    file_names = os.listdir(frame_dir)
-    sorted_file_names = sorted(file_names)
-    output_path = emotion_dir / "emotion.lab" 
-
-    emolist = []
-    for file_name in sorted_file_names:
-        fpath = frame_dir / file_name
-        image = preprocess(Image.open(fpath)).unsqueeze(0).to(device)                
-        with torch.no_grad():  
-            logits_per_image, logits_per_text = model(image, text)
-            probs = logits_per_image.softmax(dim=-1).cpu().numpy()
-
-        fp1 = format(probs[0][0], ".4f")
-        fp2 = format(probs[0][1], ".4f")
-        fp3 = format(probs[0][2], ".4f")
-        fp4 = format(probs[0][3], ".4f")
-        fp5 = format(probs[0][4], ".4f")
-        fp6 = format(probs[0][5], ".4f")
-        
-        emo_val = str(fp1) +" "+ str(fp2) +" "+ str(fp3) +" "+ str(fp4) +" "+ str(fp5) + " " + str(fp6)
-        emolist.append(emo_val)
-    
-    with open(output_path ,'w' ,encoding = 'utf-8') as f:
-        f.write("time exciting_prob fearful_prob tense_prob sad_prob relaxing_prob neutral_prob\n")
-        for i in range(0, len(emolist) ):
-            f.write(str(i) + " "+emolist[i]+"\n")
-
-def gen_scene_feature(video, scene_dir, frame_dir):
+        return right_panning_val
+
+def gen_semantic_emotion_feature(frames, extractors):
+    # One CLIP image encoding per 1-fps frame (read_frames_1fps) gives both the semantic feature and the
+    # emotion probabilities, the logits of model(image, text) against the cached text features of EMOTION_LABELS.
+    # Frames are preprocessed by extractors.num_workers threads and encoded extractors.batch_size at a time
+    # while they are decoded.
+    # Returns the (n_frames, 768) semantic features and the (n_frames, 6) emotion probabilities, the latter
+    # rounded to 4 decimals like the emotion.lab files.
+    model, preprocess = extractors.get("clip")
+    text_features = extractors.emotion_text_features().float().cpu()
+    start = time.perf_counter()
+
+    images = preprocess_frames(frames, preprocess, num_workers=extractors.num_workers)
+    features = list(encode_batched(model.encode_image, images, extractors.device, batch_size=extractors.batch_size))
+    features = torch.stack(features, dim=0)
+
+    features_norm = features / features.norm(dim=-1, keepdim=True)
+    logits_per_image = model.logit_scale.exp().float().cpu() * features_norm @ text_features.t()
+    probs = logits_per_image.softmax(dim=-1).numpy()
+
+    probs = np.array([[float(format(prob, ".4f")) for prob in row] for row in probs]).reshape(-1, 6)
+    extractors.add_inference_time("clip", start)
+    return features.numpy(), probs
+
+def gen_scene_feature(video, n_frames):
+    # Scene id per second (AdaptiveDetector), all 0 for n_frames seconds without a cut
     video_stream = open_video(str(video))
     
     scene_manager = SceneManager()
@@ -224,47 +189,15 @@ def gen_scene_feature(video, scene_dir, frame_dir):
             scenedict[s] = str(idx)
             sec += 1
     
-    fpathname = scene_dir / "scene.lab"
-
     if len(scene_list) == 0:
-        fsize = len( os.listdir(frame_dir) )
-        with open(fpathname,'w',encoding = 'utf-8') as f:
-            for i in range(0, fsize):
-                f.write(str(i) + " "+"0"+"\n")
-    else:
-        with open(fpathname,'w',encoding = 'utf-8') as f:
-            for i in range(0, len(scenedict)):
-                f.write(str(i) + " "+scenedict[i]+"\n")
+        return [0] * n_frames
+    return [int(scenedict[i]) for i in range(0, len(scenedict))]
 
-def gen_scene_offset_feature(scene_dir, scene_offset_dir):
-    src = scene_dir / "scene.lab"
-    tgt = scene_offset_dir / "scene_offset.lab"
-    
-    id_list = []
-    with open(src, encoding = 'utf-8') as f:
-        for line in f:
-            line = line.strip()
-            line_arr = line.split(" ")
-            if len(line_arr) == 2 :
-                time = int(line_arr[0])
-                scene_id = int(line_arr[1])
-                id_list.append(scene_id)
-
-    offset_list = []
-    current_id = id_list[0]
-    offset = 0
-    for i in range(len(id_list)):
-        if id_list[i] != current_id:
-            current_id = id_list[i]
-            offset = 0
-        offset_list.append(offset)
-        offset += 1
-    
-    with open(tgt,'w',encoding = 'utf-8') as f:
-        for i in range(0, len(offset_list)):
-            f.write(str(i) + " " + str(offset_list[i]) + "\n")
+def gen_scene_offset_feature(scene_ids):
+    # Seconds since the scene started, per second
+    return convert_format_id_to_offset(scene_ids)
 
-def gen_motion_feature(video, motion_dir):
+def gen_motion_feature(video, extractors):
     # Motion origin
     # cap = cv2.VideoCapture(str(video))
     # prev_frame = None
@@ -295,94 +228,49 @@ def gen_motion_feature(video, motion_dir):
     #         f.write(str(i) + " "+motiondict[i]+"\n")
 
     # Motion option 1
-    model = models.maxvit_t(weights=models.MaxVit_T_Weights.DEFAULT)   
-    model.classifier = torch.nn.Sequential(
-        torch.nn.AdaptiveAvgPool2d(1),
-        torch.nn.Flatten()
-    )
-    model = model.to(get_device())
-    model.eval()
-    transform = models.MaxVit_T_Weights.IMAGENET1K_V1.transforms()
-
-    cap = cv2.VideoCapture(str(video))
-    prev_frame = None
-    prev_time = 0
+    model, transform = extractors.get("maxvit")
+    start = time.perf_counter()
 
+    # Only the frames around each second boundary are retrieved, the differences are preprocessed by
+    # extractors.num_workers threads and encoded extractors.batch_size at a time while the video is decoded
+    images = preprocess_frames(read_motion_diffs(video), transform, num_workers=extractors.num_workers)
     features = [np.zeros(512)]
-    while cap.isOpened():
-        # Read the frame and get its time stamp
-        ret, frame = cap.read()
-        if not ret:
-            break
-        curr_time = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
-        
-        # Calculate the RGB difference between consecutive frames per second
-        if prev_frame is not None and curr_time - prev_time >= 1:
-            diff = cv2.absdiff(frame, prev_frame)
-            diff_rgb = cv2.cvtColor(diff, cv2.COLOR_BGR2RGB)
-
-            diff_image = transform(Image.fromarray(diff_rgb)).unsqueeze(0).to(get_device())
-            with torch.no_grad():
-                motion_features = model(diff_image).squeeze()
-
-            motion_features = motion_features.cpu().numpy()
-            features.append(motion_features)
-
-            prev_time = int(curr_time)
-
-        # Update the variables
-        prev_frame = frame.copy()
-    # Release the video file and close all windows
-    cap.release()
-    cv2.destroyAllWindows()
+    for motion_features in encode_batched(model, images, extractors.device, batch_size=extractors.batch_size):
+        features.append(motion_features.numpy())
 
     features = np.stack(features, axis=0)
-    fpathname = motion_dir / "motion.npy"
-    np.save(fpathname, features)
+    extractors.add_inference_time("maxvit", start)
+    return features
 
-def get_scene_offset_feature(scene_offset_dir, max_seq_chord=300, max_seq_video=300):
+def save_features(workspace, semantic, emotion_probs, scene_ids, scene_offsets, motion):
+    # Exports the video features of prepare in the layout of the dataset (vevo_semantic, vevo_emotion, ...)
+    np.save(workspace.export_path("vevo_semantic", "semantic.npy"), semantic)
+    with open(workspace.export_path("vevo_emotion", "emotion.lab") ,'w' ,encoding = 'utf-8') as f:
+        f.write("time exciting_prob fearful_prob tense_prob sad_prob relaxing_prob neutral_prob\n")
+        for i in range(0, len(emotion_probs) ):
+            f.write(str(i) + " " + " ".join(format(prob, ".4f") for prob in emotion_probs[i]) + "\n")
+    with open(workspace.export_path("vevo_scene", "scene.lab"),'w',encoding = 'utf-8') as f:
+        for i in range(0, len(scene_ids)):
+            f.write(str(i) + " "+str(scene_ids[i])+"\n")
+    with open(workspace.export_path("vevo_scene_offset", "scene_offset.lab"),'w',encoding = 'utf-8') as f:
+        for i in range(0, len(scene_offsets)):
+            f.write(str(i) + " " + str(scene_offsets[i]) + "\n")
+    np.save(workspace.export_path("vevo_motion", "motion.npy"), motion)
+
+def get_scene_offset_feature(scene_offsets, max_seq_chord=300, max_seq_video=300):
     feature_scene_offset = np.empty(max_seq_video)
     feature_scene_offset.fill(SCENE_OFFSET_PAD)
-    fpath_scene_offset = scene_offset_dir / "scene_offset.lab" 
-
-    with open(fpath_scene_offset, encoding = 'utf-8') as f:
-        for line in f:
-            line = line.strip()
-            line_arr = line.split(" ")
-            time = line_arr[0]
-            time = int(time)
-            if time >= max_seq_chord:
-                break
-            sceneID = line_arr[1]
-            feature_scene_offset[time] = int(sceneID)+1
+    n = min(len(scene_offsets), max_seq_chord)
+    feature_scene_offset[:n] = np.asarray(scene_offsets[:n]) + 1
 
     feature_scene_offset = torch.from_numpy(feature_scene_offset)
     feature_scene_offset = feature_scene_offset.to(torch.float32)
 
     return feature_scene_offset
 
-def get_motion_feature(motion_dir, max_seq_chord=300, max_seq_video=300):
-    # fpath_motion = motion_dir / "motion.lab" 
-    # feature_motion = np.empty(max_seq_video)
-    # feature_motion.fill(MOTION_PAD)
-    # with open(fpath_motion, encoding = 'utf-8') as f:
-    #     for line in f:
-    #         line = line.strip()
-    #         line_arr = line.split(" ")
-    #         time = line_arr[0]
-    #         time = int(time)
-    #         if time >= max_seq_chord:
-    #             break
-    #         motion = line_arr[1]
-    #         feature_motion[time] = float(motion)
-
-    # feature_motion = torch.from_numpy(feature_motion)
-    # feature_motion = feature_motion.to(torch.float32)
-
+def get_motion_feature(loaded_motion, max_seq_chord=300, max_seq_video=300):
     # Motion option 1
-    fpath_motion = motion_dir / "motion.npy" 
     feature_motion = np.zeros((max_seq_video, 512))
-    loaded_motion = np.load(fpath_motion)
     if loaded_motion.shape[0] > max_seq_chord:
         feature_motion = loaded_motion[:max_seq_chord, :]
     else:
@@ -392,35 +280,17 @@ def get_motion_feature(motion_dir, max_seq_chord=300, max_seq_video=300):
     feature_motion = feature_motion.to(torch.float32)
     return feature_motion
 
-def get_emotion_feature(emotion_dir, max_seq_chord=300, max_seq_video=300):
-    fpath_emotion = emotion_dir / "emotion.lab" 
+def get_emotion_feature(emotion_probs, max_seq_chord=300, max_seq_video=300):
     feature_emotion = np.empty((max_seq_video, 6))
     feature_emotion.fill(EMOTION_PAD)
-
-    with open(fpath_emotion, encoding = 'utf-8') as f:
-        for line in f:
-            line = line.strip()
-            line_arr = line.split(" ")
-            if line_arr[0] == "time":
-                continue
-            time = line_arr[0]
-            time = int(time)
-            if time >= max_seq_chord:
-                break
-            emo1, emo2, emo3, emo4, emo5, emo6 = \
-                line_arr[1],line_arr[2],line_arr[3],line_arr[4],line_arr[5],line_arr[6]                    
-            emoList = [ float(emo1), float(emo2), float(emo3), float(emo4), float(emo5), float(emo6) ]
-            emoList = np.array(emoList)
-            feature_emotion[time] = emoList
+    n = min(len(emotion_probs), max_seq_chord)
+    feature_emotion[:n] = emotion_probs[:n]
 
     feature_emotion = torch.from_numpy(feature_emotion)
     feature_emotion = feature_emotion.to(torch.float32)
     return feature_emotion
 
-def get_semantic_feature(semantic_dir, max_seq_chord=300, max_seq_video=300):
-    fpath_semantic = semantic_dir / "semantic.npy" 
-    
-    video_feature = np.load(fpath_semantic)
+def get_semantic_feature(video_feature, max_seq_chord=300, max_seq_video=300):
     dim_vf = video_feature.shape[1]
 
     video_feature_tensor = torch.from_numpy( video_feature )
@@ -451,6 +321,18 @@ def convert_format_id_to_offset(id_list):
         offset += 1
     return offset_list
 
+def pad_and_stack(features, pad_value):
+    # (1, seq_len, ...) features of several videos -> (batch, max_seq_len, ...), padded at the end
+    max_len = max(feature.shape[1] for feature in features)
+    padded = []
+    for feature in features:
+        if feature.shape[1] < max_len:
+            pad = torch.full((feature.shape[0], max_len - feature.shape[1]) + tuple(feature.shape[2:]), pad_value,
+                             dtype=feature.dtype, device=feature.device)
+            feature = torch.cat([feature, pad], dim=1)
+        padded.append(feature)
+    return torch.cat(padded, dim=0)
+
 # By ChatGPT
 def copy_track(multi_track_midi: MIDIFile, single_track_midi: MIDIFile, track_index: int = 0, tempo: int = base_tempo):
     """
@@ -473,116 +355,112 @@ def copy_track(multi_track_midi: MIDIFile, single_track_midi: MIDIFile, track_in
     #     elif (event.evtname == "NoteOff"):
     #         single_track_midi.addNote(0, event.channel, event.pitch, event.tick / 960, event.duration, event.volume) 
 
-def addChord(midifile, chord, chord_offset, density_val, trans_val, time, duration, 
-             velocity, emotion_index, arpeggio_chord=False):
-    if emotion_index in (1, 2):   # Fearful, Tense
-        trans_val += -2
-    elif emotion_index in (3,):    # Sad
-        trans_val += -1
-    elif emotion_index in (0, 4): # Exciting, Relaxing
-        trans_val += 1
-    else:                         # Neutral
-        trans_val += 0
-    trans_val = 0  # FLAG
-    
-    # Inner Chord Notes
-    first_velo = 1.1
-    second_velo = 0.95
-    third_velo = 0.98
-    fourth_velo = 1.0
-    fifth_velo = 0.95
-    diminish_velo = 0.6 # only for arpeggio_chord=False
-
-    if arpeggio_chord:
-        if density_val == 0:
-            if len(chord) >= 4:
-                if chord_offset % 2 == 0:
-                    midifile.addNote(0, 0, chord[0]+trans_val, time + 0, duration,  int(velocity*first_velo))
-                    midifile.addNote(0, 0, chord[1]+trans_val, time + 1, duration,  int(velocity*second_velo))
-                else:
-                    midifile.addNote(0, 0, chord[2]+trans_val, time + 0, duration,  int(velocity*third_velo))
-                    midifile.addNote(0, 0, chord[3]+trans_val, time + 1, duration,  int(velocity*fourth_velo))
-                
-                if len(chord) == 5:
-                    midifile.addNote(0, 0, chord[4]+trans_val, time + 2, duration,  int(velocity*fifth_velo))
-        elif density_val == 1:
-            if len(chord) >= 4:
-                if chord_offset % 2 == 0:
-                    midifile.addNote(0, 0, chord[0]+trans_val, time + 0, duration,  int(velocity*first_velo))
-                    midifile.addNote(0, 0, chord[1]+trans_val, time + 0.5, duration,  int(velocity*second_velo))
-                    midifile.addNote(0, 0, chord[2]+trans_val, time + 1, duration,  int(velocity*third_velo))
-                else:
-                    midifile.addNote(0, 0, chord[3]+trans_val, time + 0, duration,  int(velocity*fourth_velo))
-                    midifile.addNote(0, 0, chord[1]+trans_val, time + 0.5, duration,  int(velocity*second_velo))
-                    midifile.addNote(0, 0, chord[2]+trans_val, time + 1, duration,  int(velocity*third_velo))
-                
-                if len(chord) == 5:
-                    midifile.addNote(0, 0, chord[4]+trans_val, time + 1.5, duration,  int(velocity*fifth_velo))
-        elif density_val == 2:
-            if len(chord) >= 4:
-                if chord_offset % 2 == 0:
-                    midifile.addNote(0, 0, chord[0]+trans_val, time + 0, duration,  int(velocity*first_velo))
-                    midifile.addNote(0, 0, chord[1]+trans_val, time + 0.5, duration,  int(velocity*second_velo))
-                    midifile.addNote(0, 0, chord[2]+trans_val, time + 1, duration,  int(velocity*third_velo))
-                    midifile.addNote(0, 0, chord[3]+trans_val, time + 1.5, duration,  int(velocity*fourth_velo))
-                else:
-                    midifile.addNote(0, 0, chord[2]+trans_val, time + 0, duration,  int(velocity*third_velo))
-                    midifile.addNote(0, 0, chord[1]+trans_val, time + 0.5, duration,  int(velocity*second_velo))
-                    midifile.addNote(0, 0, chord[2]+trans_val, time + 1, duration,  int(velocity*third_velo))
-                    midifile.addNote(0, 0, chord[3]+trans_val, time + 1.5, duration,  int(velocity*fourth_velo))
-                
-                if len(chord) == 5:
-                    midifile.addNote(0, 0, chord[4]+trans_val, time + 2, duration,  int(velocity*fifth_velo))
-        elif density_val == 3:
-            if len(chord) >= 4:
-                if chord_offset % 2 == 0:
-                    midifile.addNote(0, 0, chord[0]+trans_val, time + 0, duration,  int(velocity*first_velo))
-                    midifile.addNote(0, 0, chord[1]+trans_val, time + 0.25, duration,  int(velocity*second_velo))
-                    midifile.addNote(0, 0, chord[2]+trans_val, time + 0.5, duration,  int(velocity*third_velo))
-                    midifile.addNote(0, 0, chord[1]+trans_val, time + 0.75, duration,  int(velocity*second_velo))
-                    midifile.addNote(0, 0, chord[3]+trans_val, time + 1, duration,  int(velocity*fourth_velo))
-                    midifile.addNote(0, 0, chord[2]+trans_val, time + 1.5, duration,  int(velocity*third_velo))
-                else:
-                    midifile.addNote(0, 0, chord[1]+trans_val, time + 0, duration,  int(velocity*second_velo))
-                    midifile.addNote(0, 0, chord[0]+trans_val, time + 0.25, duration,  int(velocity*first_velo))
-                    midifile.addNote(0, 0, chord[1]+trans_val, time + 0.5, duration,  int(velocity*second_velo))
-                    midifile.addNote(0, 0, chord[2]+trans_val, time + 0.75, duration,  int(velocity*third_velo))
-                    midifile.addNote(0, 0, chord[3]+trans_val, time + 1, duration,  int(velocity*fourth_velo))
-                    midifile.addNote(0, 0, chord[2]+trans_val, time + 1.5, duration,  int(velocity*third_velo))
-                
-                if len(chord) == 5:
-                    midifile.addNote(0, 0, chord[4]+trans_val, time + 2, duration,  int(velocity*fifth_velo))
-        elif density_val == 4:
-            if len(chord) >= 4:
-                if chord_offset % 2 == 0:
-                    midifile.addNote(0, 0, chord[0]+trans_val, time + 0, duration,  int(velocity*first_velo))
-                    midifile.addNote(0, 0, chord[1]+trans_val, time + 0.25, duration,  int(velocity*second_velo))
-                    midifile.addNote(0, 0, chord[2]+trans_val, time + 0.5, duration,  int(velocity*third_velo))
-                    midifile.addNote(0, 0, chord[1]+trans_val, time + 0.75, duration,  int(velocity*second_velo))
-                    midifile.addNote(0, 0, chord[3]+trans_val, time + 1, duration,  int(velocity*fourth_velo))
-                    midifile.addNote(0, 0, chord[2]+trans_val, time + 1.25, duration,  int(velocity*third_velo))
-                    midifile.addNote(0, 0, chord[1]+trans_val, time + 1.5, duration,  int(velocity*second_velo))
-                    midifile.addNote(0, 0, chord[2]+trans_val, time + 1.75, duration,  int(velocity*third_velo))
-                else:
-                    midifile.addNote(0, 0, chord[1]+trans_val, time + 0, duration,  int(velocity*second_velo))
-                    midifile.addNote(0, 0, chord[0]+trans_val, time + 0.25, duration,  int(velocity*first_velo))
-                    midifile.addNote(0, 0, chord[1]+trans_val, time + 0.5, duration,  int(velocity*second_velo))
-                    midifile.addNote(0, 0, chord[2]+trans_val, time + 0.75, duration,  int(velocity*third_velo))
-                    midifile.addNote(0, 0, chord[3]+trans_val, time + 1, duration,  int(velocity*fourth_velo))
-                    midifile.addNote(0, 0, chord[2]+trans_val, time + 1.25, duration,  int(velocity*third_velo))
-                    midifile.addNote(0, 0, chord[1]+trans_val, time + 1.5, duration,  int(velocity*second_velo))
-                    midifile.addNote(0, 0, chord[2]+trans_val, time + 1.75, duration,  int(velocity*third_velo))
-                
-                if len(chord) == 5:
-                    midifile.addNote(0, 0, chord[4]+trans_val, time + 2, duration,  int(velocity*fifth_velo))
-    else:
-        if len(chord) >= 4:
-            midifile.addNote(0, 0, chord[0] + trans_val, time, duration, int(velocity*first_velo*diminish_velo))
-            midifile.addNote(0, 0, chord[1] + trans_val, time, duration, int(velocity*second_velo*diminish_velo))
-            midifile.addNote(0, 0, chord[2] + trans_val, time, duration, int(velocity*third_velo*diminish_velo))
-            midifile.addNote(0, 0, chord[3] + trans_val, time, duration, int(velocity*fourth_velo*diminish_velo))
-            if len(chord) == 5:
-                midifile.addNote(0, 0, chord[4] + trans_val, time, duration, int(velocity*fifth_velo*diminish_velo))
+class FeatureExtractorPool:
+    """
+    Video feature extractors of Video2music.prepare, loaded once and shared by all requests.
+        clip      CLIP ViT-L/14@336px, (model, preprocess), semantic and emotion features. The normalized
+                  text features of EMOTION_LABELS are computed once, see emotion_text_features
+        maxvit    MaxViT-T pooled to 512-d, (model, transform), motion features (option 1)
+    With lazy=False every extractor is loaded in the constructor, otherwise on first use. Frames are
+    preprocessed by num_workers threads (see preprocess_frames) and encoded batch_size at a time.
+    warmup() runs one dummy frame through each extractor so the first request is not a cold start.
+    Load, warm-up and inference time are accumulated per extractor, see print_stats.
+    """
+    EXTRACTORS = ("clip", "maxvit")
+
+    def __init__(self, device=None, lazy=False, batch_size=32, num_workers=4):
+        self.device = torch.device(device) if device is not None else get_device()
+        self.batch_size = batch_size
+        self.num_workers = num_workers
+
+        self._models = {}
+        self._emotion_text_features = None
+        self._lock = threading.Lock()
+
+        self.load_time = {name: 0.0 for name in self.EXTRACTORS}
+        self.warmup_time = {name: 0.0 for name in self.EXTRACTORS}
+        self.inference_time = {name: 0.0 for name in self.EXTRACTORS}
+        self.num_calls = {name: 0 for name in self.EXTRACTORS}
+
+        if not lazy:
+            for name in self.EXTRACTORS:
+                self.get(name)
+
+    def get(self, name):
+        extractor = self._models.get(name)
+        if extractor is None:
+            with self._lock:
+                extractor = self._models.get(name)
+                if extractor is None:
+                    start = time.perf_counter()
+                    extractor = getattr(self, "_load_" + name)()
+                    self.load_time[name] = time.perf_counter() - start
+                    self._models[name] = extractor
+        return extractor
+
+    def emotion_text_features(self):
+        # (6, 768) normalized CLIP text features of EMOTION_LABELS, as used by model(image, text)
+        if self._emotion_text_features is None:
+            model, _ = self.get("clip")
+            with self._lock:
+                if self._emotion_text_features is None:
+                    with torch.no_grad():
+                        text_features = model.encode_text(clip.tokenize(EMOTION_LABELS).to(self.device))
+                    self._emotion_text_features = text_features / text_features.norm(dim=-1, keepdim=True)
+        return self._emotion_text_features
+
+    def _load_clip(self):
+        model, preprocess = clip.load("ViT-L/14@336px", device=self.device)
+        model.eval()
+        return model, preprocess
+
+    def _load_maxvit(self):
+        model = models.maxvit_t(weights=models.MaxVit_T_Weights.DEFAULT)
+        model.classifier = torch.nn.Sequential(
+            torch.nn.AdaptiveAvgPool2d(1),
+            torch.nn.Flatten()
+        )
+        model = model.to(self.device)
+        model.eval()
+        transform = models.MaxVit_T_Weights.IMAGENET1K_V1.transforms()
+        return model, transform
+
+    def _synchronize(self):
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+
+    def add_inference_time(self, name, start):
+        # Time since start (time.perf_counter) as one inference call of extractor name
+        self._synchronize()
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.inference_time[name] += elapsed
+            self.num_calls[name] += 1
+
+    def warmup(self):
+        # One dummy frame per extractor, loads the extractors of a lazy pool as well
+        frame = Image.new("RGB", (336, 336))
+        with torch.no_grad():
+            model, preprocess = self.get("clip")
+            start = time.perf_counter()
+            image = preprocess(frame).unsqueeze(0).to(self.device)
+            self.emotion_text_features()
+            model.encode_image(image)
+            self._synchronize()
+            self.warmup_time["clip"] = time.perf_counter() - start
+
+            model, transform = self.get("maxvit")
+            start = time.perf_counter()
+            model(transform(frame).unsqueeze(0).to(self.device))
+            self._synchronize()
+            self.warmup_time["maxvit"] = time.perf_counter() - start
+
+    def print_stats(self):
+        print("%8s %10s %12s %16s %8s %18s" % ("extractor", "load (s)", "warm-up (s)", "inference (s)", "calls", "per call (s)"))
+        for name in self.EXTRACTORS:
+            per_call = self.inference_time[name] / self.num_calls[name] if self.num_calls[name] > 0 else 0.0
+            print("%8s %10.2f %12.2f %16.2f %8d %18.3f" % (name, self.load_time[name], self.warmup_time[name],
+                                                          self.inference_time[name], self.num_calls[name], per_call))
 
 class Video2music:
     def __init__(
@@ -647,6 +525,7 @@ class Video2music:
                         rms_norm=args.rms_norm, scene_embed=args.scene_embed, chord_embed=args.chord_embed).to(get_device())
                   
         self.model.load_state_dict(torch.load(self.model_weights, map_location=get_device()))
+        set_attention_backend(self.model, args.attn_backend)
 
         self.modelReg = VideoRegression(n_layers=args.n_layers_reg, d_model=args.d_model_reg, d_hidden=args.dim_feedforward_reg, use_KAN=args.use_KAN_reg, max_sequence_video=args.max_sequence_video, total_vf_dim=self.total_vf_dim_reg, regModel=args.regModel).to(get_device())        
         self.modelReg.load_state_dict(torch.load(self.modelReg_weights, map_location=get_device()))
@@ -656,110 +535,88 @@ class Video2music:
         self.model.eval()
         self.modelReg.eval()
 
+        # Feature extractors (CLIP, MaxViT) shared by all requests
+        self.extractors = FeatureExtractorPool(get_device(), lazy=args.lazy_extractors, batch_size=args.extract_batch_size,
+                                               num_workers=args.extract_workers)
+        if not args.lazy_extractors:
+            self.extractors.warmup()
+            self.extractors.print_stats()
+
         self.SF2_FILE = "soundfonts/default_sound_font.sf2"
+        # FluidSynth workers, each soundfont stays loaded in one of them
+        self.soundfont_pool = SoundfontRenderPool(num_workers=args.render_workers)
+        self.mux_mode = args.mux
+        # Per-request directories, intermediate files only with -export_dir
+        self.workspaces = WorkspaceManager(export_root=args.export_dir, ttl=args.workspace_ttl)
 
-    def generate(self, video, primer=None, key=None, transposition_value=0, custom_sound_font=False, temperature=1.0):
-        feature_dir = Path("./feature")
-        output_dir = Path("./output")
-        if feature_dir.exists():
-            shutil.rmtree(str(feature_dir))
-        if output_dir.exists():
-            shutil.rmtree(str(output_dir))
-        
-        feature_dir.mkdir(parents=True)
-        output_dir.mkdir(parents=True)
-        
-        frame_dir = feature_dir / "vevo_frame"
-
-        #video features
-        semantic_dir = feature_dir / "vevo_semantic"
-        emotion_dir = feature_dir / "vevo_emotion"
-        scene_dir = feature_dir / "vevo_scene"
-        scene_offset_dir = feature_dir / "vevo_scene_offset"
-        motion_dir = feature_dir / "vevo_motion"
-
-        frame_dir.mkdir(parents=True)
-        semantic_dir.mkdir(parents=True)
-        emotion_dir.mkdir(parents=True)
-        scene_dir.mkdir(parents=True)
-        scene_offset_dir.mkdir(parents=True)
-        motion_dir.mkdir(parents=True)
-        
-        #music features
-        chord_dir = feature_dir / "vevo_chord"
-        loudness_dir = feature_dir / "vevo_loudness"
-        note_density_dir = feature_dir / "vevo_note_density"
-        
-        chord_dir.mkdir(parents=True)
-        loudness_dir.mkdir(parents=True)
-        note_density_dir.mkdir(parents=True)
-
-        split_video_into_frames(video, frame_dir)
-        gen_semantic_feature(frame_dir, semantic_dir)
-        gen_emotion_feature(frame_dir, emotion_dir)
-        gen_scene_feature(video, scene_dir, frame_dir)
-        gen_scene_offset_feature(scene_dir, scene_offset_dir)
-        gen_motion_feature(video, motion_dir)
-
-        feature_scene_offset = get_scene_offset_feature(scene_offset_dir)
-        feature_motion = get_motion_feature(motion_dir)
-        feature_emotion = get_emotion_feature(emotion_dir)
-        feature_semantic = get_semantic_feature(semantic_dir)
+    def print_stats(self):
+        # Time accumulated over all requests so far by the feature extractors and the soundfont renders
+        self.extractors.print_stats()
+        self.soundfont_pool.print_stats()
 
-        # cuda
-        feature_scene_offset = feature_scene_offset.to(self.device)
-        feature_motion = feature_motion.to(self.device)
-        feature_emotion = feature_emotion.to(self.device)
+    def generate(self, video, primer=None, key=None, transposition_value=0, custom_sound_font=False, temperature=1.0):
+        # Every call works in its own workspace so concurrent callers do not overwrite each other.
+        # Returns the output video, which stays until the workspace expires (-workspace_ttl)
+        workspace = self.workspaces.create()
+        try:
+            return self._generate(video, workspace, primer, key, transposition_value, custom_sound_font, temperature)
+        except BaseException:
+            self.workspaces.release(workspace)
+            raise
 
-        feature_scene_offset = feature_scene_offset.unsqueeze(0)
-        feature_motion = feature_motion.unsqueeze(0)
-        feature_emotion = feature_emotion.unsqueeze(0)
+    def _generate(self, video, workspace, primer, key, transposition_value, custom_sound_font, temperature):
+        inputs = self.prepare(video, workspace, primer=primer, key=key)
 
-        feature_semantic = feature_semantic.to(self.device)
-        feature_semantic = torch.unsqueeze(feature_semantic, 0)
-        feature_semantic_list = feature_semantic.to(self.device)
+        with torch.set_grad_enabled(False):
+            chord_sequence = self.model.generate(feature_semantic_list=inputs["feature_semantic_list"],
+                                              feature_key=inputs["feature_key"],
+                                              feature_scene_offset=inputs["feature_scene_offset"],
+                                              feature_motion=inputs["feature_motion"],
+                                              feature_emotion=inputs["feature_emotion"],
+                                              primer = inputs["primer"],
+                                              primer_root = inputs["primer_root"],
+                                              primer_attr = inputs["primer_attr"],
+                                              target_seq_length = 300,
+                                              beam=0,
+                                              max_conseq_N= max_conseq_N,
+                                              max_conseq_chord = max_conseq_chord,
+                                              temperature=temperature)
 
-        emotion_idx = torch.argmax(feature_emotion.mean(dim=0))
-        if key != None:
-            key = key.strip()
-            if key[-3:] == 'min': # Minor
-                feature_key = torch.tensor([1]).float()
-            else: # Major
-                feature_key = torch.tensor([0]).float()
-        else: # Key is not given
-            if emotion_idx in (1, 2, 3): # Minor
-                key = 'A minor'
-                feature_key = torch.tensor([1]).float()
-            else: # Major
-                key = 'C major'
-                feature_key = torch.tensor([0]).float()
-        
-        feature_key = feature_key.to(self.device)
+            # Loudness, Note density, Instrument
+            ln_nd, inst = self.modelReg(
+                        inputs["feature_semantic_list"],
+                        inputs["feature_scene_offset"],
+                        inputs["feature_motion"],
+                        inputs["feature_emotion"])
 
-        with open('dataset/vevo_meta/chord.json') as json_file:
-            chordDic = json.load(json_file)
-        with open('dataset/vevo_meta/chord_inv.json') as json_file:
-            chordInvDic = json.load(json_file)
-        with open('dataset/vevo_meta/chord_root.json') as json_file:
-            chordRootDic = json.load(json_file)
-        with open('dataset/vevo_meta/chord_attr.json') as json_file:
-            chordAttrDic = json.load(json_file)
+        return self.render(video, workspace, inputs, chord_sequence[0], ln_nd, inst,
+                           transposition_value=transposition_value, custom_sound_font=custom_sound_font)
 
-        with open("dataset/vevo_meta/instrument_inv.json", "r") as file:
-            instrument_inv_dict = json.load(file)
+    def generate_batched(self, video, scheduler, primer=None, key=None, transposition_value=0, custom_sound_font=False, temperature=1.0):
+        # Server mode: same as generate, but the model forward is shared with the other pending videos of the scheduler.
+        workspace = self.workspaces.create()
+        try:
+            inputs = self.prepare(video, workspace, primer=primer, key=key)
+            chord_sequence, ln_nd, inst = scheduler.submit(inputs, temperature).result()
+            return self.render(video, workspace, inputs, chord_sequence, ln_nd, inst,
+                               transposition_value=transposition_value, custom_sound_font=custom_sound_font)
+        except BaseException:
+            self.workspaces.release(workspace)
+            raise
+
+    def parse_primer(self, primer):
+        # Chord symbols (e.g. "Am F C G") -> chord / root / attr id tensors
+        chord_vocab = get_chord_vocab()
+        chordDic = chord_vocab.chord_to_id
+        chordRootDic = chord_vocab.root_to_id
+        chordAttrDic = chord_vocab.attr_to_id
 
-        if primer == None or primer.strip() == "":
-            if emotion_idx in (1, 2, 3):
-                primer = "Am"
-            else:
-                primer = "C"
-        
         pChordList = primer.split()
 
         primerCID = []
         primerCID_root = []
         primerCID_attr = []
-        
+
         for pChord in pChordList:
             if len(pChord) > 1:
                 if pChord[1] == "b":
@@ -783,11 +640,11 @@ class Video2music:
                     pChord = pChord[0:type_idx] + ":maj7"
                 if pChord[type_idx+1:] == "":
                     pChord = pChord[0:type_idx]
-            
+
             print("pchord is ", pChord)
             chordID = chordDic[pChord]
             primerCID.append(chordID)
-            
+
             chord_arr = pChord.split(":")
             if len(chord_arr) == 1:
                 chordRootID = chordRootDic[chord_arr[0]]
@@ -798,7 +655,7 @@ class Video2music:
                 chordAttrID = chordAttrDic[chord_arr[1]]
                 primerCID_root.append(chordRootID)
                 primerCID_attr.append(chordAttrID)
-        
+
         primerCID = np.array(primerCID)
         primerCID = torch.from_numpy(primerCID)
         primerCID = primerCID.to(torch.long)
@@ -808,50 +665,154 @@ class Video2music:
         primerCID_root = torch.from_numpy(primerCID_root)
         primerCID_root = primerCID_root.to(torch.long)
         primerCID_root = primerCID_root.to(self.device)
-        
+
         primerCID_attr = np.array(primerCID_attr)
         primerCID_attr = torch.from_numpy(primerCID_attr)
         primerCID_attr = primerCID_attr.to(torch.long)
         primerCID_attr = primerCID_attr.to(self.device)
 
+        return primerCID, primerCID_root, primerCID_attr
+
+    def prepare(self, video, workspace, primer=None, key=None):
+        # Feature extraction, key / primer selection and emotion smoothing for one video.
+        # Returns the model inputs (batch size 1) plus the chosen key, see generate / BatchScheduler.
+        # Features stay in memory, they are written to the export directory of the workspace if there is one.
+        # 1-fps frames straight from an ffmpeg pipe, no frame images on disk
+        semantic, emotion_probs = gen_semantic_emotion_feature(read_frames_1fps(video), self.extractors)
+        scene_ids = gen_scene_feature(video, len(semantic))
+        scene_offsets = gen_scene_offset_feature(scene_ids)
+        motion = gen_motion_feature(video, self.extractors)
+        if workspace.export_dir is not None:
+            save_features(workspace, semantic, emotion_probs, scene_ids, scene_offsets, motion)
+
+        feature_scene_offset = get_scene_offset_feature(scene_offsets)
+        feature_motion = get_motion_feature(motion)
+        feature_emotion = get_emotion_feature(emotion_probs)
+        feature_semantic = get_semantic_feature(semantic)
+
+        # cuda
+        feature_scene_offset = feature_scene_offset.to(self.device)
+        feature_motion = feature_motion.to(self.device)
+        feature_emotion = feature_emotion.to(self.device)
+
+        feature_scene_offset = feature_scene_offset.unsqueeze(0)
+        feature_motion = feature_motion.unsqueeze(0)
+        feature_emotion = feature_emotion.unsqueeze(0)
+
+        feature_semantic = feature_semantic.to(self.device)
+        feature_semantic = torch.unsqueeze(feature_semantic, 0)
+        feature_semantic_list = feature_semantic.to(self.device)
+
+        emotion_idx = torch.argmax(feature_emotion.mean(dim=0))
+        if key != None:
+            key = key.strip()
+            if key[-3:] == 'min': # Minor
+                feature_key = torch.tensor([1]).float()
+            else: # Major
+                feature_key = torch.tensor([0]).float()
+        else: # Key is not given
+            if emotion_idx in (1, 2, 3): # Minor
+                key = 'A minor'
+                feature_key = torch.tensor([1]).float()
+            else: # Major
+                key = 'C major'
+                feature_key = torch.tensor([0]).float()
+
+        feature_key = feature_key.to(self.device)
+
+        if primer == None or primer.strip() == "":
+            if emotion_idx in (1, 2, 3):
+                primer = "Am"
+            else:
+                primer = "C"
+
+        primerCID, primerCID_root, primerCID_attr = self.parse_primer(primer)
+
         # self.model.eval()
         # self.modelReg.eval()
 
-        os.makedirs('logs', exist_ok=True)
-        np.save("logs/feature_emotion_before.npy", feature_emotion.cpu().numpy())
+        if workspace.export_dir is not None:
+            np.save(workspace.export_path("logs", "feature_emotion_before.npy"), feature_emotion.cpu().numpy())
         # feature_emotion = feature_emotion.permute(0, 2, 1)
         # window_size = 5
         # avg_kernel = torch.ones(1, 1, window_size).to(get_device()) / window_size
         # feature_emotion = torch.nn.functional.conv1d(feature_emotion, avg_kernel, padding=window_size//2)
         # feature_emotion = feature_emotion.permute(0, 2, 1)
-        feature_emotion = feature_emotion.permute(0, 2, 1)  # (1, 6, 300)       
+        feature_emotion = feature_emotion.permute(0, 2, 1)  # (1, 6, 300)
         window_size = 5
         avg_kernel = torch.ones(6, 1, window_size).to(get_device()) / window_size
-        feature_emotion = torch.nn.functional.conv1d(feature_emotion, avg_kernel, padding=window_size//2, groups=6)        
-        feature_emotion = feature_emotion.permute(0, 2, 1) # (1, 300, 6)        
+        feature_emotion = torch.nn.functional.conv1d(feature_emotion, avg_kernel, padding=window_size//2, groups=6)
+        feature_emotion = feature_emotion.permute(0, 2, 1) # (1, 300, 6)
+
+        return {
+            "feature_semantic_list": feature_semantic_list,
+            "feature_key": feature_key,
+            "feature_scene_offset": feature_scene_offset,
+            "feature_motion": feature_motion,
+            "feature_emotion": feature_emotion,
+            "primer": primerCID,
+            "primer_root": primerCID_root,
+            "primer_attr": primerCID_attr,
+            "key": key,
+        }
+
+    def infer_batch(self, inputs_list, temperature_list):
+        # One batched forward of the chord transformer and VideoRegression for several prepared videos.
+        # All primers must have the same length. Returns (chord_sequence, ln_nd, inst) per video,
+        # shaped as in generate: (seq_len,), (1, video_len, 2), (1, video_len, 40).
+        video_lens = [inputs["feature_semantic_list"].shape[1] for inputs in inputs_list]
+
+        feature_semantic_list = pad_and_stack([inputs["feature_semantic_list"] for inputs in inputs_list], SEMANTIC_PAD)
+        feature_scene_offset = pad_and_stack([inputs["feature_scene_offset"] for inputs in inputs_list], SCENE_OFFSET_PAD)
+        feature_motion = pad_and_stack([inputs["feature_motion"] for inputs in inputs_list], MOTION_PAD)
+        feature_emotion = pad_and_stack([inputs["feature_emotion"] for inputs in inputs_list], EMOTION_PAD)
+        feature_key = torch.stack([inputs["feature_key"].reshape(1) for inputs in inputs_list], dim=0)
+        primer = torch.stack([inputs["primer"] for inputs in inputs_list], dim=0)
+        primer_root = torch.stack([inputs["primer_root"] for inputs in inputs_list], dim=0)
+        primer_attr = torch.stack([inputs["primer_attr"] for inputs in inputs_list], dim=0)
+        temperature = torch.tensor(temperature_list, dtype=torch.float32)
 
         with torch.set_grad_enabled(False):
-            chord_sequence = self.model.generate(feature_semantic_list=feature_semantic_list, 
-                                              feature_key=feature_key, 
+            chord_sequence = self.model.generate_batch(feature_semantic_list=feature_semantic_list,
+                                              feature_key=feature_key,
                                               feature_scene_offset=feature_scene_offset,
                                               feature_motion=feature_motion,
                                               feature_emotion=feature_emotion,
-                                              primer = primerCID, 
-                                              primer_root = primerCID_root,
-                                              primer_attr = primerCID_attr,
-                                              target_seq_length = 300, 
-                                              beam=0,
+                                              primer = primer,
+                                              primer_root = primer_root,
+                                              primer_attr = primer_attr,
+                                              num_samples = len(inputs_list),
+                                              target_seq_length = 300,
                                               max_conseq_N= max_conseq_N,
                                               max_conseq_chord = max_conseq_chord,
                                               temperature=temperature)
-            
+
             # Loudness, Note density, Instrument
             ln_nd, inst = self.modelReg(
-                        feature_semantic_list, 
+                        feature_semantic_list,
                         feature_scene_offset,
                         feature_motion,
                         feature_emotion)
-        
+
+        results = []
+        for i, video_len in enumerate(video_lens):
+            # A row that ended early is followed by CHORD_PAD
+            seq = chord_sequence[i]
+            seq_len = (seq >= CHORD_END).nonzero()
+            seq = seq[:seq_len[0, 0]] if len(seq_len) > 0 else seq
+            results.append((seq, ln_nd[i:i+1, :video_len], inst[i:i+1, :video_len]))
+        return results
+
+    def render(self, video, workspace, inputs, chord_sequence, ln_nd, inst, transposition_value=0, custom_sound_font=False):
+        # Model outputs of one video -> MIDI and audio (in memory) and the output video in the workspace.
+        # MIDI files, instruments and audio go to the export directory of the workspace if there is one
+        key = inputs["key"]
+        feature_emotion = inputs["feature_emotion"]
+
+        with open("dataset/vevo_meta/instrument_inv.json", "r") as file:
+            instrument_inv_dict = json.load(file)
+
+        with torch.set_grad_enabled(False):
             ln_nd   = ln_nd.reshape(ln_nd.shape[0] * ln_nd.shape[1], -1)
 
             y_note_density, y_loudness = torch.split(ln_nd, split_size_or_sections=1, dim=1)
@@ -868,8 +829,8 @@ class Video2music:
             # avg_kernel = torch.ones(1, 1, window_size).to(get_device()) / window_size
             # feature_emotion = torch.nn.functional.conv1d(feature_emotion, avg_kernel, padding=window_size//2)
             # feature_emotion = feature_emotion.permute(1, 0, 2).squeeze()
-            os.makedirs('logs', exist_ok=True)
-            np.save("logs/feature_emotion.npy", feature_emotion.cpu().numpy())
+            if workspace.export_dir is not None:
+                np.save(workspace.export_path("logs", "feature_emotion.npy"), feature_emotion.cpu().numpy())
             emotion_indice = torch.argmax(feature_emotion.squeeze(), dim=1).cpu()
 
             velolistExp = []
@@ -889,7 +850,7 @@ class Video2music:
                     velocity_exp += -1
 
                 velolistExp.append(velocity_exp)
-            
+
             densitylist = []
             for i, item in enumerate(y_note_density_np):
                 density = item[0]
@@ -911,32 +872,28 @@ class Video2music:
                     densitylist.append(3)
                 else:
                     densitylist.append(4)
-            
+
             # generated ChordID to ChordSymbol
-            chord_genlist = []
-            chordID_genlist= chord_sequence[0].cpu().numpy()
-            for index in chordID_genlist:
-                chord_genlist.append(chordInvDic[str(index)])
-            
+            chord_genlist = get_chord_vocab().chord_names(chord_sequence.cpu().numpy())
+
             chord_offsetlist = convert_format_id_to_offset(chord_genlist)
-            f_path_midi = output_dir / "output.mid"
-            f_path_flac = output_dir / "output.flac"
-            f_path_video_out = output_dir / "output.mp4"
+            f_path_video_out = workspace.path / "output.mp4"
 
             # ChordSymbol to MIDI file with voicing
             inst = inst.squeeze(0) # inst shape = (300, 40)
             inst = torch.where(inst >= 0.35, 1.0, 0.0)
             # Save instrument file
-            df = pd.DataFrame(inst.cpu().numpy())
-            df.to_csv(os.path.join(output_dir, "inst.csv"), index=False)                
-            
+            if workspace.export_dir is not None:
+                df = pd.DataFrame(inst.cpu().numpy())
+                df.to_csv(workspace.export_path("inst.csv"), index=False)
+
             num_inst = inst.shape[1]
 
             midi_list = [MIDIFile(1) for _ in range(num_inst)] # For instrument rendering
-            
+
             generated_midi = MIDIFile(1) # For saving midi file
             generated_midi.addTempo(0, 0, base_tempo)
-            
+
             midi_chords_orginal = []
             for index, k in enumerate(chord_genlist):
                 k = k.replace(":", "")
@@ -951,103 +908,151 @@ class Video2music:
             else:
                 trans = transposition_value
 
-            choosed_instrument = set()
+            # Note events of all tracks at once, chord i starts at i * duration
+            n_chords = len(midi_chords)
+            pitches, lengths = chord_pitch_table(midi_chords)
+            velocities = np.asarray(velolistExp[:n_chords], dtype=np.float64)
+            inst_ids = np.arange(num_inst)
+            arpeggio_chord = np.isin(emotion_indice[:n_chords].numpy(), (0, 1, 2)) # Exciting, Fearful, Tense
+            arpeggio_chord = arpeggio_chord | np.isin(inst_ids, arpeggio_instrument_list)[:, None]
+            velocity = velocities * np.where(np.isin(inst_ids, low_velocity_instrument_list), 1.15, 1.0)[:, None]
+            active = (inst[:n_chords].cpu().numpy() == 1.0).T
+
+            # For generated_midi
+            add_note_events(generated_midi, note_events(pitches, lengths, chord_offsetlist[:n_chords],
+                                                        densitylist[:n_chords], velocities, True, duration), duration)
+
             # For multi_track_midi
-            for inst_id in range(num_inst):
+            events = note_events(pitches, lengths, chord_offsetlist[:n_chords], densitylist[:n_chords], velocity,
+                                 arpeggio_chord, duration, active=active)
+            choosed_instrument = set(np.flatnonzero(active.any(axis=1)).tolist())
+            for inst_id, inst_events in enumerate(split_tracks(events, num_inst)):
                 midi_list[inst_id].addTempo(0, 0, tempo_instrument[inst_id])
+                midi_list[inst_id].addControllerEvent(0, 0, 0, instrument_panning(inst_id), 0)
+                add_note_events(midi_list[inst_id], inst_events, duration)
 
-                if inst_id in left_panning_instrument_list:
-                    panning_val = left_panning_val
-                elif inst_id in center_panning_instrument_list:
-                    panning_val = center_panning_val
-                else:
-                    panning_val = right_panning_val
-
-                midi_list[inst_id].addControllerEvent(0, 0, 0, panning_val, 0)
-
-                for i, chord in enumerate(midi_chords):
-                    # For generated_midi
-                    if inst_id == 0:
-                        # print(chord)
-                        addChord(generated_midi, chord, chord_offsetlist[i], densitylist[i], trans, 
-                                 i * duration, duration, velolistExp[i], emotion_indice[i], 
-                                 arpeggio_chord=True)
-                    
-                    # For multi_track_midi
-                    if inst[i, inst_id] == 1.0:
-                        arpeggio_chord = inst_id in arpeggio_instrument_list
-                        arpeggio_chord |= emotion_indice[i] in (0, 1, 2) # Exciting, Fearful, Tense
-
-                        velocity = velolistExp[i] * (1.15 if inst_id in low_velocity_instrument_list else 1.0)
-
-                        choosed_instrument.add(inst_id)
-
-                        addChord(midi_list[inst_id], chord, chord_offsetlist[i], densitylist[i], 
-                                 trans, i * duration, duration, velocity, emotion_indice[i], 
-                                 arpeggio_chord=arpeggio_chord)
-                                    
             # Save generated_midi file
-            with open(f_path_midi, "wb") as outputFile:
-                generated_midi.writeFile(outputFile)
-     
-            # Convert midi to audio (e.g., flac)
+            generated_midi_bytes = midi_to_bytes(generated_midi)
+            if workspace.export_dir is not None:
+                workspace.export_path("output.mid").write_bytes(generated_midi_bytes)
+
+            # Convert midi to audio, rendered in the soundfont pool
             if custom_sound_font == False:
-                fs = FluidSynth(sound_font=self.SF2_FILE)
-                fs.midi_to_audio(str(f_path_midi), str(f_path_flac))
+                jobs = {"default": (generated_midi_bytes, self.SF2_FILE)}
+                pans = {"default": center_panning_val}
             else:
-                flac_files = []
-                for inst_id in choosed_instrument:
-                    if inst_id not in replace_instrument_index_dict.keys():                        
+                jobs = {}
+                pans = {}
+                for inst_id in sorted(choosed_instrument):
+                    if inst_id not in replace_instrument_index_dict.keys():
                         instrument_name = instrument_inv_dict[str(inst_id)]
-                        print(inst_id, instrument_name)
                         filename = f"{str(inst_id)}_{instrument_name}.sf2"
-                        f_path_midi_instrument = os.path.join(output_dir, f"output_{instrument_name}.mid")
+                        midi_bytes = midi_to_bytes(midi_list[inst_id])
 
                         # Save single-tracks MIDI file
-                        with open(f_path_midi_instrument, "wb") as outputFile:
-                            midi_list[inst_id].writeFile(outputFile)
-                    
-                        f_path_sf = os.path.join("soundfonts", filename)
-                        flac_output = os.path.join(output_dir, f"output_{instrument_name}.flac")
-                        fs = FluidSynth(sound_font=f_path_sf)
-                        fs.midi_to_audio(str(f_path_midi_instrument), str(flac_output))
-                        flac_files.append(flac_output)
-
-                # # base_audio_index = 5
-                # # mixed = AudioSegment.from_file(flac_files[base_audio_index])
-                # mixed = AudioSegment.from_file(flac_files[0])
-                # for i, audio_path in enumerate(flac_files):
-                #     # if base_audio_index == i:
-                #         # continue
-                #     mixed = mixed.overlay(AudioSegment.from_file(audio_path))
-                # mixed.export(f_path_flac, format="flac")
-
-                # Find the longest FLAC file
-                longest_flac = find_longest_flac_file(flac_files)
-                mixed = AudioSegment.from_file(longest_flac)
-                for audio_path in flac_files:
-                    if audio_path != longest_flac:
-                        mixed = mixed.overlay(AudioSegment.from_file(audio_path))
-                mixed.export(f_path_flac, format="flac")
-
-            # Render generated music into input video
-            audio_mp = mp.AudioFileClip(str(f_path_flac))
-            video_mp = mp.VideoFileClip(str(video))
-
-            assert video_mp.duration > 0 and audio_mp.duration > 0
-            ###
-            clip_duration = min(video_mp.duration, audio_mp.duration)
-            audio_mp = audio_mp.subclip(0, clip_duration)
-            ###            
-            ###
-            # audio_mp = audio_mp.subclip(0, video_mp.duration)
-            ###
-            final = video_mp.set_audio(audio_mp)
-
-            final.write_videofile(str(f_path_video_out), 
-                codec='libx264', 
-                audio_codec='aac', 
-                temp_audiofile='temp-audio.m4a', 
-                remove_temp=True
-            )
+                        if workspace.export_dir is not None:
+                            workspace.export_path(f"output_{instrument_name}.mid").write_bytes(midi_bytes)
+                        jobs[f"{inst_id}_{instrument_name}"] = (midi_bytes, os.path.join("soundfonts", filename))
+                        pans[f"{inst_id}_{instrument_name}"] = instrument_panning(inst_id)
+
+            render_times = {}
+            pcms = self.soundfont_pool.render_many(jobs, times=render_times)
+            for name, seconds in render_times.items():
+                print("rendered %s in %.2fs" % (name, seconds))
+
+            # Sum of the tracks, each panned by instrument_panning (the default soundfont track centered)
+            names = list(pcms)
+            mixed = mix_tracks([pcms[name] for name in names], pan_gains([pans[name] for name in names]))
+            if workspace.export_dir is not None:
+                write_audio(workspace.export_path("output.flac"), mixed, self.soundfont_pool.sample_rate)
+
+            # Render generated music into input video, the audio is piped to ffmpeg
+            start = time.perf_counter()
+            mode = mux_video(video, mixed, f_path_video_out, sample_rate=self.soundfont_pool.sample_rate,
+                             mode=self.mux_mode)
+            print("muxed %s (%s) in %.2fs" % (f_path_video_out, mode, time.perf_counter() - start))
             return Path(str(f_path_video_out))
+
+class BatchScheduler:
+    """
+    Request batching for server mode.
+    Callers submit the prepared inputs of one video (Video2music.prepare) and get a Future back.
+    A worker thread collects pending requests with the same primer length and runs them through
+    Video2music.infer_batch as one batched forward, as soon as max_batch_size requests are pending
+    or the oldest one has waited max_wait_time seconds.
+    """
+    def __init__(self, video2music, max_batch_size=8, max_wait_time=0.05):
+        self.video2music = video2music
+        self.max_batch_size = max_batch_size
+        self.max_wait_time = max_wait_time
+
+        self._cond = threading.Condition()
+        self._pending = []
+        self._closed = False
+
+        self.num_batches = 0
+        self.num_requests = 0
+
+        self._worker = threading.Thread(target=self._run, name="BatchScheduler", daemon=True)
+        self._worker.start()
+
+    def submit(self, inputs, temperature=1.0):
+        future = Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("BatchScheduler is closed")
+            self._pending.append((time.monotonic(), inputs, temperature, future))
+            self._cond.notify()
+        return future
+
+    def close(self):
+        # Pending requests are still served before the worker stops
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._worker.join()
+
+    def _next_batch(self):
+        with self._cond:
+            while True:
+                if len(self._pending) >= self.max_batch_size or (self._pending and self._closed):
+                    break
+                if self._pending:
+                    remaining = self._pending[0][0] + self.max_wait_time - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                elif self._closed:
+                    return []
+                else:
+                    self._cond.wait()
+
+            # The oldest request decides the primer length of the batch
+            num_primer = self._pending[0][1]["primer"].shape[-1]
+            batch, rest = [], []
+            for request in self._pending:
+                if len(batch) < self.max_batch_size and request[1]["primer"].shape[-1] == num_primer:
+                    batch.append(request)
+                else:
+                    rest.append(request)
+            self._pending = rest
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if len(batch) == 0:
+                return
+
+            try:
+                results = self.video2music.infer_batch([request[1] for request in batch],
+                                                       [request[2] for request in batch])
+            except Exception as e:
+                for request in batch:
+                    request[3].set_exception(e)
+                continue
+
+            self.num_batches += 1
+            self.num_requests += len(batch)
+            for request, result in zip(batch, results):
+                request[3].set_result(result)